@@ -0,0 +1,36 @@
+"""seed_state
+
+Revision ID: 3b8e5f0a6c92
+Revises: e4a7c1d95b20
+Create Date: 2026-10-17 16:48:55.903126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b8e5f0a6c92'
+down_revision: Union[str, Sequence[str], None] = 'e4a7c1d95b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Checksums of applied seed datasets (seed_data.py skips unchanged ones)
+    op.create_table(
+        'seed_state',
+        sa.Column('dataset', sa.Text(), primary_key=True),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('checksum', sa.Text(), nullable=False),
+        sa.Column('row_count', sa.Integer(), nullable=True),
+        sa.Column('applied_at', sa.DateTime(timezone=True), server_default=sa.text('now()')),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('seed_state')
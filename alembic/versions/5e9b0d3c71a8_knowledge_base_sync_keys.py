@@ -0,0 +1,48 @@
+"""knowledge_base_sync_keys
+
+Revision ID: 5e9b0d3c71a8
+Revises: a1c4e7f20b93
+Create Date: 2026-10-17 10:03:55.402117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e9b0d3c71a8'
+down_revision: Union[str, Sequence[str], None] = 'a1c4e7f20b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Stable row key + content hash for incremental (diff-based) sync.
+    # Default key/hash is md5(category || 0x1f || content), same as sync_knowledge.row_hash().
+    op.add_column('knowledge_base', sa.Column('kb_key', sa.String(length=64), nullable=True))
+    op.add_column('knowledge_base', sa.Column('content_hash', sa.String(length=32), nullable=True))
+
+    op.execute("""
+        UPDATE knowledge_base
+        SET content_hash = md5(coalesce(category, '') || chr(31) || content),
+            kb_key = md5(coalesce(category, '') || chr(31) || content)
+    """)
+    # Exact duplicates would collide on the unique key; keep the oldest
+    op.execute("""
+        DELETE FROM knowledge_base a USING knowledge_base b
+        WHERE a.kb_key = b.kb_key AND a.id > b.id
+    """)
+
+    op.alter_column('knowledge_base', 'kb_key', nullable=False)
+    op.alter_column('knowledge_base', 'content_hash', nullable=False)
+    op.create_index('ux_knowledge_base_kb_key', 'knowledge_base', ['kb_key'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ux_knowledge_base_kb_key', table_name='knowledge_base')
+    op.drop_column('knowledge_base', 'content_hash')
+    op.drop_column('knowledge_base', 'kb_key')
@@ -0,0 +1,37 @@
+"""shared_state_table
+
+Revision ID: 9d2f6b8e4a17
+Revises: c82f4a19d6e0
+Create Date: 2026-10-17 14:02:41.518230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d2f6b8e4a17'
+down_revision: Union[str, Sequence[str], None] = 'c82f4a19d6e0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Key/value store for SHARED_STATE_BACKEND=postgres (see shared_state.py).
+    # UNLOGGED: it only holds short-lived coordination data, so skip the WAL.
+    op.execute("""
+        CREATE UNLOGGED TABLE shared_state (
+            key text PRIMARY KEY,
+            value text,
+            expires_at timestamptz
+        )
+    """)
+    op.create_index('ix_shared_state_expires_at', 'shared_state', ['expires_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_shared_state_expires_at', table_name='shared_state')
+    op.drop_table('shared_state')
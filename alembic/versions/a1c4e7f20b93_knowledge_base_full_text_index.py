@@ -0,0 +1,85 @@
+"""knowledge_base_full_text_index
+
+Revision ID: a1c4e7f20b93
+Revises: 7304d3eebf55
+Create Date: 2026-10-17 09:12:40.118204
+
+"""
+import re
+import unicodedata
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1c4e7f20b93'
+down_revision: Union[str, Sequence[str], None] = '7304d3eebf55'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Frozen copy of text_utils.search_text as of this revision: the backfill must
+# not change (or break) when the app's tokenizer is edited or moved later.
+_MY_SYLLABLE_BREAK = re.compile(
+    "(?<!\u1039)[\u1000-\u1021](?![\u103a\u1039])"
+    "|[\u1023-\u1027\u1029\u102a\u103f\u104c-\u104f\u1040-\u1049]"
+)
+_MY_RUN = re.compile("[\u1000-\u109f]+")
+_LATIN_WORD = re.compile(r"\d+(?:\.\d+)?[a-z]*|[a-z0-9]+")
+
+
+def _search_text(text):
+    """Latin words + Burmese syllables and syllable bigrams, space-joined."""
+    text = " ".join(unicodedata.normalize("NFC", text or "").lower().split())
+    tokens = _LATIN_WORD.findall(text)
+    for run in _MY_RUN.findall(text):
+        starts = [m.start() for m in _MY_SYLLABLE_BREAK.finditer(run)]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        bounds = starts + [len(run)]
+        syllables = [run[a:b] for a, b in zip(bounds, bounds[1:]) if run[a:b].strip()]
+        tokens.extend(syllables)
+        tokens.extend(a + b for a, b in zip(syllables, syllables[1:]))
+    return " ".join(tokens)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Pre-tokenized text (Burmese syllables + bigrams, Latin words) and its tsvector.
+    # Tokenization happens in Python (text_utils at runtime, the frozen copy
+    # above for this backfill), Postgres only indexes with 'simple'.
+    op.add_column('knowledge_base', sa.Column('search_text', sa.Text(), nullable=True))
+    op.add_column('knowledge_base', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+    op.create_index(
+        'ix_knowledge_base_search_vector', 'knowledge_base', ['search_vector'],
+        postgresql_using='gin'
+    )
+
+    # Backfill existing rows
+    conn = op.get_bind()
+    rows = conn.execute(sa.text("SELECT id, category, content FROM knowledge_base")).fetchall()
+    for row in rows:
+        conn.execute(
+            sa.text("""
+                UPDATE knowledge_base
+                SET search_text = :content_text,
+                    search_vector = setweight(to_tsvector('simple', :category_text), 'A')
+                                 || setweight(to_tsvector('simple', :content_text), 'B')
+                WHERE id = :id
+            """),
+            {
+                "id": row.id,
+                "category_text": _search_text(row.category or ""),
+                "content_text": _search_text(row.content),
+            }
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_knowledge_base_search_vector', table_name='knowledge_base')
+    op.drop_column('knowledge_base', 'search_vector')
+    op.drop_column('knowledge_base', 'search_text')
@@ -0,0 +1,57 @@
+"""broadcasts
+
+Revision ID: b9e3d5a7c140
+Revises: f7d21c6a9e34
+Create Date: 2026-10-17 20:31:07.204918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b9e3d5a7c140'
+down_revision: Union[str, Sequence[str], None] = 'f7d21c6a9e34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # One row per bulk message; `cursor` is the last user_id (in audience
+    # order) below which every chat has been handled, so a crashed run resumes there
+    op.create_table(
+        'broadcasts',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('source', sa.Text(), nullable=True, unique=True),   # e.g. 'kb:<content_hash>' for News rows
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('active_days', sa.Integer(), nullable=False, server_default='90'),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='pending'),
+        sa.Column('cursor', sa.Text(), nullable=True),
+        sa.Column('sent', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failed', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('blocked', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('owner', sa.Text(), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()')),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index('ix_broadcasts_status', 'broadcasts', ['status'])
+
+    # Chats that blocked the bot (403); skipped until they write again
+    op.create_table(
+        'blocked_chats',
+        sa.Column('user_id', sa.String(length=50), primary_key=True),
+        sa.Column('reason', sa.Text(), nullable=True),
+        sa.Column('blocked_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('blocked_chats')
+    op.drop_index('ix_broadcasts_status', table_name='broadcasts')
+    op.drop_table('broadcasts')
@@ -0,0 +1,32 @@
+"""chat_history_user_id_index
+
+Revision ID: c82f4a19d6e0
+Revises: 5e9b0d3c71a8
+Create Date: 2026-10-17 11:26:08.734561
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c82f4a19d6e0'
+down_revision: Union[str, Sequence[str], None] = '5e9b0d3c71a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Serves "WHERE user_id = $1 ORDER BY id DESC LIMIT n" (history cache misses)
+    op.create_index(
+        'ix_chat_history_user_id_id', 'chat_history',
+        ['user_id', sa.text('id DESC')]
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chat_history_user_id_id', table_name='chat_history')
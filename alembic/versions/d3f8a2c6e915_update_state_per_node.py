@@ -0,0 +1,45 @@
+"""update_state_per_node
+
+Revision ID: d3f8a2c6e915
+Revises: b9e3d5a7c140
+Create Date: 2026-10-18 10:12:44.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3f8a2c6e915'
+down_revision: Union[str, Sequence[str], None] = 'b9e3d5a7c140'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # One high-water mark per worker (CLUSTER_NODE_ID, '' for a single process);
+    # update_dedup loads the lowest, so one worker can't move another's mark
+    op.add_column('telegram_update_state',
+                  sa.Column('node_id', sa.Text(), nullable=False, server_default=''))
+    op.drop_constraint('telegram_update_state_pkey', 'telegram_update_state', type_='primary')
+    op.create_primary_key('telegram_update_state_pkey', 'telegram_update_state', ['bot_id', 'node_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("""
+        DELETE FROM telegram_update_state t
+        USING telegram_update_state lower
+        WHERE t.bot_id = lower.bot_id AND t.high_water > lower.high_water
+    """)
+    op.execute("""
+        DELETE FROM telegram_update_state t
+        USING telegram_update_state other
+        WHERE t.bot_id = other.bot_id AND t.high_water = other.high_water AND t.node_id > other.node_id
+    """)
+    op.drop_constraint('telegram_update_state_pkey', 'telegram_update_state', type_='primary')
+    op.drop_column('telegram_update_state', 'node_id')
+    op.create_primary_key('telegram_update_state_pkey', 'telegram_update_state', ['bot_id'])
@@ -0,0 +1,34 @@
+"""telegram_update_state
+
+Revision ID: e4a7c1d95b20
+Revises: 9d2f6b8e4a17
+Create Date: 2026-10-17 15:37:12.204417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a7c1d95b20'
+down_revision: Union[str, Sequence[str], None] = '9d2f6b8e4a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Per-bot update_id high-water mark for webhook/polling dedup (update_dedup.py)
+    op.create_table(
+        'telegram_update_state',
+        sa.Column('bot_id', sa.Text(), primary_key=True),
+        sa.Column('high_water', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()')),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('telegram_update_state')
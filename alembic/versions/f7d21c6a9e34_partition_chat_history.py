@@ -0,0 +1,123 @@
+"""partition_chat_history
+
+Revision ID: f7d21c6a9e34
+Revises: 3b8e5f0a6c92
+Create Date: 2026-10-17 19:12:40.518273
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7d21c6a9e34'
+down_revision: Union[str, Sequence[str], None] = '3b8e5f0a6c92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # chat_history -> monthly range partitions on "timestamp" with a BIGINT key.
+    # Old months can then be archived and dropped whole (chat_retention.py)
+    # instead of DELETEd row by row, and history reads only probe the
+    # (user_id, id DESC) index of the few retained partitions.
+    op.execute("ALTER TABLE chat_history RENAME TO chat_history_legacy")
+    # Constraint names are schema-wide: free chat_history_pkey for the new table
+    op.execute("ALTER TABLE chat_history_legacy RENAME CONSTRAINT chat_history_pkey TO chat_history_legacy_pkey")
+    op.execute("ALTER SEQUENCE chat_history_id_seq RENAME TO chat_history_legacy_id_seq")
+    op.execute("ALTER INDEX ix_chat_history_user_id_id RENAME TO ix_chat_history_legacy_user_id_id")
+
+    op.execute("CREATE SEQUENCE chat_history_id_seq AS bigint")
+    op.execute("""
+        CREATE TABLE chat_history (
+            id bigint NOT NULL DEFAULT nextval('chat_history_id_seq'),
+            user_id varchar(50),
+            role varchar(20),
+            message_text text,
+            "timestamp" timestamp NOT NULL DEFAULT now(),
+            CONSTRAINT chat_history_pkey PRIMARY KEY (id, "timestamp")
+        ) PARTITION BY RANGE ("timestamp")
+    """)
+    op.execute("ALTER SEQUENCE chat_history_id_seq OWNED BY chat_history.id")
+    op.execute('CREATE INDEX ix_chat_history_user_id_id ON chat_history (user_id, id DESC)')
+    # Catches rows outside the pre-created months (should stay empty)
+    op.execute("CREATE TABLE chat_history_default PARTITION OF chat_history DEFAULT")
+
+    # One partition per month from the oldest row to two months ahead
+    op.execute("""
+        DO $$
+        DECLARE
+            m date := date_trunc('month', COALESCE((SELECT min("timestamp") FROM chat_history_legacy), now()));
+            last date := date_trunc('month', now()) + interval '2 months';
+        BEGIN
+            WHILE m <= last LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF chat_history FOR VALUES FROM (%L) TO (%L)',
+                    'chat_history_y' || to_char(m, 'YYYY') || 'm' || to_char(m, 'MM'),
+                    m, m + interval '1 month'
+                );
+                m := m + interval '1 month';
+            END LOOP;
+        END $$
+    """)
+
+    op.execute("""
+        INSERT INTO chat_history (id, user_id, role, message_text, "timestamp")
+        SELECT id, user_id, role, message_text, COALESCE("timestamp", now())
+        FROM chat_history_legacy
+    """)
+    op.execute("SELECT setval('chat_history_id_seq', COALESCE((SELECT max(id) FROM chat_history), 0) + 1, false)")
+    op.execute("DROP TABLE chat_history_legacy")
+
+    # Compact per-day rollup that outlives the archived partitions
+    op.create_table(
+        'chat_daily_stats',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('user_messages', sa.Integer(), nullable=False),
+        sa.Column('assistant_messages', sa.Integer(), nullable=False),
+        sa.Column('active_chats', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()')),
+    )
+    # One row per archived (exported + dropped) partition
+    op.create_table(
+        'chat_history_archives',
+        sa.Column('partition', sa.Text(), primary_key=True),
+        sa.Column('range_start', sa.Date(), nullable=False),
+        sa.Column('range_end', sa.Date(), nullable=False),
+        sa.Column('row_count', sa.BigInteger(), nullable=False),
+        sa.Column('path', sa.Text(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('now()')),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('chat_history_archives')
+    op.drop_table('chat_daily_stats')
+
+    op.execute("ALTER TABLE chat_history RENAME TO chat_history_partitioned")
+    op.execute("ALTER TABLE chat_history_partitioned RENAME CONSTRAINT chat_history_pkey TO chat_history_partitioned_pkey")
+    op.execute("ALTER INDEX ix_chat_history_user_id_id RENAME TO ix_chat_history_partitioned_user_id_id")
+    op.execute("ALTER SEQUENCE chat_history_id_seq RENAME TO chat_history_partitioned_id_seq")
+    op.create_table(
+        'chat_history',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.String(length=50), nullable=True),
+        sa.Column('role', sa.String(length=20), nullable=True),
+        sa.Column('message_text', sa.Text(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id', name='chat_history_pkey')
+    )
+    op.execute("""
+        INSERT INTO chat_history (id, user_id, role, message_text, "timestamp")
+        SELECT id, user_id, role, message_text, "timestamp" FROM chat_history_partitioned
+    """)
+    op.execute("DROP TABLE chat_history_partitioned")
+    op.execute("SELECT setval('chat_history_id_seq', COALESCE((SELECT max(id) FROM chat_history), 0) + 1, false)")
+    op.create_index(
+        'ix_chat_history_user_id_id', 'chat_history',
+        ['user_id', sa.text('id DESC')]
+    )
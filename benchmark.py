@@ -0,0 +1,405 @@
+import os
+import re
+import sys
+import json
+import math
+import time
+import glob
+import random
+import socket
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from collections import deque
+
+# End-to-end load test / benchmark.
+#
+# Boots main:app in-process (uvicorn, full startup hook) against local fake
+# Bot API and OpenRouter servers with configurable latency and error rates,
+# and optionally a real Postgres (--database-url) or a throwaway one
+# (--ephemeral-db: initdb + pg_ctl + alembic upgrade head + seed). Synthetic
+# Burmese/English webhook traffic is fired at a fixed rate and the report has
+# end-to-end latency (webhook POST -> reply delivered) p50/p95/p99,
+# throughput, and DB round trips / LLM calls / Bot API calls per turn.
+#
+#   python benchmark.py --messages 500 --rate 25 --users 200
+#   python benchmark.py --ephemeral-db --save-baseline bench_baseline.json
+#   python benchmark.py --ephemeral-db --baseline bench_baseline.json   # exit 1 on regression
+
+BENCH_BOT_TOKEN = "123456:BENCH"
+
+# (weight, templates); {w}/{h}/{n} are filled with random numbers
+MESSAGE_MIX = [
+    (20, ["hi", "hello", "မင်္ဂလာပါ", "ဟိုင်း", "thanks", "ကျေးဇူးပါ"]),
+    (25, ["{w}W {h} hours", "I need {w} watts for {h} hours", "{w}W နဲ့ {h} နာရီ သုံးချင်တယ်",
+          "ရေခဲသေတ္တာ နဲ့ မီးချောင်း {n} ချောင်း {h} နာရီ", "aircon 1HP {h} hours backup"]),
+    (20, ["Growatt price", "6kW 48V inverter under 2M", "battery ဈေးဘယ်လောက်လဲ", "Jinko panel price",
+          "ဘက်ထရီ {n}0 သိန်းအောက်", "Deye inverter"]),
+    (20, ["Growatt error 04", "inverter error 08 ဘာဖြစ်တာလဲ", "မီးပျက်ချိန် ဘယ်လောက်လဲ", "grid schedule Yangon",
+          "voltage fluctuation 180V", "battery maintenance"]),
+    (15, ["What's the best system for an apartment?", "EcoFlow ရှိလား", "condo backup အတွက် ဘာကောင်းလဲ",
+          "how long does a 16kWh battery last", "solar panel ဈေးကျသွားပြီလား"]),
+]
+
+_CALC = re.compile(r"(\d+)\s*w\b|watts?|ရေခဲ|aircon", re.I)
+_PRODUCT = re.compile(r"price|ဈေး|inverter\b|deye|growatt|jinko|ecoflow|ဘက်ထရီ", re.I)
+
+
+def pick_message(rng):
+    total = sum(w for w, _ in MESSAGE_MIX)
+    r = rng.uniform(0, total)
+    for weight, templates in MESSAGE_MIX:
+        r -= weight
+        if r <= 0:
+            break
+    return rng.choice(templates).format(w=rng.choice([500, 1000, 1500, 2000, 3000]),
+                                        h=rng.choice([2, 4, 6, 8]), n=rng.randint(2, 9))
+
+
+def _sample(median, rng):
+    """Log-normal latency around `median` seconds (long right tail, like real APIs)."""
+    return rng.lognormvariate(math.log(median), 0.5) if median > 0 else 0.0
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(data, q):
+    if not data:
+        return None
+    data = sorted(data)
+    return data[min(len(data) - 1, int(q * len(data)))]
+
+
+# --- fake upstreams ---
+
+class FakeUpstreams:
+    """Bot API + OpenRouter stand-ins; both count every request they get."""
+
+    def __init__(self, args, seed=0):
+        self.args = args
+        self.rng = random.Random(seed)
+        self.telegram_calls = {}
+        self.llm_calls = 0
+        self.llm_errors = 0
+        self._message_id = 0
+
+    def telegram_app(self):
+        from fastapi import FastAPI, Request
+        from fastapi.responses import JSONResponse
+        app = FastAPI()
+
+        @app.post("/bot{token}/{method}")
+        async def bot_api(token: str, method: str, request: Request):
+            await request.body()
+            self.telegram_calls[method] = self.telegram_calls.get(method, 0) + 1
+            await asyncio.sleep(_sample(self.args.tg_latency, self.rng))
+            if self.rng.random() < self.args.tg_error_rate:
+                return JSONResponse({"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                     "parameters": {"retry_after": 1}}, status_code=429)
+            self._message_id += 1
+            return {"ok": True, "result": {"message_id": self._message_id} if method != "sendChatAction" else True}
+
+        return app
+
+    def _answer(self, body):
+        """Tool call on the decision pass for sizing / product questions, text otherwise."""
+        messages = body.get("messages") or []
+        user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        if body.get("tools") and body.get("tool_choice") != "none" and not any(m.get("role") == "tool" for m in messages):
+            m = _CALC.search(user)
+            if m:
+                watts = int(m.group(1)) if m.group(1) else 1500
+                return None, {"name": "calculate", "arguments": json.dumps({"watts": watts, "hours": 4})}
+            if _PRODUCT.search(user):
+                return None, {"name": "search", "arguments": json.dumps({"query": user}, ensure_ascii=False)}
+        return "မင်္ဂလာပါ။ ဆိုလာ System အကြောင်း အကူအညီ လိုရင် ပြောပါ။ " * 3, None
+
+    def openrouter_app(self):
+        from fastapi import FastAPI, Request
+        from fastapi.responses import JSONResponse, StreamingResponse
+        app = FastAPI()
+
+        @app.post("/chat/completions")
+        async def completions(request: Request):
+            body = await request.json()
+            self.llm_calls += 1
+            await asyncio.sleep(_sample(self.args.llm_latency, self.rng))
+            if self.rng.random() < self.args.llm_error_rate:
+                self.llm_errors += 1
+                return JSONResponse({"error": {"message": "upstream overloaded"}}, status_code=503)
+
+            text, call = self._answer(body)
+            if not body.get("stream"):
+                message = {"role": "assistant", "content": text}
+                if call:
+                    message["tool_calls"] = [{"id": "call_1", "type": "function", "function": call}]
+                return {"choices": [{"message": message}]}
+
+            async def events():
+                if call:
+                    delta = {"tool_calls": [{"index": 0, "id": "call_1", "function": call}]}
+                    yield f"data: {json.dumps({'choices': [{'delta': delta}]})}\n\n"
+                else:
+                    for i in range(0, len(text), 40):
+                        await asyncio.sleep(self.args.llm_token_interval)
+                        delta = {"content": text[i:i + 40]}
+                        yield f"data: {json.dumps({'choices': [{'delta': delta}]}, ensure_ascii=False)}\n\n"
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return app
+
+
+# --- ephemeral Postgres ---
+
+class EphemeralPostgres:
+    """initdb into a temp dir, start on a free port, migrate; removed on stop()."""
+
+    def __init__(self):
+        self.dir = None
+        self.url = None
+        self._pg_ctl = None
+
+    @staticmethod
+    def _binary(name):
+        found = shutil.which(name) or sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))
+        if not found:
+            raise RuntimeError(f"'{name}' not found; install PostgreSQL or pass --database-url")
+        return found if isinstance(found, str) else found[-1]
+
+    def start(self):
+        initdb, self._pg_ctl = self._binary("initdb"), self._binary("pg_ctl")
+        self.dir = tempfile.mkdtemp(prefix="meesaya-bench-pg-")
+        data, port = os.path.join(self.dir, "data"), _free_port()
+        subprocess.run([initdb, "-D", data, "-U", "postgres", "-A", "trust", "--no-sync"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([self._pg_ctl, "-D", data, "-l", os.path.join(self.dir, "postgres.log"), "-w",
+                        "-o", f"-p {port} -k {self.dir} -c fsync=off -c synchronous_commit=off", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        self.url = f"postgresql://postgres@127.0.0.1:{port}/postgres"
+        subprocess.run([sys.executable, "-m", "alembic", "upgrade", "head"], check=True,
+                       env={**os.environ, "DATABASE_URL": self.url}, stdout=subprocess.DEVNULL)
+        print(f"✅ Ephemeral Postgres on :{port}")
+        return self.url
+
+    def stop(self):
+        if self.dir:
+            subprocess.run([self._pg_ctl, "-D", os.path.join(self.dir, "data"), "-m", "fast", "stop"],
+                           stdout=subprocess.DEVNULL)
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+
+# --- run ---
+
+async def _serve(app, port):
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def _stop(server, task):
+    server.should_exit = True
+    await task
+
+
+async def run_benchmark(args, database_url=None):
+    rng = random.Random(args.seed)
+    fakes = FakeUpstreams(args, args.seed)
+    tg_port, or_port, app_port = _free_port(), _free_port(), _free_port()
+
+    # Configure before main (and the modules it imports) read their env
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": BENCH_BOT_TOKEN,
+        "TELEGRAM_API_BASE": f"http://127.0.0.1:{tg_port}",
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{or_port}",
+        "OPENROUTER_API_KEY": "bench",
+        "APP_PUBLIC_URL": "",
+        "INGEST_MODE": "webhook",
+        "HTTP2_ENABLED": "0",
+        "SEED_ON_STARTUP": "1" if database_url else "0",
+        "EMBEDDINGS_PATH": os.path.join(tempfile.gettempdir(), "meesaya-bench-kb.npy"),
+    })
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    else:
+        os.environ.pop("DATABASE_URL", None)
+
+    import httpx
+    import main
+    from metrics import metrics
+
+    # End-to-end latency: webhook POST -> handler finished (reply delivered)
+    started = {}    # chat_id -> deque of send times (the dispatcher keeps per-chat FIFO)
+    latencies = []
+    handler = main.dispatcher.handler
+
+    async def timed_handler(chat_id, text):
+        try:
+            await handler(chat_id, text)
+        finally:
+            queue = started.get(str(chat_id))
+            if queue:
+                latencies.append(time.monotonic() - queue.popleft())
+
+    main.dispatcher.handler = timed_handler
+
+    servers = [await _serve(fakes.telegram_app(), tg_port), await _serve(fakes.openrouter_app(), or_port)]
+    servers.append(await _serve(main.app, app_port))
+    rejected = 0
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=30) as client:
+            while (await client.get("/ready")).status_code != 200:
+                await asyncio.sleep(0.1)
+
+            db_before = metrics.counters.get(("db_queries_total", ()), 0)
+            llm_before, tg_before = fakes.llm_calls, sum(fakes.telegram_calls.values())
+
+            async def fire(update_id, chat_id, text):
+                nonlocal rejected
+                started.setdefault(str(chat_id), deque()).append(time.monotonic())
+                update = {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": chat_id},
+                                                              "from": {"id": chat_id}, "text": text}}
+                # Telegram re-delivers on 429; so do we
+                while (await client.post("/webhook", json=update)).status_code == 429:
+                    rejected += 1
+                    await asyncio.sleep(0.5)
+
+            t0 = time.monotonic()
+            sends = []
+            for i in range(args.messages):
+                target = t0 + i / args.rate
+                await asyncio.sleep(max(0.0, target - time.monotonic()))
+                chat_id = 100000 + rng.randrange(args.users)
+                sends.append(asyncio.create_task(fire(i + 1, chat_id, pick_message(rng))))
+            await asyncio.gather(*sends)
+
+            deadline = time.monotonic() + args.drain_timeout
+            while main.dispatcher.busy and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            elapsed = time.monotonic() - t0
+            # Write-behind chat logs are part of the per-turn DB cost
+            while database_url and main.chat_log_writer.stats()["pending"] and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+
+            turns = len(latencies) or 1
+            db_queries = metrics.counters.get(("db_queries_total", ()), 0) - db_before
+            results = {
+                "messages": args.messages,
+                "completed": len(latencies),
+                "rejected_429": rejected,
+                "merged": main.dispatcher.stats()["merged"],
+                "throughput_per_s": round(len(latencies) / elapsed, 2),
+                "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 1) if latencies else None,
+                "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 1) if latencies else None,
+                "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1) if latencies else None,
+                "db_round_trips_per_turn": round(db_queries / turns, 2) if database_url else None,
+                "llm_calls_per_turn": round((fakes.llm_calls - llm_before) / turns, 2),
+                "telegram_calls_per_turn": round((sum(fakes.telegram_calls.values()) - tg_before) / turns, 2),
+                "response_cache_hit_rate": main.response_cache.stats().get("hit_rate"),
+                "fast_path_share": main.intent_router.stats()["fast_share"],
+                "stages": metrics.stats(),
+            }
+    finally:
+        for server, task in reversed(servers):
+            await _stop(server, task)
+    return results
+
+
+# --- regression check ---
+
+# metric -> True if higher is better
+TRACKED = {
+    "throughput_per_s": True,
+    "latency_p50_ms": False,
+    "latency_p95_ms": False,
+    "latency_p99_ms": False,
+    "db_round_trips_per_turn": False,
+    "llm_calls_per_turn": False,
+    "telegram_calls_per_turn": False,
+}
+
+
+def compare(results, baseline, tolerance):
+    """[(metric, baseline, current)] for every tracked metric that got worse by more than `tolerance`."""
+    regressions = []
+    for metric, higher_is_better in TRACKED.items():
+        old, new = baseline.get(metric), results.get(metric)
+        if old is None or new is None:
+            continue
+        limit = old * (1 - tolerance) if higher_is_better else old * (1 + tolerance)
+        if (new < limit) if higher_is_better else (new > limit + 1e-9):
+            regressions.append((metric, old, new))
+    return regressions
+
+
+def _print_report(results):
+    print("\n📊 Benchmark")
+    for key, value in results.items():
+        if key != "stages":
+            print(f"  {key:<26} {value}")
+    print("  stages (p50 / p95 ms):")
+    for name, s in results["stages"].items():
+        print(f"    {name:<22} {s['p50_ms']} / {s['p95_ms']}  (n={s['count']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test against local fakes")
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=20.0, help="webhook updates per second")
+    parser.add_argument("--users", type=int, default=100, help="distinct chats")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.8, help="median seconds per OpenRouter call")
+    parser.add_argument("--llm-token-interval", type=float, default=0.02, help="seconds between stream chunks")
+    parser.add_argument("--llm-error-rate", type=float, default=0.02)
+    parser.add_argument("--tg-latency", type=float, default=0.05, help="median seconds per Bot API call")
+    parser.add_argument("--tg-error-rate", type=float, default=0.0, help="share of Bot API calls answered 429")
+    parser.add_argument("--database-url", default=os.environ.get("BENCH_DATABASE_URL"))
+    parser.add_argument("--ephemeral-db", action="store_true", help="throwaway Postgres (needs initdb/pg_ctl)")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--baseline", help="fail (exit 1) if worse than this results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--save-baseline", help="write results as the new baseline")
+    parser.add_argument("--verbose", action="store_true", help="show the app's own logs")
+    args = parser.parse_args()
+
+    pg = EphemeralPostgres() if args.ephemeral_db else None
+    database_url = pg.start() if pg else args.database_url
+    try:
+        out = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+        with out:
+            results = asyncio.run(run_benchmark(args, database_url))
+    finally:
+        if pg:
+            pg.stop()
+
+    _print_report(results)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({k: v for k, v in results.items() if k in TRACKED}, f, indent=2)
+        print(f"✅ Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for metric, old, new in regressions:
+            print(f"❌ Regression: {metric} {old} -> {new}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ Within {args.tolerance:.0%} of baseline")
+
+
+if __name__ == "__main__":
+    main()
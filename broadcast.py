@@ -0,0 +1,392 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+from collections import deque
+from database import get_db_connection, register_invalidation_handler, notify_invalidation
+from telegram_sender import telegram_sender, TokenBucket, PRIORITY_BROADCAST
+from telegram_api import clean_markdown, TELEGRAM_MAX_MESSAGE_LEN
+from metrics import metrics
+
+# Bulk messages (News rows from knowledge.csv, announcements) to every chat
+# active in the last `active_days` days.
+#
+# - Audience: distinct chat_history.user_id, walked in (user_id, id DESC)
+#   index order by a loose index scan, BROADCAST_SEGMENT_SIZE chats per
+#   query; each segment is fetched and its connection released before it is
+#   sent, so no transaction stays open while the senders work. Chats that
+#   blocked the bot are skipped until they write again.
+# - Sends go through telegram_sender at PRIORITY_BROADCAST, so live replies
+#   always go first, capped at BROADCAST_RATE msg/s with BROADCAST_CONCURRENCY
+#   sends in flight.
+# - Progress (cursor + counts) is checkpointed every few seconds. A run that
+#   dies is picked up again from its cursor (at-least-once: chats after the
+#   last checkpoint may get the message twice).
+#
+#   python broadcast.py --news                   # queue News rows from the last 48h
+#   python broadcast.py --message "..." --days 30
+#   python broadcast.py --status
+#   python broadcast.py --run                    # send here instead of on the server
+
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", 20))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", 16))
+BROADCAST_ACTIVE_DAYS = int(os.environ.get("BROADCAST_ACTIVE_DAYS", 90))
+BROADCAST_SEGMENT_SIZE = int(os.environ.get("BROADCAST_SEGMENT_SIZE", 5000))
+BROADCAST_CHECKPOINT_SECONDS = float(os.environ.get("BROADCAST_CHECKPOINT_SECONDS", 5))
+BROADCAST_POLL_INTERVAL = float(os.environ.get("BROADCAST_POLL_INTERVAL", 60))
+# A running broadcast whose owner stopped checkpointing this long ago is taken over
+BROADCAST_STALE_SECONDS = float(os.environ.get("BROADCAST_STALE_SECONDS", 120))
+BROADCAST_NEWS_MAX_AGE_HOURS = float(os.environ.get("BROADCAST_NEWS_MAX_AGE_HOURS", 48))
+
+# Loose index scan over ix_chat_history_user_id_id (user_id, id DESC): each
+# step jumps to the next user_id with a row in the window (partitions older
+# than the window are pruned), so one segment costs ~$3 index probes instead
+# of aggregating every message of the last `active_days` days. `blocked` is
+# checked against the chat's newest row (first index entry of that user_id).
+AUDIENCE_SQL = """
+    WITH RECURSIVE active (user_id, n) AS (
+        (SELECT user_id, 1 FROM chat_history
+         WHERE user_id > $1 AND "timestamp" >= localtimestamp - make_interval(days => $2)
+         ORDER BY user_id
+         LIMIT 1)
+        UNION ALL
+        SELECT (SELECT h.user_id FROM chat_history h
+                WHERE h.user_id > a.user_id AND h."timestamp" >= localtimestamp - make_interval(days => $2)
+                ORDER BY h.user_id
+                LIMIT 1),
+               a.n + 1
+        FROM active a
+        WHERE a.user_id IS NOT NULL AND a.n < $3
+    )
+    SELECT a.user_id, EXISTS (
+        SELECT 1 FROM blocked_chats b
+        WHERE b.user_id = a.user_id
+          AND b.blocked_at >= (SELECT h."timestamp" FROM chat_history h
+                               WHERE h.user_id = a.user_id
+                               ORDER BY h.id DESC
+                               LIMIT 1)
+    ) AS blocked
+    FROM active a
+    WHERE a.user_id IS NOT NULL
+    ORDER BY a.user_id
+"""
+
+CLAIM_SQL = """
+    UPDATE broadcasts SET status = 'running', owner = $1, heartbeat_at = now(),
+                          started_at = COALESCE(started_at, now())
+    WHERE id = (
+        SELECT id FROM broadcasts
+        WHERE status = 'pending'
+           OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => $2))
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, message, active_days, cursor, sent, failed, blocked
+"""
+
+CHECKPOINT_SQL = """
+    UPDATE broadcasts SET cursor = $2, sent = $3, failed = $4, blocked = $5, heartbeat_at = now()
+    WHERE id = $1 AND owner = $6
+"""
+
+BLOCKED_SQL = """
+    INSERT INTO blocked_chats (user_id, reason)
+    SELECT * FROM unnest($1::text[], $2::text[])
+    ON CONFLICT (user_id) DO UPDATE SET reason = EXCLUDED.reason, blocked_at = localtimestamp
+"""
+
+# Bot API errors meaning the chat can't receive messages any more
+_GONE = ("chat not found", "user is deactivated", "bot was kicked", "have no rights to send")
+
+
+def classify(data):
+    """sendMessage response -> ('sent' | 'blocked' | 'failed', reason)."""
+    if not data:
+        return "failed", None
+    if data.get("ok"):
+        return "sent", None
+    description = str(data.get("description", ""))
+    if data.get("error_code") == 403 or any(g in description.lower() for g in _GONE):
+        return "blocked", description[:200]
+    return "failed", description[:200]
+
+
+class _Run:
+    """Progress of one broadcast in this process."""
+
+    def __init__(self, row):
+        self.id = row["id"]
+        self.text = clean_markdown(row["message"])
+        self.active_days = row["active_days"]
+        self.cursor = row["cursor"] or ""
+        self.counts = {"sent": row["sent"], "failed": row["failed"], "blocked": row["blocked"]}
+        self.handled = 0
+        self.started = time.monotonic()
+        self.pending = deque()     # [user_id, done] in audience order
+        self.new_blocked = {}      # user_id -> reason, flushed at the next checkpoint
+
+    def advance(self):
+        """Move the cursor past every leading chat that has been handled."""
+        while self.pending and self.pending[0][1]:
+            self.cursor = self.pending.popleft()[0]
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return round(self.handled / elapsed, 2) if elapsed > 0 else 0.0
+
+
+class Broadcaster:
+    def __init__(self, rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._task = None
+        self._wakeup = None
+        self._run = None
+
+        # Metrics
+        self.broadcasts_done = 0
+        self.totals = {"sent": 0, "failed": 0, "blocked": 0}
+        self.errors = 0
+
+    # --- queueing ---
+
+    async def create(self, message, active_days=BROADCAST_ACTIVE_DAYS, source=None):
+        """Queue a broadcast. Returns its id, or None if `source` was already queued."""
+        if len(clean_markdown(message)) > TELEGRAM_MAX_MESSAGE_LEN:
+            raise ValueError(f"Broadcast message is longer than {TELEGRAM_MAX_MESSAGE_LEN} characters")
+        async with get_db_connection() as conn:
+            broadcast_id = await conn.fetchval("""
+                INSERT INTO broadcasts (source, message, active_days) VALUES ($1, $2, $3)
+                ON CONFLICT (source) DO NOTHING RETURNING id
+            """, source, message, active_days)
+            if broadcast_id:
+                await notify_invalidation(conn, "broadcasts")
+        return broadcast_id
+
+    async def queue_news(self, active_days=BROADCAST_ACTIVE_DAYS, max_age_hours=BROADCAST_NEWS_MAX_AGE_HOURS):
+        """One broadcast per recent knowledge_base News row not sent before (keyed by content hash)."""
+        async with get_db_connection() as conn:
+            ids = [r["id"] for r in await conn.fetch("""
+                INSERT INTO broadcasts (source, message, active_days)
+                SELECT 'kb:' || content_hash, '📢 ' || content, $1
+                FROM knowledge_base
+                WHERE lower(category) = 'news' AND created_at >= localtimestamp - $2::float8 * interval '1 hour'
+                  AND length(content) < 4000
+                ORDER BY id
+                ON CONFLICT (source) DO NOTHING
+                RETURNING id
+            """, active_days, float(max_age_hours))]
+            if ids:
+                await notify_invalidation(conn, "broadcasts")
+        return ids
+
+    # --- sending ---
+
+    async def claim(self):
+        async with get_db_connection() as conn:
+            return await conn.fetchrow(CLAIM_SQL, self.owner, BROADCAST_STALE_SECONDS)
+
+    async def _produce(self, run, queue):
+        """Feed the audience into `queue`, one keyset query per segment of active chats."""
+        after = run.cursor
+        while True:
+            # Fetched in one go and the connection returned before queueing: the
+            # senders take minutes per segment, no pool slot or snapshot waits on them
+            async with get_db_connection() as conn:
+                rows = await conn.fetch(AUDIENCE_SQL, after, run.active_days, BROADCAST_SEGMENT_SIZE)
+            for r in rows:
+                after = r["user_id"]
+                if r["blocked"]:
+                    continue
+                entry = [after, False]
+                run.pending.append(entry)
+                await queue.put(entry)   # waits while the senders catch up
+            if len(rows) < BROADCAST_SEGMENT_SIZE:
+                break
+        for _ in range(self.concurrency):
+            await queue.put(None)
+
+    async def _send(self, run, queue, bucket):
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            while True:
+                wait = bucket.wait_time(time.monotonic())
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            bucket.take(time.monotonic())
+
+            payload = {"chat_id": entry[0], "text": run.text, "parse_mode": "Markdown"}
+            outcome, reason = classify(await telegram_sender.submit("sendMessage", payload, PRIORITY_BROADCAST))
+            run.counts[outcome] += 1
+            run.handled += 1
+            self.totals[outcome] += 1
+            metrics.inc("broadcast_messages_total", outcome=outcome)
+            if outcome == "blocked":
+                run.new_blocked[entry[0]] = reason
+            entry[1] = True
+            run.advance()
+
+    async def _checkpoint(self, run, status=None):
+        blocked, run.new_blocked = run.new_blocked, {}
+        async with get_db_connection() as conn:
+            async with conn.transaction():
+                if blocked:
+                    await conn.execute(BLOCKED_SQL, list(blocked), list(blocked.values()))
+                await conn.execute(CHECKPOINT_SQL, run.id, run.cursor, run.counts["sent"],
+                                   run.counts["failed"], run.counts["blocked"], self.owner)
+                if status:
+                    await conn.execute("""
+                        UPDATE broadcasts SET status = $2,
+                            finished_at = CASE WHEN $2 = 'done' THEN now() END
+                        WHERE id = $1 AND owner = $3
+                    """, run.id, status, self.owner)
+
+    async def _checkpoints(self, run):
+        while True:
+            await asyncio.sleep(BROADCAST_CHECKPOINT_SECONDS)
+            try:
+                await self._checkpoint(run)
+            except Exception as e:
+                print(f"❌ Broadcast Checkpoint Error: {e}")
+
+    async def run(self, row):
+        """Send one claimed broadcast to its whole audience. Returns its counts."""
+        run = self._run = _Run(row)
+        print(f"📢 Broadcast {run.id} {'resumed after ' + repr(run.cursor) if run.cursor else 'started'}")
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        bucket = TokenBucket(self.rate, max(1.0, self.rate))
+        checkpoints = asyncio.create_task(self._checkpoints(run))
+        senders = [asyncio.create_task(self._send(run, queue, bucket)) for _ in range(self.concurrency)]
+        try:
+            await self._produce(run, queue)
+            await asyncio.gather(*senders)
+        except BaseException:
+            for task in senders:
+                task.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+            # Hand it back right away (it would be taken over once stale anyway)
+            try:
+                await self._checkpoint(run, status="pending")
+            except Exception as e:
+                print(f"❌ Broadcast Checkpoint Error: {e}")
+            raise
+        finally:
+            checkpoints.cancel()
+            await asyncio.gather(checkpoints, return_exceptions=True)
+            self._run = None
+
+        await self._checkpoint(run, status="done")
+        self.broadcasts_done += 1
+        print(f"✅ Broadcast {run.id} done: {run.counts['sent']} sent, {run.counts['failed']} failed, "
+              f"{run.counts['blocked']} blocked ({run.throughput()} msg/s)")
+        return run.counts
+
+    async def run_pending(self):
+        """Send every queued (or abandoned) broadcast. Returns how many ran."""
+        ran = 0
+        while True:
+            row = await self.claim()
+            if not row:
+                return ran
+            await self.run(row)
+            ran += 1
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_pending()
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Broadcast Error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), BROADCAST_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def wake(self):
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+        print(f"✅ Broadcaster Started ({self.rate} msg/s, {self.concurrency} in flight)")
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self):
+        run = self._run
+        return {
+            "broadcasts_done": self.broadcasts_done,
+            **self.totals,
+            "errors": self.errors,
+            "active": run.id if run else None,
+            "active_throughput_per_s": run.throughput() if run else None,
+            "active_backlog": len(run.pending) if run else 0,
+        }
+
+
+broadcaster = Broadcaster()
+
+# Wake up the worker as soon as a broadcast is queued from another process
+register_invalidation_handler("broadcasts", broadcaster.wake)
+
+
+async def print_status(limit=10):
+    async with get_db_connection() as conn:
+        rows = await conn.fetch("""
+            SELECT id, source, status, sent, failed, blocked, cursor, created_at, started_at, finished_at
+            FROM broadcasts ORDER BY id DESC LIMIT $1
+        """, limit)
+    for r in rows:
+        elapsed = (r["finished_at"] - r["started_at"]).total_seconds() if r["finished_at"] and r["started_at"] else None
+        handled = r["sent"] + r["failed"] + r["blocked"]
+        rate = f", {handled / elapsed:.1f} msg/s" if elapsed else ""
+        print(f"#{r['id']} [{r['status']}] {r['source'] or '-'}: {r['sent']} sent, {r['failed']} failed, "
+              f"{r['blocked']} blocked{rate}")
+
+
+async def main(argv):
+    parser = argparse.ArgumentParser(description="Queue and send broadcasts to active chats")
+    parser.add_argument("--message", help="Queue this text for every active chat")
+    parser.add_argument("--news", action="store_true", help="Queue recent News rows from the knowledge base")
+    parser.add_argument("--days", type=int, default=BROADCAST_ACTIVE_DAYS, help="Chats active in the last N days")
+    parser.add_argument("--run", action="store_true", help="Send queued broadcasts from this process")
+    parser.add_argument("--status", action="store_true", help="Show recent broadcasts")
+    args = parser.parse_args(argv)
+
+    if args.message:
+        print(f"✅ Broadcast {await broadcaster.create(args.message, args.days)} queued")
+    if args.news:
+        ids = await broadcaster.queue_news(args.days)
+        print(f"✅ {len(ids)} News broadcast(s) queued {ids}")
+    if args.run:
+        from http_client import init_http_clients, close_http_clients
+        await init_http_clients()
+        telegram_sender.start()
+        try:
+            await broadcaster.run_pending()
+        finally:
+            await telegram_sender.stop()
+            await close_http_clients()
+    if args.status or not (args.message or args.news or args.run):
+        await print_status()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -1,65 +1,196 @@
-from database import get_db_connection
+import os
+import time
+import bisect
+from collections import namedtuple
+import numpy as np
+from database import get_db_connection, register_invalidation_handler, PACKAGES_SQL
 
-async def calculate_system(watts: int, hours: int, housing_type: str = "home"):
+# market_packages is a tiny, rarely-changing table, so it is loaded once into an
+# immutable in-memory catalogue and sizing becomes a pure CPU lookup.
+# Refreshed after PACKAGE_CACHE_TTL seconds, or immediately when seed_data.py
+# sends NOTIFY meesaya_invalidate, 'market_packages'.
+
+PACKAGE_CACHE_TTL = float(os.environ.get("PACKAGE_CACHE_TTL", 300))
+
+APARTMENT_TYPES = ('apartment', 'condo', 'flat')
+
+# Tier thresholds, checked in order (later tiers override earlier ones)
+#   (tier, min kW exceeded, min kWh exceeded)
+TIER_RULES = (
+    ('B', 1.5, 2.0),
+    ('C', 3.5, 5.0),
+    ('D', 6.5, None),
+)
+
+Package = namedtuple("Package", [
+    "tier_code", "name", "system_voltage", "inverter_kw", "battery_kwh",
+    "est_price_low", "est_price_high", "install_cost", "description", "is_portable",
+])
+
+
+class PackageCatalog:
+    """Immutable snapshot of market_packages with lookup indexes."""
+
+    def __init__(self, packages):
+        self.packages = tuple(packages)
+        self.loaded_at = time.monotonic()
+
+        # tier_code -> first package (matches the old "WHERE tier_code = $1 LIMIT 1")
+        by_tier = {}
+        for p in self.packages:
+            if not p.is_portable:
+                by_tier.setdefault(p.tier_code, p)
+        self.by_tier = by_tier
+
+        # Portable units sorted by inverter_kw, with the cheapest option at or
+        # above each position precomputed -> "cheapest with kW >= x" is one bisect.
+        portable = sorted((p for p in self.packages if p.is_portable), key=lambda p: p.inverter_kw)
+        self.portable_kw = [p.inverter_kw for p in portable]
+        cheapest = [None] * len(portable)
+        best = None
+        for i in range(len(portable) - 1, -1, -1):
+            if best is None or portable[i].est_price_low <= best.est_price_low:
+                best = portable[i]
+            cheapest[i] = best
+        self.portable_cheapest = tuple(cheapest)
+
+    def cheapest_portable(self, min_kw):
+        i = bisect.bisect_left(self.portable_kw, min_kw)
+        return self.portable_cheapest[i] if i < len(self.portable_cheapest) else None
+
+    def is_stale(self):
+        return time.monotonic() - self.loaded_at > PACKAGE_CACHE_TTL
+
+
+_catalog = None
+
+
+async def load_package_catalog():
+    global _catalog
+    async with get_db_connection() as conn:
+        rows = await conn.fetch(PACKAGES_SQL)
+    _catalog = PackageCatalog(Package(**dict(r)) for r in rows)
+    print(f"✅ Package Catalog Loaded ({len(_catalog.packages)} packages)")
+    return _catalog
+
+
+def invalidate_package_catalog():
+    global _catalog
+    _catalog = None
+
+
+register_invalidation_handler("market_packages", invalidate_package_catalog)
+
+
+async def get_package_catalog():
+    if _catalog is None or _catalog.is_stale():
+        try:
+            return await load_package_catalog()
+        except Exception as e:
+            # Keep serving the stale snapshot if the DB is briefly unavailable
+            if _catalog is not None:
+                print(f"❌ Package Catalog Refresh Error: {e}")
+                return _catalog
+            raise
+    return _catalog
+
+
+def select_tier(raw_kw, raw_energy_kwh):
+    tier_target = 'A'
+    for tier, kw_limit, kwh_limit in TIER_RULES:
+        if raw_kw > kw_limit or (kwh_limit is not None and raw_energy_kwh > kwh_limit):
+            tier_target = tier
+    return tier_target
+
+
+def _portable_result(p):
+    return {
+        "strategy": "PORTABLE",
+        "tier_name": p.name,
+        "specs": f"{p.inverter_kw}kW / {p.battery_kwh}kWh",
+        "price_est": p.est_price_low,
+        "desc": p.description
+    }
+
+
+def _home_result(p):
+    total_low = p.est_price_low + p.install_cost
+    total_high = p.est_price_high + p.install_cost
+    return {
+        "strategy": "HOME_INSTALL",
+        "tier_name": p.name,
+        "voltage": p.system_voltage,
+        "specs": {
+            "inverter": f"{p.inverter_kw}kW",
+            "battery": f"{p.battery_kwh}kWh (LiFePO4)"
+        },
+        "price_range": f"{total_low:,} - {total_high:,} MMK",
+        "install_fee": f"{p.install_cost:,} MMK",
+        "desc": p.description
+    }
+
+
+NO_MATCH = {"error": "Requirements too high (Industrial). Contact admin."}
+
+
+def size_system(catalog, watts, hours, housing_type="home"):
+    """Pure sizing against a catalogue snapshot (no I/O)."""
     # Convert to kW/kWh for comparison
     raw_kw = watts / 1000.0
     raw_energy_kwh = (watts * hours) / 1000.0
 
-    match_found = None
-    
-    async with get_db_connection() as conn:
-        
-        if housing_type in ['apartment', 'condo', 'flat']:
-            row = await conn.fetchrow("""
-                SELECT name, inverter_kw, battery_kwh, est_price_low, description 
-                FROM market_packages 
-                WHERE is_portable = TRUE 
-                AND inverter_kw >= $1
-                ORDER BY est_price_low ASC LIMIT 1
-            """, raw_kw)
-            
-            if row:
-                match_found = {
-                    "strategy": "PORTABLE",
-                    "tier_name": row['name'],
-                    "specs": f"{row['inverter_kw']}kW / {row['battery_kwh']}kWh",
-                    "price_est": row['est_price_low'],
-                    "desc": row['description']
-                }
-
-        if not match_found:
-            tier_target = 'A'
-            if raw_kw > 1.5 or raw_energy_kwh > 2.0:
-                tier_target = 'B'
-            if raw_kw > 3.5 or raw_energy_kwh > 5.0:
-                tier_target = 'C'
-            if raw_kw > 6.5:
-                tier_target = 'D'
-
-            row = await conn.fetchrow("""
-                SELECT name, inverter_kw, battery_kwh, est_price_low, est_price_high, install_cost, description, system_voltage
-                FROM market_packages 
-                WHERE tier_code = $1
-                LIMIT 1
-            """, tier_target)
-            
-            if row:
-                total_low = row['est_price_low'] + row['install_cost']
-                total_high = row['est_price_high'] + row['install_cost']
-                match_found = {
-                    "strategy": "HOME_INSTALL",
-                    "tier_name": row['name'],
-                    "voltage": row['system_voltage'],
-                    "specs": {
-                        "inverter": f"{row['inverter_kw']}kW",
-                        "battery": f"{row['battery_kwh']}kWh (LiFePO4)"
-                    },
-                    "price_range": f"{total_low:,} - {total_high:,} MMK",
-                    "install_fee": f"{row['install_cost']:,} MMK",
-                    "desc": row['description']
-                }
-
-    if not match_found:
-        return {"error": "Requirements too high (Industrial). Contact admin."}
-        
-    return match_found
\ No newline at end of file
+    if housing_type in APARTMENT_TYPES:
+        p = catalog.cheapest_portable(raw_kw)
+        if p:
+            return _portable_result(p)
+
+    p = catalog.by_tier.get(select_tier(raw_kw, raw_energy_kwh))
+    if p:
+        return _home_result(p)
+
+    return dict(NO_MATCH)
+
+
+async def calculate_system(watts: int, hours: int, housing_type: str = "home"):
+    catalog = await get_package_catalog()
+    return size_system(catalog, watts, hours, housing_type)
+
+
+def size_batch(catalog, watts, hours, housing_types):
+    """
+    Vectorised sizing for many requests (quoting / benchmarking).
+    Same results as size_system, element-wise. Result dicts are shared between
+    rows with the same package, so treat them as read-only.
+    """
+    watts = np.atleast_1d(np.asarray(watts, dtype=np.float64))
+    hours = np.broadcast_to(np.asarray(hours, dtype=np.float64), watts.shape)
+    raw_kw = watts / 1000.0
+    raw_energy_kwh = (watts * hours) / 1000.0
+
+    tiers = np.full(watts.shape, 'A', dtype=object)
+    for tier, kw_limit, kwh_limit in TIER_RULES:
+        hit = raw_kw > kw_limit
+        if kwh_limit is not None:
+            hit |= raw_energy_kwh > kwh_limit
+        tiers[hit] = tier
+
+    housing = np.broadcast_to(np.asarray(housing_types, dtype=object), watts.shape)
+    is_apartment = np.isin(housing, APARTMENT_TYPES)
+    portable_idx = np.searchsorted(np.asarray(catalog.portable_kw, dtype=np.float64), raw_kw, side="left")
+
+    # Each distinct package is formatted once and reused
+    home_results = {t: _home_result(p) for t, p in catalog.by_tier.items()}
+    portable_results = [_portable_result(p) for p in catalog.portable_cheapest]
+
+    results = []
+    for i in range(len(watts)):
+        if is_apartment[i] and portable_idx[i] < len(portable_results):
+            results.append(portable_results[portable_idx[i]])
+        else:
+            results.append(home_results.get(tiers[i], NO_MATCH))
+    return results
+
+
+async def calculate_batch(watts, hours, housing_types):
+    catalog = await get_package_catalog()
+    return size_batch(catalog, watts, hours, housing_types)
@@ -1,13 +1,23 @@
 import os
-import json
-import httpx
+import time
 import asyncio
-from database import save_chat_log, get_recent_history, search_products_db, search_knowledge_base
-from calculator import calculate_system
+from llm_client import llm_client
+from telegram_api import send_chat_action, send_message
+from telegram_sender import PRIORITY_NOTICE
+from streaming import ProgressiveReply, stream_reply
+from database import search_knowledge_base, get_history_and_context
+from history_cache import history_cache, HISTORY_CACHE_TURNS
+from prompt_builder import prompt_builder
+from response_cache import response_cache
+from tools import tool_schemas, execute_tool_calls, progress_notice, tool_messages
+from metrics import metrics, log_event
+from intent_router import intent_router
+import retrieval
 
-OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
-TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+# Primary model (fallback chain is configured in llm_client via LLM_MODELS)
+LLM_MODEL = llm_client.primary_model
+# Show replies progressively as they stream (set to 0 for one-shot replies)
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "1") == "1"
 
 # System Prompt now includes a placeholder for dynamic context if needed, 
 # but usually we append context as a separate message.
@@ -18,140 +28,169 @@ Tone: Friendly, Expert (Male Engineer Persona).
 
 **INSTRUCTIONS:**
 - Use the provided CONTEXT to answer market/troubleshooting questions.
-- If user gives watts/appliances, output JSON: `{"tool": "calculate", "watts": 2000, "hours": 4, "housing": "home"}`.
-- If user asks for product price/stock, output JSON: `{"tool": "search", "query": "Growatt"}`.
+- If user gives watts/appliances, call the `calculate` tool.
+- If user asks for product price/stock, call the `search` tool.
 - Otherwise, reply normally.
 """
 
-async def send_chat_action(chat_id, action="typing"):
-    """Async chat action"""
-    try:
-        async with httpx.AsyncClient() as client:
-            await client.post(f"{TELEGRAM_API_URL}/sendChatAction", json={"chat_id": chat_id, "action": action})
-    except: pass
+async def call_llm_message(messages, temperature=0.3, tools=None, tool_choice=None):
+    """Full assistant message (content + tool_calls), or None on failure."""
+    return (await call_llm_model(messages, temperature, tools, tool_choice))[1]
 
-async def send_message(chat_id, text):
-    """Async message sender"""
-    clean_text = text.replace("**", "*")
-    async with httpx.AsyncClient() as client:
-        await client.post(f"{TELEGRAM_API_URL}/sendMessage", json={"chat_id": chat_id, "text": clean_text, "parse_mode": "Markdown"})
+async def call_llm_model(messages, temperature=0.3, tools=None, tool_choice=None):
+    """(model that answered, assistant message), or (None, None) on failure."""
+    with metrics.stage("llm"):
+        return await llm_client.chat_model(messages, temperature, tools, tool_choice)
 
 async def call_llm(messages, temperature=0.3):
-    try:
-        # Using Gemini 2.0 Flash Lite Preview as requested
-        model = "google/gemini-2.5-flash-lite" 
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            r = await client.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": model, 
-                    "messages": messages,
-                    "temperature": temperature
-                }
+    message = await call_llm_message(messages, temperature)
+    return message.get('content') if message else None
+
+async def complete(messages, reply, temperature=0.3, tools=None, tool_choice=None):
+    """
+    One LLM pass -> (text, tool_calls, model that answered), or (None, [], None)
+    if every model failed. Streams into `reply` when given, with the same
+    fallback chain, breakers and retries as a plain request.
+    """
+    if reply:
+        with metrics.stage("llm_stream"):
+            model, result = await llm_client.stream(
+                lambda m: stream_reply(messages, reply, m, temperature, tools, tool_choice)
             )
-            
-            if r.status_code != 200:
-                print(f"❌ OpenRouter API Error ({r.status_code}): {r.text}")
-                return None
-
-            result = r.json()
-            
-            if 'choices' not in result:
-                return None
-                
-            return result['choices'][0]['message']['content']
-        
-    except Exception as e:
-        print(f"❌ Connection Error: {e}")
-        return None
+        return (*result, model) if result is not None else (None, [], None)
+    model, message = await call_llm_model(messages, temperature, tools, tool_choice)
+    if not message:
+        return None, [], None
+    return message.get('content'), message.get('tool_calls') or [], model
+
+async def fetch_history(chat_id):
+    with metrics.stage("history"):
+        return await history_cache.get(chat_id, limit=HISTORY_CACHE_TURNS)
+
+async def retrieve_context(user_text):
+    """In-process vector search first (no DB round trip), full-text search as fallback."""
+    with metrics.stage("rag"):
+        if retrieval.is_ready():
+            context = retrieval.search_context(user_text)
+            if context:
+                return context
+        return await search_knowledge_base(user_text)
+
+async def load_context(chat_id, user_text):
+    """
+    (history, rag_context). When neither is in memory (cold chat, vector index
+    not loaded) both come from one combined query instead of two round trips.
+    """
+    if not history_cache.cached(chat_id) and not retrieval.is_ready():
+        with metrics.stage("history_rag"):
+            combined = await get_history_and_context(chat_id, HISTORY_CACHE_TURNS, user_text)
+        if combined is not None:
+            history, rag_context = combined
+            history_cache.prime(chat_id, history)
+            return history, rag_context
+
+    history_task = asyncio.create_task(fetch_history(chat_id))
+    rag_task = asyncio.create_task(retrieve_context(user_text))
+    return await history_task, await rag_task
+
+async def log_turn(chat_id, user_text, reply_text):
+    with metrics.stage("log"):
+        await history_cache.append(chat_id, "user", user_text)
+        await history_cache.append(chat_id, "assistant", reply_text)
 
 async def process_ai_message(chat_id, user_text):
     chat_id = str(chat_id)
-    
+    started = time.monotonic()
+
+    # 0. Deterministic requests (greeting, "2000W 4 hours", "Growatt price"): no LLM, no RAG
+    fast_reply = await intent_router.route(user_text)
+    if fast_reply:
+        await log_turn(chat_id, user_text, fast_reply)
+        with metrics.stage("send"):
+            await send_message(chat_id, fast_reply)
+        intent_router.record_fast(time.monotonic() - started)
+        return
+
     # 1. Immediate Feedback
     await send_chat_action(chat_id, "typing")
     
-    # 2. Retrieve Data (Async Parallel)
-    history_task = asyncio.create_task(get_recent_history(chat_id))
-    rag_task = asyncio.create_task(search_knowledge_base(user_text))
-    
-    history = await history_task
-    rag_context = await rag_task
+    # 2. Retrieve Data (Async Parallel, or one combined query)
+    history, rag_context = await load_context(chat_id, user_text)
     
-    # 3. Construct Contextual Prompt
-    context_msg = ""
-    if rag_context:
-        context_msg = f"CONTEXT (FROM KNOWLEDGE BASE):\n{rag_context}\n\nUse this context to answer if relevant."
-    
-    messages = [{"role": "system", "content": SYSTEM_PROMPT_BASE}] + history
-    
-    if context_msg:
-         messages.append({"role": "system", "content": context_msg})
-         
-    messages.append({"role": "user", "content": user_text})
+    # 3. Repeated question with the same context? Answer from cache (no LLM call).
+    #    Only for standalone questions: one that refers back to the conversation
+    #    ("how much is that one?") has an answer that belongs to that chat.
+    standalone = not history or not prompt_builder.is_followup(user_text)
+    cached = None
+    if standalone:
+        cached = response_cache.get(user_text, SYSTEM_PROMPT_BASE, rag_context, llm_client.expected_model())
+    if cached:
+        metrics.inc("response_cache_answers_total")
+        await log_turn(chat_id, user_text, cached)
+        with metrics.stage("send"):
+            await send_message(chat_id, cached)
+        intent_router.record_fallthrough()
+        return
+
+    # Construct Contextual Prompt (token-budgeted; older turns summarised)
+    with metrics.stage("prompt"):
+        messages, prompt_stats = prompt_builder.build(chat_id, SYSTEM_PROMPT_BASE, history, user_text, rag_context)
+    if prompt_stats["saved"]:
+        print(f"✂️ Prompt {prompt_stats['prompt_tokens']} tokens (saved ~{prompt_stats['saved']})")
     
-    # 4. First Pass (Decision)
-    ai_response = await call_llm(messages)
+    # 4. First Pass (Decision) - streamed straight to the user unless it's a tool call
+    reply = ProgressiveReply(chat_id) if STREAM_RESPONSES else None
+    tools = tool_schemas()
+    ai_response, tool_calls, model = await complete(messages, reply, tools=tools)
     
-    if not ai_response:
-        await send_message(chat_id, "System Error (AI Model). Please try again later.")
+    if not ai_response and not tool_calls:
+        log_event("llm_unavailable", level="error", chat_id=chat_id)
+        error_text = "System Error (AI Model). Please try again later."
+        if reply and reply.message_id is not None:
+            await reply.finish(error_text)   # replace a half-streamed answer
+        else:
+            await send_message(chat_id, error_text)
+        intent_router.record_fallthrough()
         return
 
-    tool_output_text = ""
-    tool_data = None
-    
-    # 5. Check for Tool Usage
-    if "{" in ai_response and "tool" in ai_response:
-        try:
-            # Clean json string if mixed with text
-            start_idx = ai_response.find("{")
-            end_idx = ai_response.rfind("}")
-            json_str = ai_response[start_idx:end_idx+1]
-            
-            tool_data = json.loads(json_str)
-            
-            if tool_data['tool'] == 'calculate':
-                await send_message(chat_id, "🔍 တွက်ချက်နေပါသည်... (Calculating...)")
-                await send_chat_action(chat_id, "typing")
-                
-                res = await calculate_system(tool_data['watts'], tool_data['hours'], tool_data.get('housing', 'home'))
-                if "error" in res:
-                    tool_output_text = f"Error: {res['error']}"
-                elif res['strategy'] == 'HOME_INSTALL':
-                    tool_output_text = (
-                        f"RECOMMENDATION: {res['tier_name']}\n"
-                        f"SPECS: {res['specs']['inverter']} + {res['specs']['battery']}\n"
-                        f"VOLTAGE: {res['voltage']}V System\n"
-                        f"ESTIMATED PRICE: {res['price_range']} (Includes {res['install_fee']} Installation)\n"
-                        f"CAPABILITY: {res['desc']}"
-                    )
-                elif res['strategy'] == 'PORTABLE':
-                    tool_output_text = f"RECOMMENDATION: {res['tier_name']} (Portable)\nPRICE: {res['price_est']:,} MMK"
-
-            elif tool_data['tool'] == 'search':
-                items = await search_products_db(tool_data['query'])
-                tool_output_text = "INVENTORY SEARCH RESULTS:\n" + "\n".join(items)
-
-        except Exception as e:
-            print(f"Tool Error: {e}")
-
-    # 6. Final Pass (Explanation)
-    if tool_output_text:
-        messages.append({"role": "assistant", "content": json.dumps(tool_data)})
-        messages.append({"role": "system", "content": f"TOOL RESULT: {tool_output_text}. Now write the final helpful response in Burmese."})
-        final_response = await call_llm(messages, temperature=0.6)
-        
-        if not final_response:
-            final_response = "Calculation done.\n" + tool_output_text
+    cacheable = True
+
+    # 5. Tool Usage (native tool_calls, run concurrently)
+    if tool_calls:
+        notice = progress_notice(tool_calls)
+        if notice:
+            await send_message(chat_id, notice, priority=PRIORITY_NOTICE)
+            await send_chat_action(chat_id, "typing")
+
+        with metrics.stage("tools"):
+            results = await execute_tool_calls(tool_calls)
+        # An answer worded around a failed tool call is not worth repeating
+        cacheable = all(r.result is not None for r in results)
+
+        # 6. Final Pass - skipped when every result has a deterministic template
+        if all(r.rendered for r in results):
+            final_response = "\n\n".join(r.rendered for r in results)
+        else:
+            messages = prompt_builder.followup(messages)
+            messages.extend(tool_messages(ai_response, tool_calls, results))
+            messages.append({"role": "system", "content": "Now write the final helpful response in Burmese."})
+            final_response, _, model = await complete(messages, reply, temperature=0.6, tools=tools, tool_choice="none")
+
+            if not final_response:
+                final_response = "Calculation done.\n" + "\n".join(r.text for r in results)
+                cacheable = False
     else:
         final_response = ai_response
 
-    # 7. Logging & Response
-    await save_chat_log(chat_id, "user", user_text)
-    await save_chat_log(chat_id, "assistant", final_response)
-    await send_message(chat_id, final_response)
\ No newline at end of file
+    # Keyed by the model that wrote the answer (a fallback's answer isn't the primary's)
+    if cacheable and standalone and model:
+        response_cache.put(user_text, final_response, SYSTEM_PROMPT_BASE, rag_context, model)
+
+    # 7. Response & Logging (log rows are queued; persistence finishes after the reply)
+    await log_turn(chat_id, user_text, final_response)
+    with metrics.stage("send"):
+        if reply:
+            await reply.finish(final_response)
+        else:
+            await send_message(chat_id, final_response)
+    intent_router.record_fallthrough(time.monotonic() - started)
@@ -0,0 +1,210 @@
+import os
+import re
+import sys
+import gzip
+import asyncio
+import datetime
+from database import get_db_connection
+
+# chat_history retention: partitions, daily rollup and archival.
+#
+# chat_history is range-partitioned by month on "timestamp" (migration
+# f7d21c6a9e34). Every CHAT_RETENTION_INTERVAL seconds, one worker:
+# - creates the next CHAT_PARTITION_PREMAKE_MONTHS partitions ahead of time,
+# - refreshes chat_daily_stats (per-day message / active chat counts) for
+#   the last two days,
+# - for months older than CHAT_HISTORY_RETENTION_MONTHS: rolls them up, COPYs
+#   them to CHAT_ARCHIVE_DIR/<partition>.csv.gz, then detaches and drops the
+#   partition (no row-by-row DELETE, no vacuum debt).
+#
+#   python chat_retention.py             # one pass now
+#   python chat_retention.py --dry-run   # show what would be archived
+
+CHAT_HISTORY_RETENTION_MONTHS = int(os.environ.get("CHAT_HISTORY_RETENTION_MONTHS", 6))
+CHAT_PARTITION_PREMAKE_MONTHS = int(os.environ.get("CHAT_PARTITION_PREMAKE_MONTHS", 2))
+CHAT_ARCHIVE_DIR = os.environ.get("CHAT_ARCHIVE_DIR", "chat_archive")
+CHAT_RETENTION_INTERVAL = float(os.environ.get("CHAT_RETENTION_INTERVAL", 6 * 3600))
+# A month of history can take far longer to COPY than DB_COMMAND_TIMEOUT
+CHAT_ARCHIVE_TIMEOUT = float(os.environ.get("CHAT_ARCHIVE_TIMEOUT", 3600))
+
+# Only one process runs a pass at a time (session-level advisory lock)
+RETENTION_LOCK_ID = 7306
+
+_PARTITION = re.compile(r"^chat_history_y(\d{4})m(\d{2})$")
+
+
+def month_start(day, offset=0):
+    """First day of the month `offset` months after `day`'s month."""
+    index = day.year * 12 + day.month - 1 + offset
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"chat_history_y{month.year:04d}m{month.month:02d}"
+
+
+def parse_partition(name):
+    """'chat_history_y2026m04' -> date(2026, 4, 1), or None for other tables."""
+    m = _PARTITION.match(name)
+    return datetime.date(int(m.group(1)), int(m.group(2)), 1) if m else None
+
+
+ROLLUP_SQL = """
+    INSERT INTO chat_daily_stats (day, user_messages, assistant_messages, active_chats, updated_at)
+    SELECT "timestamp"::date,
+           count(*) FILTER (WHERE role = 'user'),
+           count(*) FILTER (WHERE role IS DISTINCT FROM 'user'),
+           count(DISTINCT user_id),
+           now()
+    FROM chat_history
+    WHERE "timestamp" >= $1::date AND "timestamp" < $2::date
+    GROUP BY 1
+    ON CONFLICT (day) DO UPDATE SET
+        user_messages = EXCLUDED.user_messages,
+        assistant_messages = EXCLUDED.assistant_messages,
+        active_chats = EXCLUDED.active_chats,
+        updated_at = now()
+"""
+
+
+class ChatRetention:
+    def __init__(self, retention_months=CHAT_HISTORY_RETENTION_MONTHS, archive_dir=CHAT_ARCHIVE_DIR,
+                 interval=CHAT_RETENTION_INTERVAL):
+        self.retention_months = retention_months
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self._task = None
+
+        # Metrics
+        self.runs = 0
+        self.errors = 0
+        self.partitions_created = 0
+        self.partitions_archived = 0
+        self.rows_archived = 0
+        self.last_run_seconds = None
+
+    async def ensure_partitions(self, conn, today):
+        for offset in range(CHAT_PARTITION_PREMAKE_MONTHS + 1):
+            start = month_start(today, offset)
+            name = partition_name(start)
+            exists = await conn.fetchval("SELECT to_regclass($1) IS NOT NULL", name)
+            if exists:
+                continue
+            await conn.execute(
+                f"CREATE TABLE {name} PARTITION OF chat_history "
+                f"FOR VALUES FROM ('{start}') TO ('{month_start(start, 1)}')"
+            )
+            self.partitions_created += 1
+            print(f"✅ Chat History Partition Created ({name})")
+
+    async def rollup(self, conn, start, end):
+        await conn.execute(ROLLUP_SQL, start, end)
+
+    async def expired_partitions(self, conn, today):
+        """[(name, month start)] entirely older than the retention window, oldest first."""
+        cutoff = month_start(today, -self.retention_months)
+        rows = await conn.fetch("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'chat_history'::regclass
+        """)
+        parts = [(r['relname'], parse_partition(r['relname'])) for r in rows]
+        return sorted((name, start) for name, start in parts if start and start < cutoff)
+
+    async def archive_partition(self, conn, name, start):
+        """Rollup -> COPY to <dir>/<name>.csv.gz -> detach + drop. Returns rows archived."""
+        end = month_start(start, 1)
+        await self.rollup(conn, start, end)
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.csv.gz")
+        tmp = path + ".tmp"
+        with gzip.open(tmp, "wb") as f:
+            async def write(chunk):
+                f.write(chunk)
+            status = await conn.copy_from_table(name, output=write, format="csv", header=True,
+                                                timeout=CHAT_ARCHIVE_TIMEOUT)
+        os.replace(tmp, path)   # only a complete file ever has the final name
+        rows = int(status.split()[-1])
+
+        async with conn.transaction():
+            await conn.execute(f"ALTER TABLE chat_history DETACH PARTITION {name}")
+            await conn.execute(f"DROP TABLE {name}")
+            await conn.execute("""
+                INSERT INTO chat_history_archives (partition, range_start, range_end, row_count, path)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (partition) DO UPDATE SET
+                    row_count = EXCLUDED.row_count, path = EXCLUDED.path, archived_at = now()
+            """, name, start, end, rows, os.path.abspath(path))
+
+        self.partitions_archived += 1
+        self.rows_archived += rows
+        print(f"✅ Archived {name} ({rows} rows) -> {path}")
+        return rows
+
+    async def run_once(self, dry_run=False):
+        """One pass; skipped if another process holds the lock. Returns archived partition names."""
+        started = asyncio.get_running_loop().time()
+        archived = []
+        async with get_db_connection() as conn:
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", RETENTION_LOCK_ID):
+                return archived
+            try:
+                # The database's calendar, not this host's: chat_history timestamps
+                # are written by Postgres, so partition bounds must follow its TimeZone
+                today = await conn.fetchval("SELECT current_date")
+                expired = await self.expired_partitions(conn, today)
+                if dry_run:
+                    for name, _ in expired:
+                        print(f"Would archive {name}")
+                    return [name for name, _ in expired]
+
+                await self.ensure_partitions(conn, today)
+                await self.rollup(conn, today - datetime.timedelta(days=1), today + datetime.timedelta(days=1))
+                for name, start in expired:
+                    await self.archive_partition(conn, name, start)
+                    archived.append(name)
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", RETENTION_LOCK_ID)
+        self.runs += 1
+        self.last_run_seconds = round(asyncio.get_running_loop().time() - started, 3)
+        return archived
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Chat Retention Error: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._loop())
+        print(f"✅ Chat Retention Started (keep {self.retention_months} months, archive to {self.archive_dir})")
+
+    async def stop(self):
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "partitions_created": self.partitions_created,
+            "partitions_archived": self.partitions_archived,
+            "rows_archived": self.rows_archived,
+            "last_run_seconds": self.last_run_seconds,
+        }
+
+
+chat_retention = ChatRetention()
+
+
+if __name__ == "__main__":
+    asyncio.run(chat_retention.run_once(dry_run="--dry-run" in sys.argv))
@@ -0,0 +1,122 @@
+import os
+import time
+import asyncio
+from database import get_db_connection
+
+# Write-behind logger for chat_history.
+#
+# enqueue() is non-blocking, so replies are never held up by log INSERTs.
+# A background task drains the queue and writes batches with COPY, flushing
+# when CHATLOG_BATCH_SIZE rows are pending or every CHATLOG_FLUSH_INTERVAL
+# seconds. Rows keep queue order, so ids stay in per-chat turn order.
+# (timestamp is filled by the DB default at flush time, at most one interval late.)
+
+CHATLOG_BATCH_SIZE = int(os.environ.get("CHATLOG_BATCH_SIZE", 200))
+CHATLOG_FLUSH_INTERVAL = float(os.environ.get("CHATLOG_FLUSH_INTERVAL", 0.5))
+CHATLOG_MAX_PENDING = int(os.environ.get("CHATLOG_MAX_PENDING", 50000))
+CHATLOG_MAX_RETRIES = int(os.environ.get("CHATLOG_MAX_RETRIES", 3))
+
+_STOP = object()
+
+
+class ChatLogWriter:
+    def __init__(self, batch_size=CHATLOG_BATCH_SIZE, flush_interval=CHATLOG_FLUSH_INTERVAL,
+                 max_pending=CHATLOG_MAX_PENDING):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._queue = None
+        self._task = None
+
+        # Counters
+        self.written = 0
+        self.dropped = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self._task:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+        print("✅ Chat Log Writer Started")
+
+    async def stop(self):
+        """Flush everything still queued, then stop the background task."""
+        task, self._task = self._task, None   # enqueue() now refuses new rows
+        if not task:
+            return
+        await self._queue.put(_STOP)
+        await task
+        print(f"🛑 Chat Log Writer Stopped (written={self.written}, dropped={self.dropped})")
+
+    def enqueue(self, user_id, role, message):
+        """Queue one row. Returns False (and counts a drop) when the queue is full."""
+        if not self._task:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((str(user_id), role, message))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def _run(self):
+        while True:
+            # Wait for the first row, then give the batch up to one interval to fill
+            first = await self._queue.get()
+            if first is _STOP:
+                return
+            deadline = time.monotonic() + self.flush_interval
+            batch = [first]
+            stopping = False
+            while True:
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    row = self._queue.get_nowait()
+                    if row is _STOP:
+                        stopping = True
+                        break
+                    batch.append(row)
+                remaining = deadline - time.monotonic()
+                if stopping or len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, 0.05))
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        if not batch:
+            return
+        for attempt in range(1, CHATLOG_MAX_RETRIES + 1):
+            try:
+                async with get_db_connection() as conn:
+                    await conn.copy_records_to_table(
+                        'chat_history', records=batch,
+                        columns=['user_id', 'role', 'message_text']
+                    )
+                self.written += len(batch)
+                self.flushes += 1
+                return
+            except Exception as e:
+                self.failed_flushes += 1
+                print(f"❌ Chat Log Flush Error (attempt {attempt}, {len(batch)} rows): {e}")
+                await asyncio.sleep(0.2 * attempt)
+        self.dropped += len(batch)
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
+
+
+chat_log_writer = ChatLogWriter()
@@ -0,0 +1,226 @@
+import os
+import sys
+import hmac
+import bisect
+import socket
+import signal
+import hashlib
+import argparse
+import multiprocessing
+from http_client import get_cluster_client
+from update_dedup import update_dedup
+from dispatcher import REJECTED
+
+# Multi-worker / multi-node operation with chat affinity.
+#
+# Every worker process is a node on a consistent-hash ring (CLUSTER_NODES).
+# Whichever worker receives an update forwards it to the owner of its chat_id
+# (POST /internal/dispatch), so one chat is always handled by one dispatcher
+# and per-chat ordering, history_cache and prompt summaries stay correct.
+# Adding or removing a node only moves ~1/N of the chats.
+#
+#   python cluster.py --workers 4 --port 8000
+#
+# starts 4 uvicorn workers sharing the public port (SO_REUSEPORT, the kernel
+# spreads webhook connections) plus one internal port each for forwarding,
+# bound to CLUSTER_ADVERTISE_HOST. /internal/dispatch only answers on the
+# internal port and a cluster refuses to start without CLUSTER_SECRET.
+# For several machines, list the other machines' workers in CLUSTER_NODES and
+# give each machine its own CLUSTER_NODE_NAME.
+
+CLUSTER_NODES = os.environ.get("CLUSTER_NODES", "")   # "id=url,id=url,..."
+CLUSTER_NODE_NAME = os.environ.get("CLUSTER_NODE_NAME", socket.gethostname())
+CLUSTER_ADVERTISE_HOST = os.environ.get("CLUSTER_ADVERTISE_HOST", "127.0.0.1")
+CLUSTER_SECRET = os.environ.get("CLUSTER_SECRET", "")
+CLUSTER_VNODES = int(os.environ.get("CLUSTER_VNODES", 64))
+
+
+def parse_nodes(spec):
+    """'w0=http://10.0.0.1:9100,w1=...' -> {'w0': 'http://10.0.0.1:9100', ...}"""
+    nodes = {}
+    for item in spec.split(","):
+        if "=" in item:
+            node_id, url = item.split("=", 1)
+            nodes[node_id.strip()] = url.strip().rstrip("/")
+    return nodes
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, node_ids, vnodes=CLUSTER_VNODES):
+        points = sorted((_hash(f"{node_id}#{i}"), node_id) for node_id in node_ids for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def node_for(self, key):
+        i = bisect.bisect(self._hashes, _hash(str(key))) % len(self._hashes)
+        return self._nodes[i]
+
+
+def check_secret(headers):
+    """An empty secret never matches: forwarding is only trusted with a shared secret."""
+    return bool(CLUSTER_SECRET) and hmac.compare_digest(headers.get("x-cluster-secret", ""), CLUSTER_SECRET)
+
+
+class ClusterRouter:
+    """Routes chat messages to the owning worker's dispatcher (local or forwarded)."""
+
+    def __init__(self, dispatcher, nodes=None, node_id=None):
+        self.dispatcher = dispatcher
+        # Read at construction: the launcher sets these per worker process
+        self.nodes = parse_nodes(os.environ.get("CLUSTER_NODES", "")) if nodes is None else nodes
+        self.node_id = os.environ.get("CLUSTER_NODE_ID", "") if node_id is None else node_id
+        # This worker's own internal port (set by the launcher; None outside a cluster)
+        self.internal_port = int(os.environ.get("CLUSTER_WORKER_PORT", 0)) or None
+        self.ring = HashRing(self.nodes) if len(self.nodes) > 1 else None
+        if self.ring and not CLUSTER_SECRET:
+            raise RuntimeError("CLUSTER_SECRET must be set when CLUSTER_NODES lists several nodes")
+        if self.ring and self.node_id not in self.nodes:
+            print(f"⚠️ CLUSTER_NODE_ID '{self.node_id}' is not in CLUSTER_NODES, chats will all be forwarded")
+
+        # Metrics
+        self.local = 0
+        self.forwarded = 0
+        self.forward_errors = 0
+
+    @property
+    def enabled(self):
+        return self.ring is not None
+
+    @property
+    def is_leader(self):
+        """One worker does the cluster-wide chores (setWebhook, long polling)."""
+        return not self.enabled or self.node_id == min(self.nodes)
+
+    def is_internal(self, scope):
+        """Whether an ASGI request arrived on this worker's internal socket."""
+        server = scope.get("server") or (None, None)
+        return self.enabled and self.internal_port is not None and server[1] == self.internal_port
+
+    def owner(self, chat_id):
+        return self.ring.node_for(chat_id) if self.ring else self.node_id
+
+    async def submit_local(self, chat_id, text, update_id=None):
+        """
+        Queue on this worker's dispatcher, dropping Telegram retries first.
+        Duplicates count as handled (True) so Telegram stops retrying them.
+        Until the dedup mark is loaded updates are refused (False -> 429, Telegram
+        retries later) rather than holding the request open through DB warm-up.
+        """
+        if update_id is not None and not update_dedup.ready:
+            update_dedup.not_ready += 1
+            return False
+        if update_id is not None and not await update_dedup.claim(update_id):
+            return True
+        # A drop_newest discard is final too: retrying it would only be dropped again
+        if self.dispatcher.submit(chat_id, text, trace_id=update_id) != REJECTED:
+            return True
+        if update_id is not None:
+            await update_dedup.release(update_id)
+        return False
+
+    async def route(self, chat_id, text, update_id=None):
+        """Like dispatcher.submit(): False means the owner is saturated."""
+        owner = self.owner(chat_id)
+        if not self.enabled or owner == self.node_id:
+            self.local += 1
+            return await self.submit_local(chat_id, text, update_id)
+
+        try:
+            r = await get_cluster_client().post(
+                f"{self.nodes[owner]}/internal/dispatch",
+                json={"chat_id": chat_id, "text": text, "update_id": update_id},
+                headers={"X-Cluster-Secret": CLUSTER_SECRET},
+            )
+            if r.status_code == 429:
+                return False
+            r.raise_for_status()
+            self.forwarded += 1
+            return True
+        except Exception as e:
+            # Owner unreachable: answering here beats losing the message
+            self.forward_errors += 1
+            print(f"⚠️ Forward to {owner} failed ({e}), handling chat {chat_id} locally")
+            self.local += 1
+            return await self.submit_local(chat_id, text, update_id)
+
+    def stats(self):
+        return {
+            "node_id": self.node_id or None,
+            "nodes": len(self.nodes) or 1,
+            "leader": self.is_leader,
+            "local": self.local,
+            "forwarded": self.forwarded,
+            "forward_errors": self.forward_errors,
+        }
+
+
+# --- launcher ---
+
+def _listen_socket(host, port, reuse_port=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    return sock
+
+
+def _serve_worker(node_id, nodes_spec, host, port, internal_port):
+    # Must be set before main (and its config) is imported in this process
+    os.environ["CLUSTER_NODE_ID"] = node_id
+    os.environ["CLUSTER_NODES"] = nodes_spec
+    os.environ["CLUSTER_WORKER_PORT"] = str(internal_port)
+    import uvicorn
+
+    sockets = [_listen_socket(host, port, reuse_port=True), _listen_socket(CLUSTER_ADVERTISE_HOST, internal_port)]
+    uvicorn.Server(uvicorn.Config("main:app", host=host, port=port)).run(sockets=sockets)
+
+
+def run_workers(workers, host="0.0.0.0", port=8000, internal_port=9100):
+    if workers <= 1:
+        import uvicorn
+        uvicorn.run("main:app", host=host, port=port)
+        return
+    if not CLUSTER_SECRET:
+        print("🛑 CLUSTER_SECRET is empty: refusing to start workers that accept forwarded updates")
+        sys.exit(2)
+
+    local = {f"{CLUSTER_NODE_NAME}-w{i}": f"http://{CLUSTER_ADVERTISE_HOST}:{internal_port + i}"
+             for i in range(workers)}
+    nodes = {**parse_nodes(CLUSTER_NODES), **local}   # other machines' workers + ours
+    nodes_spec = ",".join(f"{k}={v}" for k, v in nodes.items())
+
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=_serve_worker, args=(node_id, nodes_spec, host, port, internal_port + i), name=node_id)
+        for i, node_id in enumerate(local)
+    ]
+    for p in procs:
+        p.start()
+    print(f"✅ Cluster Started ({workers} workers on :{port}, {len(nodes)} nodes in ring)")
+
+    def _shutdown(signum, frame):
+        for p in procs:
+            if p.is_alive():
+                p.terminate()   # SIGTERM -> uvicorn graceful shutdown (drains)
+
+    signal.signal(signal.SIGTERM, _shutdown)
+    signal.signal(signal.SIGINT, _shutdown)
+    for p in procs:
+        p.join()
+    print("🛑 Cluster Stopped")
+    sys.exit(max((p.exitcode or 0) for p in procs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run several chat-affine workers")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 1)))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--internal-port", type=int, default=int(os.environ.get("CLUSTER_INTERNAL_PORT", 9100)))
+    args = parser.parse_args()
+    run_workers(args.workers, args.host, args.port, args.internal_port)
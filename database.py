@@ -1,36 +1,148 @@
 import os
+import time
+import asyncio
 from contextlib import asynccontextmanager
 import asyncpg
 from dotenv import load_dotenv
+from text_utils import search_tokens
+from metrics import metrics
 
 load_dotenv()
 
 DB_URL = os.environ.get("DATABASE_URL")
 
+# Pool sizing / timeouts. Every worker process has its own pool, so
+# WEB_CONCURRENCY * DB_POOL_MAX_SIZE must stay under the server's max_connections.
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_ACQUIRE_TIMEOUT = float(os.environ.get("DB_ACQUIRE_TIMEOUT", 5.0))
+DB_COMMAND_TIMEOUT = float(os.environ.get("DB_COMMAND_TIMEOUT", 15.0))
+DB_MAX_IDLE_LIFETIME = float(os.environ.get("DB_MAX_IDLE_LIFETIME", 300.0))
+# asyncpg's per-connection prepared statement cache (0 behind PgBouncer in transaction mode)
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+# After a failed connect, wait this long before trying again (instead of on every call)
+DB_RETRY_INTERVAL = float(os.environ.get("DB_RETRY_INTERVAL", 5.0))
+# DB round trips one user turn may make before it is flagged (metrics + log)
+DB_TURN_BUDGET = int(os.environ.get("DB_TURN_BUDGET", 2))
+
 # Singleton Connection Pool
 pool = None
+_pool_lock = None
+_pool_failed_at = None
+_waiting = 0   # tasks currently blocked in pool.acquire()
+
+# Cross-process cache invalidation (Postgres LISTEN/NOTIFY).
+# Writers (seed_data.py, sync_knowledge.py) run: NOTIFY meesaya_invalidate, '<topic>'
+INVALIDATION_CHANNEL = "meesaya_invalidate"
+_invalidation_handlers = {}   # topic -> [callable]
+_listener_conn = None
+
+# --- hot queries ---
+# Fixed SQL text, so asyncpg keeps each one as a server-side prepared statement
+# per connection (parse/plan once, then a single Bind/Execute round trip).
+
+HISTORY_SQL = """
+    SELECT id, role, message_text FROM chat_history
+    WHERE user_id = $1
+    ORDER BY id DESC LIMIT $2
+"""
+
+PRODUCT_SEARCH_SQL = """
+    SELECT category, brand, model, specs, price, tags
+    FROM products_inventory
+    WHERE brand ILIKE $1 OR model ILIKE $1 OR category ILIKE $1
+    LIMIT 4
+"""
+
+KNOWLEDGE_SEARCH_SQL = """
+    SELECT content, category
+    FROM knowledge_base, to_tsquery('simple', $1) AS q
+    WHERE search_vector @@ q
+    ORDER BY ts_rank_cd(search_vector, q) DESC, id
+    LIMIT $2
+"""
+
+# Single-row fallback; the write-behind chat_log_writer uses COPY instead
+CHAT_LOG_INSERT_SQL = "INSERT INTO chat_history (user_id, role, message_text) VALUES ($1, $2, $3)"
+
+PACKAGES_SQL = """
+    SELECT tier_code, name, system_voltage, inverter_kw, battery_kwh,
+           est_price_low, est_price_high, install_cost, description, is_portable
+    FROM market_packages
+    ORDER BY id
+"""
+
+# History + RAG context in one round trip (when neither is in memory)
+HISTORY_AND_KNOWLEDGE_SQL = """
+    (SELECT 'history' AS kind, id, role AS a, message_text AS b, 0::real AS rank
+     FROM chat_history WHERE user_id = $1
+     ORDER BY id DESC LIMIT $2)
+    UNION ALL
+    (SELECT 'context', kb.id, kb.category, kb.content, ts_rank_cd(kb.search_vector, q)
+     FROM knowledge_base kb, to_tsquery('simple', $3) AS q
+     WHERE $3 <> '' AND kb.search_vector @@ q
+     ORDER BY ts_rank_cd(kb.search_vector, q) DESC, kb.id LIMIT $4)
+"""
+
+# (sql, harmless args) run once per new connection to prepare the statements
+_WARM_QUERIES = [
+    (HISTORY_SQL, ("", 0)),
+    (PRODUCT_SEARCH_SQL, ("",)),
+    (KNOWLEDGE_SEARCH_SQL, ("", 0)),
+    (HISTORY_AND_KNOWLEDGE_SQL, ("", 0, "", 0)),
+    (PACKAGES_SQL, ()),
+]
+
+def _count_query(record):
+    metrics.inc("db_queries_total")
+    metrics.count("db_queries")
+
+metrics.set_budget("db_queries", DB_TURN_BUDGET)
+
+async def _init_connection(conn):
+    if DB_STATEMENT_CACHE_SIZE > 0:
+        for sql, args in _WARM_QUERIES:
+            try:
+                await conn.fetch(sql, *args)
+            except Exception:
+                pass   # table not migrated yet; prepared on first real use instead
+    # Every statement after this is a round trip; counted for /metrics and benchmark.py
+    conn.add_query_logger(_count_query)
 
 async def init_pool():
-    global pool
+    global pool, _pool_lock, _pool_failed_at
     if not DB_URL:
+        _pool_failed_at = time.monotonic()
         print("❌ Error: DATABASE_URL is missing.")
         return
 
-    if not pool:
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:   # concurrent first calls create one pool, not several
+        if pool:
+            return
         try:
-            # Create a connection pool with asyncpg
-            # We don't need sslmode='require' for local if standard postgres used, 
-            # but usually for cloud URLs it's implied in the string or needed explicitly.
-            # asyncpg usually parses the DSN.
-            pool = await asyncpg.create_pool(DB_URL)
-            print("✅ Async Database Pool Created")
+            # min_size connections are opened (and warmed) before this returns
+            pool = await asyncpg.create_pool(
+                DB_URL,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                command_timeout=DB_COMMAND_TIMEOUT,
+                max_inactive_connection_lifetime=DB_MAX_IDLE_LIFETIME,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+                init=_init_connection,
+            )
+            _pool_failed_at = None
+            print(f"✅ Async Database Pool Created (min={DB_POOL_MIN_SIZE}, max={DB_POOL_MAX_SIZE})")
         except Exception as e:
+            _pool_failed_at = time.monotonic()
             print(f"❌ DB Pool Error: {e}")
 
 async def close_pool():
     global pool
     if pool:
         await pool.close()
+        pool = None
         print("🛑 Database Pool Closed")
 
 @asynccontextmanager
@@ -40,41 +152,93 @@ async def get_db_connection():
     Usage:
         async with get_db_connection() as conn:
             rows = await conn.fetch("SELECT * FROM ...")
+    Waits at most DB_ACQUIRE_TIMEOUT for a free connection.
     """
-    if not pool:
+    global _waiting
+    if not pool and (_pool_failed_at is None or time.monotonic() - _pool_failed_at >= DB_RETRY_INTERVAL):
         await init_pool()
     
     if not pool:
         raise Exception("Database pool not initialized")
 
-    async with pool.acquire() as conn:
+    _waiting += 1
+    started = time.monotonic()
+    try:
+        conn = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.inc("db_pool_acquire_timeouts_total")
+        raise Exception(f"DB pool exhausted (no connection within {DB_ACQUIRE_TIMEOUT}s)")
+    finally:
+        _waiting -= 1
+        metrics.observe("db_pool_acquire_seconds", time.monotonic() - started)
+    try:
         yield conn
+    finally:
+        await pool.release(conn)
+
+def pool_stats():
+    """Connections open / idle / checked out, and tasks waiting (for /metrics and /stats)."""
+    if not pool:
+        return {"size": 0, "idle": 0, "in_use": 0, "waiting": _waiting, "max": DB_POOL_MAX_SIZE}
+    size, idle = pool.get_size(), pool.get_idle_size()
+    return {"size": size, "idle": idle, "in_use": size - idle, "waiting": _waiting, "max": pool.get_max_size()}
+
+def register_invalidation_handler(topic, handler):
+    """handler() may be sync or async; it runs whenever '<topic>' is notified."""
+    _invalidation_handlers.setdefault(topic, []).append(handler)
+
+def _on_invalidation(connection, pid, channel, payload):
+    for handler in _invalidation_handlers.get(payload, []):
+        try:
+            result = handler()
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+        except Exception as e:
+            print(f"❌ Invalidation Handler Error ({payload}): {e}")
+
+async def start_invalidation_listener():
+    """Dedicated connection (outside the pool) that LISTENs for invalidations."""
+    global _listener_conn
+    if _listener_conn or not DB_URL:
+        return
+    try:
+        _listener_conn = await asyncpg.connect(DB_URL)
+        await _listener_conn.add_listener(INVALIDATION_CHANNEL, _on_invalidation)
+        print(f"✅ Listening for cache invalidations on '{INVALIDATION_CHANNEL}'")
+    except Exception as e:
+        _listener_conn = None
+        print(f"❌ Invalidation Listener Error: {e}")
+
+async def stop_invalidation_listener():
+    global _listener_conn
+    if _listener_conn:
+        await _listener_conn.close()
+        _listener_conn = None
+
+async def notify_invalidation(conn, topic):
+    await conn.execute("SELECT pg_notify($1, $2)", INVALIDATION_CHANNEL, topic)
 
 async def save_chat_log(user_id, role, message):
     """Async log saver"""
     try:
         async with get_db_connection() as conn:
-            await conn.execute(
-                "INSERT INTO chat_history (user_id, role, message_text) VALUES ($1, $2, $3)",
-                str(user_id), role, message
-            )
+            await conn.execute(CHAT_LOG_INSERT_SQL, str(user_id), role, message)
     except Exception as e:
         print(f"Log Error: {e}")
 
-async def get_recent_history(user_id, limit=6):
-    """Async history fetcher"""
+async def get_recent_history(user_id, limit=6, strict=False):
+    """Async history fetcher (strict=True re-raises DB errors instead of returning [])"""
     try:
         async with get_db_connection() as conn:
-            rows = await conn.fetch("""
-                SELECT role, message_text FROM chat_history
-                WHERE user_id = $1
-                ORDER BY id DESC LIMIT $2 
-            """, str(user_id), limit)
+            rows = await conn.fetch(HISTORY_SQL, str(user_id), limit)
         # asyncpg returns Record objects, we access them like dicts or tuples
         # Order is DESC, so we reverse it to ASC for the LLM
-        return [{"role": ("user" if r['role']=="user" else "assistant"), "content": r['message_text']} for r in rows[::-1]]
+        return [{"role": ("user" if r['role']=="user" else "assistant"), "content": r['message_text'], "id": r['id']}
+                for r in rows[::-1]]
     except Exception as e:
         print(f"History Error: {e}")
+        if strict:
+            raise
         return []
 
 async def search_products_db(query_text):
@@ -83,13 +247,7 @@ async def search_products_db(query_text):
     try:
         async with get_db_connection() as conn:
             # Simple ILIKE search used previously
-            search_term = f"%{query_text}%"
-            rows = await conn.fetch("""
-                SELECT category, brand, model, specs, price, tags 
-                FROM products_inventory 
-                WHERE brand ILIKE $1 OR model ILIKE $2 OR category ILIKE $3
-                LIMIT 4
-            """, search_term, search_term, search_term)
+            rows = await conn.fetch(PRODUCT_SEARCH_SQL, f"%{query_text}%")
             
             if not rows: return ["No specific products found."]
             for r in rows:
@@ -98,32 +256,26 @@ async def search_products_db(query_text):
         return [f"Search Error: {e}"]
     return results
 
-async def search_knowledge_base(query_text):
+def build_ts_query(query_text):
+    """
+    OR-query over search tokens, e.g. "'growatt' | 'error' | '04'".
+    Rows matching more tokens (and Burmese syllable bigrams) rank higher.
+    """
+    tokens = list(dict.fromkeys(search_tokens(query_text)))
+    return " | ".join("'" + t.replace("'", "''") + "'" for t in tokens)
+
+async def search_knowledge_base(query_text, limit=2):
     """
     RAG Search: Find relevant context from the knowledge_base table.
-    Uses basic keyword matching.
+    Single ranked query over the GIN-indexed search_vector column.
     """
+    ts_query = build_ts_query(query_text)
+    if not ts_query:
+        return ""
+
     try:
         async with get_db_connection() as conn:
-            # 1. Try Exact Phrase Match first
-            search_term = f"%{query_text}%"
-            rows = await conn.fetch("""
-                SELECT content, category FROM knowledge_base
-                WHERE content ILIKE $1 OR category ILIKE $1
-                LIMIT 2
-            """, search_term)
-            
-            # 2. If no results, try splitting words (find rows containing ANY word)
-            if not rows and " " in query_text:
-                words = [w for w in query_text.split() if len(w) > 3] # Filter small words
-                if words:
-                    # Construct dynamic query for multiple OR conditions
-                    # "content ILIKE $1 OR content ILIKE $2 ..."
-                    conditions = " OR ".join([f"content ILIKE ${i+1}" for i in range(len(words))])
-                    args = [f"%{w}%" for w in words]
-                    
-                    query = f"SELECT content, category FROM knowledge_base WHERE {conditions} LIMIT 2"
-                    rows = await conn.fetch(query, *args)
+            rows = await conn.fetch(KNOWLEDGE_SEARCH_SQL, ts_query, limit)
             
             if rows:
                 return "\n".join([f"[Context: {r['category']}] {r['content']}" for r in rows])
@@ -131,4 +283,23 @@ async def search_knowledge_base(query_text):
             
     except Exception as e:
         print(f"RAG Error: {e}")
-        return ""
\ No newline at end of file
+        return ""
+
+async def get_history_and_context(user_id, history_limit, query_text, kb_limit=2):
+    """
+    get_recent_history() + search_knowledge_base() in one round trip.
+    Returns (history, context), or None on error (callers fall back to the two calls).
+    """
+    try:
+        async with get_db_connection() as conn:
+            rows = await conn.fetch(HISTORY_AND_KNOWLEDGE_SQL, str(user_id), history_limit,
+                                    build_ts_query(query_text), kb_limit)
+    except Exception as e:
+        print(f"History+RAG Error: {e}")
+        return None
+    history = sorted((r for r in rows if r['kind'] == 'history'), key=lambda r: r['id'])
+    context = sorted((r for r in rows if r['kind'] == 'context'), key=lambda r: (-r['rank'], r['id']))
+    return (
+        [{"role": ("user" if r['a'] == "user" else "assistant"), "content": r['b'], "id": r['id']} for r in history],
+        "\n".join(f"[Context: {r['a']}] {r['b']}" for r in context),
+    )
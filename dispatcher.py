@@ -0,0 +1,202 @@
+import os
+import time
+import asyncio
+from collections import deque
+from metrics import metrics
+
+# In-process work dispatcher for incoming chat messages.
+#
+# - A fixed pool of async workers caps global concurrency (LLM calls, DB pool waits).
+# - Each chat_id gets its own FIFO lane, and a lane is only ever served by one
+#   worker at a time, so messages from the same chat are processed in order.
+# - A global pending limit gives backpressure; per-lane overload is handled by
+#   a drop or merge policy.
+
+DISPATCH_WORKERS = int(os.environ.get("DISPATCH_WORKERS", 16))
+DISPATCH_MAX_PENDING = int(os.environ.get("DISPATCH_MAX_PENDING", 1000))
+DISPATCH_MAX_LANE = int(os.environ.get("DISPATCH_MAX_LANE", 5))
+# 'merge' | 'drop_oldest' | 'drop_newest'
+DISPATCH_OVERLOAD_POLICY = os.environ.get("DISPATCH_OVERLOAD_POLICY", "merge")
+
+# submit() results
+ACCEPTED = "accepted"
+DROPPED = "dropped"     # discarded by the drop_newest policy (not worth a retry)
+REJECTED = "rejected"   # saturated / stopped: the caller should signal backpressure
+
+
+class Job:
+    __slots__ = ("chat_id", "text", "enqueued_at", "merged", "trace_id")
+
+    def __init__(self, chat_id, text, trace_id=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.trace_id = trace_id
+        self.enqueued_at = time.monotonic()
+        self.merged = 1
+
+
+class ChatDispatcher:
+    def __init__(self, handler, workers=DISPATCH_WORKERS, max_pending=DISPATCH_MAX_PENDING,
+                 max_lane=DISPATCH_MAX_LANE, overload_policy=DISPATCH_OVERLOAD_POLICY):
+        self.handler = handler
+        self.worker_count = workers
+        self.max_pending = max_pending
+        self.max_lane = max_lane
+        self.overload_policy = overload_policy
+
+        self._lanes = {}                # chat_id -> deque[Job]
+        self._ready = None              # chat_ids with work and no active worker
+        self._workers = []
+        self._pending = 0
+        self._active = 0
+        self._running = False
+
+        # Metrics
+        self.accepted = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.merged = 0
+        self.completed = 0
+        self.failed = 0
+        self._wait_times = deque(maxlen=1000)
+        self._max_wait = 0.0
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def busy(self):
+        """Work queued or in progress."""
+        return bool(self._pending or self._active)
+
+    @property
+    def saturated(self):
+        """A new chat's message would be rejected right now."""
+        return self._pending >= self.max_pending
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        # Created here (not in __init__) so it binds to the running loop
+        self._ready = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        print(f"✅ Dispatcher Started ({self.worker_count} workers)")
+
+    async def stop(self, drain=True, timeout=10.0):
+        """Stop workers. With drain=True, waits (up to timeout) for queued work first."""
+        if drain:
+            deadline = time.monotonic() + timeout
+            while self.busy and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+        self._running = False
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        print(f"🛑 Dispatcher Stopped (pending={self._pending})")
+
+    def submit(self, chat_id, text, trace_id=None):
+        """
+        Queue a message for processing. Never blocks.
+        Returns ACCEPTED, DROPPED (lane full under drop_newest) or REJECTED
+        (saturated or stopped; caller should signal backpressure).
+        trace_id (usually the Telegram update_id) labels the turn's logs.
+        """
+        if not self._running or self._pending >= self.max_pending:
+            # Checked before the lane policy, so merges can't grow work past the cap either
+            self.rejected += 1
+            metrics.inc("dispatcher_rejected_total")
+            return REJECTED
+
+        chat_id = str(chat_id)
+        lane = self._lanes.get(chat_id)
+
+        if lane is not None and len(lane) >= self.max_lane:
+            # Per-chat overload: apply policy instead of growing the lane
+            if self.overload_policy == "merge":
+                lane[-1].text = f"{lane[-1].text}\n{text}"
+                lane[-1].merged += 1
+                self._pending += 1   # pending counts messages, merged ones included
+                self.merged += 1
+                self.accepted += 1
+                return ACCEPTED
+            if self.overload_policy == "drop_oldest":
+                self._pending += 1 - lane.popleft().merged
+                lane.append(Job(chat_id, text, trace_id))
+                self.dropped += 1
+                metrics.inc("dispatcher_dropped_total", policy="drop_oldest")
+                self.accepted += 1
+                return ACCEPTED
+            # drop_newest
+            self.dropped += 1
+            metrics.inc("dispatcher_dropped_total", policy="drop_newest")
+            print(f"⚠️ Dropped message for chat {chat_id} (lane full)")
+            return DROPPED
+
+        job = Job(chat_id, text, trace_id)
+        if lane is None:
+            self._lanes[chat_id] = deque([job])
+            self._ready.put_nowait(chat_id)
+        else:
+            lane.append(job)
+        self._pending += 1
+        self.accepted += 1
+        return ACCEPTED
+
+    async def _worker(self, worker_id):
+        while True:
+            chat_id = await self._ready.get()
+            lane = self._lanes.get(chat_id)
+            if not lane:
+                self._lanes.pop(chat_id, None)
+                continue
+
+            job = lane.popleft()
+            self._pending -= job.merged
+            self._active += 1
+            wait = time.monotonic() - job.enqueued_at
+            self._wait_times.append(wait)
+            self._max_wait = max(self._max_wait, wait)
+
+            try:
+                with metrics.trace(job.chat_id, job.trace_id, queued=wait):
+                    await self.handler(job.chat_id, job.text)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"❌ Dispatcher Job Error (chat {chat_id}): {e}")
+            finally:
+                self._active -= 1
+                # Hand the lane back only after this job finished -> per-chat FIFO
+                if lane:
+                    self._ready.put_nowait(chat_id)
+                else:
+                    self._lanes.pop(chat_id, None)
+
+    def stats(self):
+        waits = sorted(self._wait_times)
+
+        def pct(p):
+            if not waits:
+                return 0.0
+            return waits[min(len(waits) - 1, int(p * len(waits)))]
+
+        return {
+            "workers": self.worker_count,
+            "queue_depth": self._pending,
+            "active": self._active,
+            "lanes": len(self._lanes),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "merged": self.merged,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_p50_ms": round(pct(0.50) * 1000, 1),
+            "wait_p95_ms": round(pct(0.95) * 1000, 1),
+            "wait_max_ms": round(self._max_wait * 1000, 1),
+        }
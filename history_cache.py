@@ -0,0 +1,129 @@
+import os
+import time
+import itertools
+from collections import OrderedDict, deque
+from database import get_recent_history, save_chat_log
+from chatlog_writer import chat_log_writer
+
+# Per-chat conversation history cache in front of chat_history.
+#
+# Reads are served from memory after the first miss; writes go to the cache
+# and through to the DB (via the write-behind chat_log_writer when running). The dispatcher processes each chat's messages one at
+# a time, so appends land in the same order as they are persisted.
+#
+# Bounded by number of chats (LRU) and idle time. Every cached turn carries a
+# `turn_id` that is unique per turn, not per text: ("db", chat_history.id) for
+# loaded rows, ("mem", n) for turns appended here (their row id isn't known yet).
+
+HISTORY_CACHE_TURNS = int(os.environ.get("HISTORY_CACHE_TURNS", 20))
+HISTORY_CACHE_MAX_CHATS = int(os.environ.get("HISTORY_CACHE_MAX_CHATS", 5000))
+HISTORY_CACHE_IDLE_TTL = float(os.environ.get("HISTORY_CACHE_IDLE_TTL", 3600))
+
+_appended_seq = itertools.count()
+
+
+def _loaded_turn(turn):
+    return {"role": turn["role"], "content": turn["content"], "turn_id": ("db", turn.get("id"))}
+
+
+class _Entry:
+    __slots__ = ("turns", "last_used")
+
+    def __init__(self, turns):
+        self.turns = deque((_loaded_turn(t) for t in turns), maxlen=HISTORY_CACHE_TURNS)
+        self.last_used = time.monotonic()
+
+
+class HistoryCache:
+    def __init__(self, max_chats=HISTORY_CACHE_MAX_CHATS, idle_ttl=HISTORY_CACHE_IDLE_TTL):
+        self.max_chats = max_chats
+        self.idle_ttl = idle_ttl
+        self._entries = OrderedDict()   # chat_id -> _Entry, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, chat_id):
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.last_used > self.idle_ttl:
+            del self._entries[chat_id]
+            self.evictions += 1
+            return None
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(chat_id)
+        return entry
+
+    def _put(self, chat_id, turns):
+        entry = _Entry(turns)
+        self._entries[chat_id] = entry
+        self._entries.move_to_end(chat_id)
+        self._evict()
+        return entry
+
+    def _evict(self):
+        now = time.monotonic()
+        # Idle entries sit at the LRU end, so stop at the first fresh one
+        while self._entries:
+            chat_id, entry = next(iter(self._entries.items()))
+            if len(self._entries) > self.max_chats or now - entry.last_used > self.idle_ttl:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            else:
+                break
+
+    async def get(self, chat_id, limit=6):
+        chat_id = str(chat_id)
+        entry = self._get(chat_id)
+        if entry is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            try:
+                turns = await get_recent_history(chat_id, limit=HISTORY_CACHE_TURNS, strict=True)
+            except Exception:
+                return []  # don't cache an empty history for a DB hiccup
+            entry = self._put(chat_id, turns)
+        return list(entry.turns)[-limit:] if limit else []
+
+    def cached(self, chat_id):
+        """True if get() would be answered from memory."""
+        return self._get(str(chat_id)) is not None
+
+    def prime(self, chat_id, turns):
+        """Store turns loaded elsewhere (e.g. the combined history + RAG query); counts as a miss."""
+        self.misses += 1
+        self._put(str(chat_id), turns)
+
+    async def append(self, chat_id, role, text):
+        """Write-through: update memory, then persist (queued, non-blocking when the writer runs)."""
+        chat_id = str(chat_id)
+        entry = self._get(chat_id)
+        if entry is not None:
+            entry.turns.append({"role": "user" if role == "user" else "assistant", "content": text,
+                                "turn_id": ("mem", next(_appended_seq))})
+        # On a miss we don't create a partial entry; the next read loads from DB.
+        if chat_log_writer.running:
+            chat_log_writer.enqueue(chat_id, role, text)
+        else:
+            await save_chat_log(chat_id, role, text)
+
+    def invalidate(self, chat_id=None):
+        if chat_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(str(chat_id), None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "chats": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+history_cache = HistoryCache()
@@ -0,0 +1,106 @@
+import os
+import httpx
+
+# App-lifetime HTTP clients.
+# One pooled AsyncClient per upstream host so every user turn reuses warm
+# keep-alive (and HTTP/2 where available) connections instead of paying a
+# fresh TLS handshake per call.
+#
+# Base URLs are overridable so the bot can be pointed at a local stub server.
+
+TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
+TELEGRAM_API_BASE = os.environ.get("TELEGRAM_API_BASE", "https://api.telegram.org")
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 5.0))
+HTTP_TELEGRAM_TIMEOUT = float(os.environ.get("HTTP_TELEGRAM_TIMEOUT", 10.0))
+HTTP_LLM_TIMEOUT = float(os.environ.get("HTTP_LLM_TIMEOUT", 30.0))
+HTTP_CLUSTER_TIMEOUT = float(os.environ.get("HTTP_CLUSTER_TIMEOUT", 5.0))
+HTTP_MAX_CONNECTIONS = int(os.environ.get("HTTP_MAX_CONNECTIONS", 50))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("HTTP_MAX_KEEPALIVE", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 60.0))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "1") == "1"
+
+# Singleton clients (one per host, so limits are effectively per-host)
+telegram_client = None
+openrouter_client = None
+cluster_client = None   # worker-to-worker forwarding (absolute URLs)
+
+
+def telegram_api_url():
+    return f"{TELEGRAM_API_BASE}/bot{TELEGRAM_BOT_TOKEN}"
+
+
+def _http2_available():
+    """HTTP/2 needs the optional 'h2' package."""
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_client(base_url, read_timeout):
+    return httpx.AsyncClient(
+        base_url=base_url or "",
+        http2=_http2_available(),
+        timeout=httpx.Timeout(read_timeout, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+async def init_http_clients():
+    global telegram_client, openrouter_client
+    if not telegram_client:
+        telegram_client = _build_client(telegram_api_url(), HTTP_TELEGRAM_TIMEOUT)
+    if not openrouter_client:
+        openrouter_client = _build_client(OPENROUTER_BASE_URL, HTTP_LLM_TIMEOUT)
+    print(f"✅ HTTP Clients Ready (http2={_http2_available()})")
+
+
+async def close_http_clients():
+    global telegram_client, openrouter_client, cluster_client
+    if telegram_client:
+        await telegram_client.aclose()
+        telegram_client = None
+    if openrouter_client:
+        await openrouter_client.aclose()
+        openrouter_client = None
+    if cluster_client:
+        await cluster_client.aclose()
+        cluster_client = None
+    print("🛑 HTTP Clients Closed")
+
+
+def get_telegram_client():
+    """
+    Shared Telegram Bot API client. Paths are relative to the bot URL:
+        await get_telegram_client().post("/sendMessage", json={...})
+    Lazily created so scripts that skip the startup hook still work.
+    """
+    global telegram_client
+    if not telegram_client:
+        telegram_client = _build_client(telegram_api_url(), HTTP_TELEGRAM_TIMEOUT)
+    return telegram_client
+
+
+def get_openrouter_client():
+    """Shared OpenRouter client. Paths are relative to OPENROUTER_BASE_URL."""
+    global openrouter_client
+    if not openrouter_client:
+        openrouter_client = _build_client(OPENROUTER_BASE_URL, HTTP_LLM_TIMEOUT)
+    return openrouter_client
+
+
+def get_cluster_client():
+    """Client for forwarding updates to other workers/nodes (see cluster.py)."""
+    global cluster_client
+    if not cluster_client:
+        cluster_client = _build_client(None, HTTP_CLUSTER_TIMEOUT)
+    return cluster_client
@@ -0,0 +1,225 @@
+import os
+import re
+from text_utils import normalize_text
+from product_index import get_product_index, parse_query
+from tools import TOOLS, TOOL_TEMPLATE_REPLIES
+from metrics import metrics
+
+# Fast path: answers deterministic messages without an LLM call.
+#
+#   "hi" / "မင်္ဂလာပါ"                -> templated greeting
+#   "2000W 4 hours" / "၂၀၀၀ ဝပ် ၄ နာရီ" -> calculate tool, rendered reply
+#   "Growatt price" / "အင်ဗာတာ ဈေး"    -> search tool, rendered reply
+#
+# Rules extract the slots (watts, hours, housing, product terms), then a
+# coverage check acts as the classifier: every other word of the message must
+# be a known filler for that intent, otherwise the message is ambiguous
+# ("fridge 150W and TV 100W 4 hours", "Growatt error 04") and goes to the LLM
+# as before. Latency saved = running average of LLM-path turns minus the
+# fast-path turn time.
+
+# Set to 0 to send every message through the LLM
+FAST_PATH = os.environ.get("FAST_PATH", "1") == "1"
+FAST_PATH_INTENTS = set(os.environ.get("FAST_PATH_INTENTS", "greeting,sizing,price").split(","))
+# Sanity limits for sizing requests (bigger loads are a conversation, not a lookup)
+FAST_PATH_MAX_WATTS = int(os.environ.get("FAST_PATH_MAX_WATTS", 20000))
+FAST_PATH_MAX_HOURS = int(os.environ.get("FAST_PATH_MAX_HOURS", 24))
+
+# Weight of the newest LLM-path turn in the running average
+_EWMA_ALPHA = 0.1
+
+_BURMESE_DIGITS = str.maketrans("၀၁၂၃၄၅၆၇၈၉", "0123456789")
+# Everything except words, numbers and Burmese letters (incl. ၊ ။ and emoji)
+_PUNCT = re.compile(r"[^\wက-၉၌-႟.]|_|(?<!\d)\.|\.(?!\d)")
+
+_WATTS = re.compile(r"(\d+(?:\.\d+)?)\s*(kw|kilowatts?|watts?|w|ကီလိုဝပ်|ဝပ်)(?![a-z])")
+_HOURS = re.compile(r"(\d+(?:\.\d+)?)\s*(hours?|hrs?|h|နာရီ)(?![a-z])")
+_KILO = ("kw", "kilowatt", "kilowatts", "ကီလိုဝပ်")
+_APARTMENT = re.compile(r"\b(?:apartment|condo|flat)\b|တိုက်ခန်း|ကွန်ဒို")
+_PRICE_WORDS = re.compile(r"\b(?:price|prices|cost|how much)\b|ဈေး|ဘယ်လောက်")
+
+_GREETING_WORDS = {"hi", "hii", "hiii", "hello", "helo", "hey", "mingalaba", "mingalarpar", "morning",
+                   "afternoon", "evening"}
+_GREETING_MY = ("မင်္ဂလာ", "ဟိုင်း", "ဟယ်လို")
+
+# Words that don't change what is being asked, per intent
+_POLITE_EN = {"good", "sir", "bro", "admin", "there", "please", "pls", "thanks", "ok", "dear", "meesaya"}
+_POLITE_MY = ("ခင်ဗျာ", "ခင်ဗျ", "ရှင့်", "ရှင်", "ဆရာ", "ပါတယ်", "ပါ", "နော်", "လား", "လဲ", "ရှိ", "ဗျ")
+_SIZING_EN = {"i", "need", "want", "a", "an", "for", "of", "system", "solar", "setup", "backup", "load", "my",
+              "how", "much", "what", "which", "recommend", "size", "total", "with", "and", "per", "day",
+              "daily", "run", "use", "to", "home", "house", "apartment", "condo", "flat", "power", "kit",
+              "package", "price", "cost", "is", "it", "in", "the", "about", "around", "x"}
+_SIZING_MY = ("တိုက်ခန်း", "ကွန်ဒို", "လိုချင်", "သုံးချင်", "သုံးမယ်", "ဘယ်လောက်", "အတွက်", "စနစ်", "ဆိုလာ",
+              "အိမ်", "တစ်ရက်", "ကျ", "ခန့်", "လောက်", "ဈေး", "နှုန်း")
+_PRICE_EN = {"price", "prices", "cost", "how", "much", "what", "is", "the", "of", "for", "a", "an", "now",
+             "current", "today", "please", "pls", "in", "mmk", "ks", "kyat"}
+_PRICE_MY = ("ဈေးနှုန်း", "ဈေး", "ဘယ်လောက်", "ကျ", "ရှိ", "လက်ရှိ", "ဒီနေ့", "သိချင်", "မေးချင်", "နှုန်း")
+
+GREETING_REPLY = (
+    "မင်္ဂလာပါ ခင်ဗျာ 🙏 မီးဆရာ (MeeSaya) ပါ။\n"
+    "☀️ ဆိုလာ System တွက်ချက်ပေးခြင်း၊ 📦 ပစ္စည်းဈေးနှုန်း မေးမြန်းခြင်း၊ "
+    "🔧 Inverter/Battery ပြဿနာများကို ကူညီပေးနိုင်ပါတယ်။\n"
+    "ဥပမာ - \"2000W 4 နာရီ\" သို့မဟုတ် \"Growatt ဈေး\" လို့ ပို့ကြည့်ပါ။"
+)
+
+
+def _clean(text):
+    """Normalised text with Burmese digits as ASCII and punctuation/emoji removed."""
+    return " ".join(_PUNCT.sub(" ", normalize_text(text).translate(_BURMESE_DIGITS)).split())
+
+
+def _residual(text, english, burmese):
+    """Words of `text` that are neither in `english` nor one of the `burmese` phrases."""
+    for phrase in sorted(burmese, key=len, reverse=True):
+        text = text.replace(phrase, " ")
+    return [w for w in text.split() if w not in english]
+
+
+def parse_sizing(text):
+    """'2kW 4 hours condo' -> (2000, 4, 'apartment'); None unless it is only that."""
+    watts, hours = _WATTS.findall(text), _HOURS.findall(text)
+    if len(watts) != 1 or len(hours) != 1:
+        return None   # missing a slot, or a list of appliances
+    (w, unit), (h, _) = watts[0], hours[0]
+    w = float(w) * (1000 if unit in _KILO else 1)
+    h = float(h)
+    if not (0 < w <= FAST_PATH_MAX_WATTS and 0 < h <= FAST_PATH_MAX_HOURS):
+        return None
+    if not (w.is_integer() and h.is_integer()):
+        return None   # "2.5 hours" / "150.5W": the calculator takes whole numbers, let the LLM word it
+    rest = _HOURS.sub(" ", _WATTS.sub(" ", text))
+    if _residual(rest, _SIZING_EN | _POLITE_EN | _GREETING_WORDS, _SIZING_MY + _POLITE_MY + _GREETING_MY):
+        return None
+    housing = "apartment" if _APARTMENT.search(text) else "home"
+    return int(w), int(h), housing
+
+
+def is_greeting(text):
+    words = set(text.split())
+    if not (words & _GREETING_WORDS or any(g in text for g in _GREETING_MY)):
+        return False
+    return not _residual(text, _GREETING_WORDS | _POLITE_EN, _GREETING_MY + _POLITE_MY)
+
+
+def _has_filter(text):
+    _, attrs, min_price, max_price = parse_query(text)
+    return bool(attrs) or min_price is not None or max_price is not None
+
+
+def looks_like_price(text):
+    """Price words or spec/budget filters ("6kW 48V under 2M") - cheap check before the index."""
+    return bool(_PRICE_WORDS.search(text)) or _has_filter(text)
+
+
+def price_query(text, index):
+    """Product terms of a bare price lookup ('growatt price' -> 'growatt'), else None (after looks_like_price())."""
+    has_filter = _has_filter(text)
+    query = " ".join(_residual(text, _PRICE_EN | _POLITE_EN | _GREETING_WORDS,
+                               _PRICE_MY + _POLITE_MY + _GREETING_MY))
+    tokens = parse_query(query)[0]
+    if not tokens and not has_filter:
+        return None
+    # Every remaining word must be a product term ("Growatt error 04 price" is not a lookup)
+    if not all(index.knows(t) for t in tokens):
+        return None
+    return query
+
+
+class IntentRouter:
+    def __init__(self, enabled=FAST_PATH, intents=FAST_PATH_INTENTS):
+        self.enabled = enabled
+        self.intents = intents
+
+        # Metrics
+        self.fast_turns = 0
+        self.other_turns = 0
+        self.by_intent = {}
+        self.saved_seconds = 0.0
+        self.llm_turn_avg = None   # running average of full LLM-path turns (seconds)
+
+    async def _tool_reply(self, name, args):
+        tool = TOOLS[name]
+        with metrics.stage(f"tool_{name}"):
+            result = await tool.handler(args)
+        return tool.render(result) if tool.render else None
+
+    async def _route(self, user_text):
+        """(intent, reply) or (None, fallthrough reason)."""
+        text = _clean(user_text)
+        if not text:
+            return None, "empty"
+
+        if "greeting" in self.intents and is_greeting(text):
+            return "greeting", GREETING_REPLY
+
+        if not TOOL_TEMPLATE_REPLIES:
+            return None, "no_match"   # tool results must be worded by the LLM
+
+        if "sizing" in self.intents:
+            sizing = parse_sizing(text)
+            if sizing:
+                watts, hours, housing = sizing
+                reply = await self._tool_reply("calculate", {"watts": watts, "hours": hours, "housing": housing})
+                return ("sizing", reply) if reply else (None, "no_result")
+
+        if "price" in self.intents and looks_like_price(text):
+            try:
+                index = await get_product_index()
+            except Exception:
+                return None, "index_unavailable"
+            query = price_query(text, index)
+            if query is not None:
+                reply = await self._tool_reply("search", {"query": query})
+                return ("price", reply) if reply else (None, "no_result")
+
+        return None, "no_match"
+
+    async def route(self, user_text):
+        """Templated reply for a deterministic message, or None to use the LLM."""
+        if not self.enabled:
+            return None
+        try:
+            with metrics.stage("fast_path"):
+                intent, result = await self._route(user_text)
+        except Exception as e:
+            print(f"❌ Fast Path Error: {e}")
+            intent, result = None, "error"
+        if intent is None:
+            metrics.inc("fast_path_fallthrough_total", reason=result)
+            return None
+        self.by_intent[intent] = self.by_intent.get(intent, 0) + 1
+        metrics.inc("fast_path_turns_total", intent=intent)
+        return result
+
+    def record_fast(self, seconds):
+        """A turn answered on the fast path took `seconds` end to end."""
+        self.fast_turns += 1
+        if self.llm_turn_avg is not None:
+            saved = max(0.0, self.llm_turn_avg - seconds)
+            self.saved_seconds += saved
+            metrics.inc("fast_path_saved_seconds_total", round(saved, 6))
+
+    def record_fallthrough(self, llm_seconds=None):
+        """A turn that was not fast-pathed; `llm_seconds` if the LLM answered it end to end."""
+        self.other_turns += 1
+        if llm_seconds is None:
+            return
+        if self.llm_turn_avg is None:
+            self.llm_turn_avg = llm_seconds
+        else:
+            self.llm_turn_avg += _EWMA_ALPHA * (llm_seconds - self.llm_turn_avg)
+
+    def stats(self):
+        total = self.fast_turns + self.other_turns
+        return {
+            "enabled": self.enabled,
+            "fast_turns": self.fast_turns,
+            "other_turns": self.other_turns,
+            "fast_share": round(self.fast_turns / total, 3) if total else 0.0,
+            "by_intent": dict(self.by_intent),
+            "saved_seconds": round(self.saved_seconds, 3),
+            "llm_turn_avg_ms": round(self.llm_turn_avg * 1000, 1) if self.llm_turn_avg is not None else None,
+        }
+
+
+intent_router = IntentRouter()
@@ -0,0 +1,277 @@
+import os
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+from http_client import get_openrouter_client
+from metrics import LatencyHistogram, LATENCY_BUCKETS, metrics
+
+# Resilient OpenRouter client.
+#
+# - Model fallback chain (LLM_MODELS, first = primary).
+# - Hedged requests: if an attempt hasn't answered after the model's recent p95
+#   latency, a second identical attempt is fired and whichever finishes first wins.
+# - Jittered exponential retries on 429 / 5xx / network errors, honouring Retry-After.
+# - Per-model circuit breaker so a failing model is skipped instead of waited on.
+# - Per-model latency histograms.
+# Streamed replies (stream()) share the fallback chain, breakers, retries and
+# histograms; they are not hedged, as only one stream can edit the reply.
+
+OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
+LLM_MODELS = [m.strip() for m in os.environ.get(
+    "LLM_MODELS", "google/gemini-2.5-flash-lite,google/gemini-2.0-flash-001"
+).split(",") if m.strip()]
+
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_DELAY = float(os.environ.get("LLM_RETRY_BASE_DELAY", 0.5))
+LLM_MAX_RETRY_AFTER = float(os.environ.get("LLM_MAX_RETRY_AFTER", 10.0))
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "1") == "1"
+LLM_HEDGE_DEFAULT_DELAY = float(os.environ.get("LLM_HEDGE_DEFAULT_DELAY", 4.0))
+LLM_HEDGE_MIN_DELAY = float(os.environ.get("LLM_HEDGE_MIN_DELAY", 1.0))
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", 5))
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", 30.0))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+    def __init__(self, message, status=None, retry_after=None, retryable=True):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open probe after cooldown."""
+
+    def __init__(self, threshold=LLM_BREAKER_THRESHOLD, cooldown=LLM_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probing = False
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+            self._probing = False
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.state = "closed"
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class LLMClient:
+    def __init__(self, models=None):
+        self.models = list(models or LLM_MODELS)
+        self.breakers = {m: CircuitBreaker() for m in self.models}
+        self.latency = {m: LatencyHistogram() for m in self.models}
+        self.errors = {m: 0 for m in self.models}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    @property
+    def primary_model(self):
+        return self.models[0]
+
+    def hedge_delay(self, model):
+        hist = self.latency[model]
+        p95 = hist.percentile(0.95) if len(hist.recent) >= LLM_HEDGE_MIN_SAMPLES else None
+        return max(LLM_HEDGE_MIN_DELAY, p95 if p95 is not None else LLM_HEDGE_DEFAULT_DELAY)
+
+    def _observe(self, model, elapsed):
+        self.latency[model].observe(elapsed)
+        metrics.observe("llm_request_seconds", elapsed, buckets=LATENCY_BUCKETS, model=model)
+
+    def _body(self, model, messages, temperature, tools, tool_choice):
+        body = {"model": model, "messages": messages, "temperature": temperature}
+        if tools:
+            body["tools"] = tools
+            if tool_choice:
+                body["tool_choice"] = tool_choice
+        return body
+
+    async def _attempt(self, model, body):
+        started = time.monotonic()
+        try:
+            r = await get_openrouter_client().post(
+                "/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json=body
+            )
+        except Exception as e:
+            raise LLMError(f"Connection Error: {e}")
+
+        if r.status_code != 200:
+            raise LLMError(
+                f"OpenRouter API Error ({r.status_code}): {r.text[:300]}",
+                status=r.status_code,
+                retry_after=_parse_retry_after(r.headers.get("retry-after")),
+                retryable=r.status_code in RETRYABLE_STATUS,
+            )
+
+        # OpenRouter can return 200 with an upstream error body, a truncated
+        # body or an empty choices list; all of those are worth a retry
+        try:
+            message = r.json()['choices'][0]['message']
+        except (ValueError, LookupError, TypeError):
+            raise LLMError(f"OpenRouter Bad Response: {r.text[:300]}", retryable=True)
+
+        self._observe(model, time.monotonic() - started)
+        return message
+
+    async def _retrying(self, model, attempt):
+        """Await attempt() until it succeeds, retrying retryable LLMErrors with jittered backoff."""
+        for n in range(LLM_MAX_RETRIES + 1):
+            try:
+                return await attempt()
+            except LLMError as e:
+                metrics.inc("llm_errors_total", model=model, status=e.status or "network")
+                if not e.retryable or n == LLM_MAX_RETRIES:
+                    raise
+                delay = LLM_RETRY_BASE_DELAY * (2 ** n)
+                delay = random.uniform(0, delay)  # full jitter
+                if e.retry_after is not None:
+                    delay = max(delay, min(e.retry_after, LLM_MAX_RETRY_AFTER))
+                print(f"⚠️ LLM retry {n + 1} on {model} in {delay:.2f}s ({e})")
+                await asyncio.sleep(delay)
+
+    async def _with_retries(self, model, body):
+        return await self._retrying(model, lambda: self._attempt(model, body))
+
+    async def _hedged(self, model, body):
+        first = asyncio.create_task(self._with_retries(model, body))
+        tasks = [first]
+        try:
+            if not LLM_HEDGE_ENABLED:
+                return await first
+
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(model))
+            if done:
+                return first.result()
+
+            # Slow tail: fire a second attempt, keep whichever finishes first
+            self.hedges += 1
+            second = asyncio.create_task(self._with_retries(model, body))
+            tasks.append(second)
+            pending = {first, second}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The loser, or both attempts when the caller itself was cancelled
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def expected_model(self):
+        """The model the next request will most likely be answered by (first one not tripped)."""
+        return next((m for m in self.models if self.breakers[m].state != "open"), self.primary_model)
+
+    async def chat(self, messages, temperature=0.3, tools=None, tool_choice=None):
+        """Assistant message dict from the first healthy model in the chain, or None."""
+        return (await self.chat_model(messages, temperature, tools, tool_choice))[1]
+
+    async def chat_model(self, messages, temperature=0.3, tools=None, tool_choice=None):
+        """Like chat(), as (model that answered, message); (None, None) if every model failed."""
+        for i, model in enumerate(self.models):
+            if not self.breakers[model].allow():
+                continue
+            if i > 0:
+                self.fallbacks += 1
+            try:
+                message = await self._hedged(model, self._body(model, messages, temperature, tools, tool_choice))
+                self.breakers[model].record_success()
+                return model, message
+            except LLMError as e:
+                self.errors[model] += 1
+                self.breakers[model].record_failure()
+                print(f"❌ LLM {model} failed: {e}")
+        return None, None
+
+    async def stream(self, attempt):
+        """
+        Streaming counterpart of chat(): `attempt(model)` streams one completion
+        and returns its result, raising LLMError on failure. Same fallback chain,
+        breakers and retries. Returns (model, result), or (None, None) once
+        every model has failed.
+        """
+        async def timed(model):
+            started = time.monotonic()
+            result = await attempt(model)
+            self._observe(model, time.monotonic() - started)
+            return result
+
+        for i, model in enumerate(self.models):
+            if not self.breakers[model].allow():
+                continue
+            if i > 0:
+                self.fallbacks += 1
+            try:
+                result = await self._retrying(model, lambda: timed(model))
+                self.breakers[model].record_success()
+                return model, result
+            except LLMError as e:
+                self.errors[model] += 1
+                self.breakers[model].record_failure()
+                print(f"❌ LLM {model} stream failed: {e}")
+        return None, None
+
+    def stats(self):
+        return {
+            "models": {
+                m: {
+                    "breaker": self.breakers[m].state,
+                    "errors": self.errors[m],
+                    "latency": self.latency[m].snapshot(),
+                }
+                for m in self.models
+            },
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+        }
+
+
+llm_client = LLMClient()
@@ -1,8 +1,29 @@
-from fastapi import FastAPI, Request, BackgroundTasks
+from warmup import warmup  # first import: its clock approximates process start
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from chat_logic import process_ai_message
-from database import init_pool, close_pool
+from dispatcher import ChatDispatcher
+from history_cache import history_cache
+from chatlog_writer import chat_log_writer
+from response_cache import response_cache
+from intent_router import intent_router
+from prompt_builder import prompt_builder
+from llm_client import llm_client
+from telegram_sender import telegram_sender
+from poller import UpdatePoller, parse_update, update_recorder
+from cluster import ClusterRouter, check_secret
+from shared_state import shared_state
+from update_dedup import update_dedup
+from database import init_pool, close_pool, start_invalidation_listener, stop_invalidation_listener, pool_stats
+from metrics import metrics
+from calculator import load_package_catalog
+from product_index import load_product_index
+from chat_retention import chat_retention
+from broadcast import broadcaster
+from retrieval import load_index
+from seed_data import seed_all
+from http_client import init_http_clients, close_http_clients, get_telegram_client
 import os
-import httpx
 import uvicorn
 import asyncio
 
@@ -10,51 +31,165 @@ app = FastAPI()
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 APP_PUBLIC_URL = os.environ.get("APP_PUBLIC_URL")
+# 'webhook' | 'polling' (getUpdates, no public URL needed) | 'replay' (poller.py --replay)
+INGEST_MODE = os.environ.get("INGEST_MODE", "webhook")
+# Apply changed seed datasets during warm-up (cluster leader only)
+SEED_ON_STARTUP = os.environ.get("SEED_ON_STARTUP", "1") == "1"
+
+async def handle_message(chat_id, text):
+    # Updates are accepted during warm-up; processing waits for the DB/caches
+    await warmup.wait_ready()
+    await process_ai_message(chat_id, text)
+
+# Bounded per-chat work queue (replaces unbounded BackgroundTasks)
+dispatcher = ChatDispatcher(handle_message)
+# Chat affinity across workers/nodes (single-node: everything is local)
+router = ClusterRouter(dispatcher)
+poller = UpdatePoller(dispatcher, router)
+
+# Component stats exported as gauges on /metrics (one series set per worker)
+metrics.set_labels(node=router.node_id)
+for _name, _fn in [("dispatcher", dispatcher.stats), ("history_cache", history_cache.stats),
+                   ("chat_log_writer", chat_log_writer.stats), ("response_cache", response_cache.stats),
+                   ("fast_path", intent_router.stats),
+                   ("telegram_sender", telegram_sender.stats), ("poller", poller.stats),
+                   ("cluster", router.stats), ("update_dedup", update_dedup.stats),
+                   ("db_pool", pool_stats), ("chat_retention", chat_retention.stats),
+                   ("broadcast", broadcaster.stats)]:
+    metrics.add_source(_name, _fn)
+
+async def start_ingest():
+    """Set Webhook (or start long polling; one worker polls for the cluster)."""
+    if INGEST_MODE == "polling":
+        if router.is_leader:
+            await poller.start()
+    elif INGEST_MODE == "webhook" and TELEGRAM_BOT_TOKEN and APP_PUBLIC_URL:
+        webhook_url = f"{APP_PUBLIC_URL}/webhook"
+        try:
+            await get_telegram_client().get("/setWebhook", params={"url": webhook_url})
+            print(f"✅ Webhook set to {webhook_url}")
+        except Exception as e:
+            print(f"❌ Webhook Error: {e}")
+
+async def seed():
+    if SEED_ON_STARTUP and router.is_leader:
+        await seed_all()
+
+async def start_retention():
+    """chat_history partitions / archival: one worker per cluster."""
+    if router.is_leader:
+        await chat_retention.start()
+
+async def start_broadcaster():
+    """Queued broadcasts are sent by one worker per cluster (at broadcast priority)."""
+    if router.is_leader:
+        await broadcaster.start()
 
 @app.on_event("startup")
 async def startup_event():
-    # 1. Init DB Pool
-    await init_pool()
-    
-    # 2. Set Webhook
-    if TELEGRAM_BOT_TOKEN and APP_PUBLIC_URL:
-        webhook_url = f"{APP_PUBLIC_URL}/webhook"
-        # We can use httpx here too for consistency
-        async with httpx.AsyncClient() as client:
-            try:
-                await client.get(f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/setWebhook?url={webhook_url}")
-                print(f"✅ Webhook set to {webhook_url}")
-            except Exception as e:
-                print(f"❌ Webhook Error: {e}")
+    # 1. Fast path: HTTP clients, outbound sender, message workers + write-behind chat logger
+    await init_http_clients()
+    telegram_sender.set_share(router.stats()["nodes"])   # the bot's global limit is split across workers
+    telegram_sender.start()
+    chat_log_writer.start()
+    dispatcher.start()
+    update_dedup.expect_load()
+    warmup.accepting()
+
+    # 2. Everything else warms up in the background (progress on /ready)
+    warmup.start([
+        ("ingest", start_ingest),
+        ("db_pool", init_pool),
+        ("invalidation_listener", start_invalidation_listener),
+        ("shared_state", shared_state.start),
+        ("update_dedup", update_dedup.start),
+        ("seed", seed),
+        ("vector_index", load_index),
+        ("package_catalog", load_package_catalog),
+        ("product_index", load_product_index),
+        ("chat_retention", start_retention),
+        ("broadcaster", start_broadcaster),
+    ])
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await warmup.stop()
+    await chat_retention.stop()
+    await broadcaster.stop()   # checkpoints and hands back a running broadcast
+    await poller.stop()
+    await dispatcher.stop(drain=True)
+    await chat_log_writer.stop()  # flush pending chat_history rows
+    await telegram_sender.stop()  # let queued replies go out
+    await close_http_clients()
+    update_recorder.close()
+    await update_dedup.stop()   # persist the update_id high-water mark
+    await shared_state.close()
+    await stop_invalidation_listener()
     await close_pool()
 
 @app.get("/")
 def home():
     return {"status": "MeeSaya Bot v2.1 (Async + RAG) Active"}
 
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until warm-up has finished."""
+    return JSONResponse(warmup.status(), status_code=200 if warmup.ready else 503)
+
+@app.get("/stats")
+def stats():
+    return {"dispatcher": dispatcher.stats(), "history_cache": history_cache.stats(),
+            "chat_log_writer": chat_log_writer.stats(),
+            "response_cache": response_cache.stats(),
+            "fast_path": intent_router.stats(),
+            "prompt_builder": prompt_builder.stats(),
+            "llm": llm_client.stats(),
+            "telegram_sender": telegram_sender.stats(),
+            "poller": poller.stats(),
+            "cluster": router.stats(),
+            "shared_state": shared_state.stats(),
+            "update_dedup": update_dedup.stats(),
+            "db_pool": pool_stats(),
+            "chat_retention": chat_retention.stats(),
+            "broadcast": broadcaster.stats(),
+            "stages": metrics.stats(),
+            "startup": warmup.status()}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint (per worker; scrape each worker's internal port)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/webhook")
-async def telegram_webhook(request: Request, background_tasks: BackgroundTasks):
+async def telegram_webhook(request: Request):
     try:
         data = await request.json()
     except:
         return {"status": "error"}
     
-    if "message" in data:
-        msg = data["message"]
-        chat_id = msg.get("chat", {}).get("id")
-        text = msg.get("text", "")
-        
-        if chat_id and text:
-            # Add async task to background
-            background_tasks.add_task(process_ai_message, chat_id, text)
+    parsed = parse_update(data)
+    if parsed:
+        # Queue on the owning worker's chat lane; 429 tells Telegram to retry later
+        if not await router.route(*parsed, update_id=data.get("update_id")):
+            return JSONResponse({"status": "busy"}, status_code=429)
+    update_recorder.write([data])
             
     return {"status": "ok"}
 
+@app.post("/internal/dispatch")
+async def internal_dispatch(request: Request):
+    """Updates forwarded by other workers (cluster.py); always handled here."""
+    if not router.is_internal(request.scope):
+        return JSONResponse({"detail": "Not Found"}, status_code=404)   # not on the public port
+    if not check_secret(request.headers):
+        return JSONResponse({"status": "forbidden"}, status_code=403)
+    data = await request.json()
+    if not await router.submit_local(data["chat_id"], data["text"], data.get("update_id")):
+        return JSONResponse({"status": "busy"}, status_code=429)
+    return {"status": "ok"}
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 8000))
-    # 'workers' is for multiprocess, but for async usually 1 worker is enough for IO bound unless CPU bound.
+    # Single process; for several chat-affine workers use: python cluster.py --workers N
     # reload=True is good for dev.
     uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
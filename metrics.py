@@ -0,0 +1,262 @@
+import os
+import re
+import json
+import time
+import uuid
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Metrics, per-stage timers and per-update traces.
+#
+# - Counters and latency histograms, rendered in Prometheus text format on
+#   GET /metrics, plus the numeric fields of every component's stats()
+#   (registered with add_source) as gauges.
+# - stage("rag") times a block of the message pipeline; the timing goes to the
+#   meesaya_stage_seconds histogram and to the current trace.
+# - The dispatcher opens a trace per message (id = Telegram update_id when
+#   known), carried by a contextvar through every task the handler creates.
+#   With LOG_FORMAT=json each turn ends with one JSON log line holding the
+#   trace id and stage timings.
+
+METRICS_PREFIX = os.environ.get("METRICS_PREFIX", "meesaya_")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")   # text | json
+# Text mode only logs turns slower than this (JSON mode logs every turn)
+SLOW_TURN_SECONDS = float(os.environ.get("SLOW_TURN_SECONDS", 8.0))
+
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0)
+
+
+class LatencyHistogram:
+    """Per-bucket counts (rendered cumulatively) + a recent window for percentiles."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # last = +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=500)
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(self.buckets) and seconds > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def percentile(self, q):
+        if not self.recent:
+            return None
+        data = sorted(self.recent)
+        return data[min(len(data) - 1, int(q * len(data)))]
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], self.counts)),
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+        }
+
+
+# --- traces ---
+
+class Trace:
+    __slots__ = ("id", "chat_id", "started", "stages", "counts")
+
+    def __init__(self, chat_id, trace_id=None):
+        self.id = str(trace_id) if trace_id is not None else uuid.uuid4().hex[:12]
+        self.chat_id = chat_id
+        self.started = time.monotonic()
+        self.stages = {}   # name -> seconds (summed when a stage repeats)
+        self.counts = {}   # name -> events in this turn (e.g. db_queries)
+
+
+_trace = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace_id():
+    t = _trace.get()
+    return t.id if t else None
+
+
+def log_event(event, level="info", **fields):
+    """One structured log line (JSON with LOG_FORMAT=json)."""
+    if LOG_FORMAT == "json":
+        record = {"ts": round(time.time(), 3), "level": level, "event": event, "trace_id": current_trace_id()}
+        record.update(fields)
+        print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+    else:
+        icon = {"error": "❌", "warning": "⚠️"}.get(level, "⏱️")
+        trace_id = current_trace_id()
+        details = " ".join(f"{k}={v}" for k, v in fields.items())
+        print(f"{icon} {event}" + (f" [{trace_id}]" if trace_id else "") + (f" {details}" if details else ""))
+
+
+# --- registry ---
+
+def _name(name):
+    return METRICS_PREFIX + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _key(name, labels):
+    # Label values as strings, so series sort and compare consistently
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, bool):
+        out[prefix] = int(value)
+    elif isinstance(value, (int, float)):
+        out[prefix] = value
+    elif isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}_{k}", v, out)
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}     # (name, labels) -> value
+        self.histograms = {}   # (name, labels) -> LatencyHistogram
+        self.sources = []      # (prefix, stats fn)
+        self.budgets = {}      # per-turn count name -> limit
+        self.const_labels = ()
+
+    def set_labels(self, **labels):
+        """Labels added to every series (e.g. node=<cluster node id>)."""
+        self.const_labels = _key("", {k: v for k, v in labels.items() if v})[1]
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, buckets=STAGE_BUCKETS, **labels):
+        key = _key(name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = LatencyHistogram(buckets)
+        hist.observe(seconds)
+
+    def count(self, name, value=1):
+        """Per-turn count on the current trace (checked against set_budget())."""
+        t = _trace.get()
+        if t is not None:
+            t.counts[name] = t.counts.get(name, 0) + value
+
+    def set_budget(self, name, limit):
+        """Flag turns whose count(name) exceeds `limit` (0 disables)."""
+        self.budgets[name] = limit
+
+    def add_source(self, prefix, fn):
+        """Export the numeric fields of fn() (a stats() dict) as gauges."""
+        self.sources.append((prefix, fn))
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage (usable around awaits)."""
+        started = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self.inc("stage_errors_total", stage=name)
+            raise
+        finally:
+            elapsed = time.monotonic() - started
+            self.observe("stage_seconds", elapsed, stage=name)
+            t = _trace.get()
+            if t is not None:
+                t.stages[name] = t.stages.get(name, 0.0) + elapsed
+
+    @contextmanager
+    def trace(self, chat_id, trace_id=None, queued=None):
+        """One message turn; ends with a turn histogram sample and a log line."""
+        t = Trace(chat_id, trace_id)
+        if queued is not None:
+            t.stages["queue"] = queued
+        token = _trace.set(t)
+        outcome = "ok"
+        try:
+            yield t
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            total = time.monotonic() - t.started
+            self.observe("turn_seconds", total)
+            self.inc("turns_total", outcome=outcome)
+            over = [name for name, limit in self.budgets.items() if limit and t.counts.get(name, 0) > limit]
+            for name in over:
+                self.inc("turn_budget_exceeded_total", counter=name)
+            if LOG_FORMAT == "json" or total >= SLOW_TURN_SECONDS or outcome != "ok" or over:
+                level = "error" if outcome != "ok" else "warning" if over else "info"
+                log_event("turn", level=level, chat_id=chat_id, outcome=outcome,
+                          total_ms=round(total * 1000, 1),
+                          stages={k: round(v * 1000, 1) for k, v in t.stages.items()},
+                          counts=t.counts, over_budget=over or None)
+            _trace.reset(token)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = []
+        const = self.const_labels
+
+        seen = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = _name(name)
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(const + labels)} {value}")
+
+        seen = set()
+        for (name, labels), hist in sorted(self.histograms.items()):
+            metric = _name(name)
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip([str(b) for b in hist.buckets] + ["+Inf"], hist.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_labels(const + labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(const + labels)} {hist.sum:.6f}")
+            lines.append(f"{metric}_count{_labels(const + labels)} {hist.count}")
+
+        for prefix, fn in self.sources:
+            try:
+                values = {}
+                _flatten(prefix, fn(), values)
+            except Exception as e:
+                lines.append(f"# {prefix} unavailable: {e}")
+                continue
+            for key, value in values.items():
+                metric = _name(key)
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric}{_labels(const)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def stats(self):
+        """Stage percentiles for /stats."""
+        return {
+            labels[0][1] if labels else "turn": {
+                "count": h.count,
+                "p50_ms": round(h.percentile(0.50) * 1000, 1) if h.recent else None,
+                "p95_ms": round(h.percentile(0.95) * 1000, 1) if h.recent else None,
+            }
+            for (name, labels), h in sorted(self.histograms.items())
+            if name in ("stage_seconds", "turn_seconds")
+        }
+
+
+metrics = Metrics()
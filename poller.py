@@ -0,0 +1,238 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import urlparse
+from http_client import get_telegram_client, TELEGRAM_API_BASE, OPENROUTER_BASE_URL
+from dispatcher import REJECTED
+
+# getUpdates long-polling ingest (alternative to the webhook).
+#
+# Pulls batches of up to 100 updates per call and feeds them into the same
+# dispatcher as /webhook. The offset only moves past an update once it has been
+# queued, and a full dispatcher pauses polling instead of dropping updates.
+# The same runner can replay a recorded update log (JSONL, one update per line)
+# at a target rate, for throughput benchmarks without Telegram. Replay runs the
+# full pipeline (replies, LLM calls), so it refuses to start unless
+# TELEGRAM_API_BASE and OPENROUTER_BASE_URL point at local stubs.
+#
+#   python poller.py                                   # poll Telegram
+#   python poller.py --replay updates.jsonl --rate 50  # replay a log
+
+POLL_TIMEOUT = int(os.environ.get("POLL_TIMEOUT", 30))
+POLL_BATCH_SIZE = min(100, int(os.environ.get("POLL_BATCH_SIZE", 100)))
+POLL_RETRY_DELAY = float(os.environ.get("POLL_RETRY_DELAY", 2.0))
+_LOCAL_HOSTS = {"localhost", "127.0.0.1", "::1"}
+# Append every ingested update to this JSONL file (for --replay)
+UPDATE_LOG_FILE = os.environ.get("UPDATE_LOG_FILE")
+
+
+def parse_update(update):
+    """(chat_id, text) for a text message update, else None."""
+    msg = update.get("message")
+    if not msg:
+        return None
+    chat_id = msg.get("chat", {}).get("id")
+    text = msg.get("text", "")
+    if chat_id and text:
+        return chat_id, text
+    return None
+
+
+class UpdateRecorder:
+    """Appends raw updates to a JSONL log, flushed per batch."""
+
+    def __init__(self, path=UPDATE_LOG_FILE):
+        self.path = path
+        self._file = None
+
+    def write(self, updates):
+        if not self.path or not updates:
+            return
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        for update in updates:
+            self._file.write(json.dumps(update, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+update_recorder = UpdateRecorder()
+
+
+async def submit_update(dispatcher, update, wait=True, router=None):
+    """
+    Queue one update on the dispatcher (or on its owner via `router`, see
+    cluster.py). Returns False if it isn't a text message or wasn't accepted.
+    With wait=True a full dispatcher is waited on until it has room: pollers
+    can afford backpressure, unlike the webhook, which answers 429 instead.
+    """
+    parsed = parse_update(update)
+    if parsed is None:
+        return False
+    while True:
+        while wait and dispatcher.running and dispatcher.saturated:
+            await asyncio.sleep(0.05)
+        if router is not None:
+            ok = await router.route(*parsed, update_id=update.get("update_id"))
+        else:
+            ok = dispatcher.submit(*parsed, trace_id=update.get("update_id")) != REJECTED
+        if ok or not wait or not dispatcher.running:
+            return ok
+        await asyncio.sleep(0.05)
+
+
+class UpdatePoller:
+    def __init__(self, dispatcher, router=None, timeout=POLL_TIMEOUT, batch_size=POLL_BATCH_SIZE):
+        self.dispatcher = dispatcher
+        self.router = router
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.offset = None
+        self._task = None
+
+        # Metrics
+        self.polls = 0
+        self.received = 0
+        self.errors = 0
+
+    async def _get_updates(self, timeout):
+        params = {"timeout": timeout, "limit": self.batch_size,
+                  "allowed_updates": json.dumps(["message"])}
+        if self.offset is not None:
+            params["offset"] = self.offset
+        # Long poll: the HTTP read timeout must outlast Telegram's
+        r = await get_telegram_client().get("/getUpdates", params=params, timeout=timeout + 10)
+        data = r.json()
+        if not data.get("ok"):
+            raise RuntimeError(f"getUpdates failed ({r.status_code}): {data.get('description')}")
+        return data["result"]
+
+    async def _run(self):
+        while True:
+            try:
+                updates = await self._get_updates(self.timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Polling Error: {e}")
+                await asyncio.sleep(POLL_RETRY_DELAY)
+                continue
+
+            self.polls += 1
+            self.received += len(updates)
+            update_recorder.write(updates)
+            for update in updates:
+                await submit_update(self.dispatcher, update, router=self.router)
+                self.offset = update["update_id"] + 1
+
+    async def start(self):
+        if self._task:
+            return
+        # getUpdates is refused (409) while a webhook is set
+        await get_telegram_client().post("/deleteWebhook")
+        self._task = asyncio.create_task(self._run())
+        print(f"✅ Polling Started (timeout={self.timeout}s, batch={self.batch_size})")
+
+    async def stop(self):
+        """Stop fetching and confirm the offset; queued work is drained by the dispatcher."""
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self.offset is not None:
+            # Telegram only forgets updates once a later offset is requested
+            try:
+                params = {"offset": self.offset, "timeout": 0, "limit": 1}
+                await get_telegram_client().get("/getUpdates", params=params)
+            except Exception as e:
+                print(f"⚠️ Could not confirm polling offset: {e}")
+        print(f"🛑 Polling Stopped (offset={self.offset})")
+
+    def stats(self):
+        return {"polls": self.polls, "received": self.received,
+                "errors": self.errors, "offset": self.offset}
+
+
+def replay_targets_remote():
+    """Configured endpoints that are not local stubs (replay would message real users / spend credits)."""
+    endpoints = {"TELEGRAM_API_BASE": TELEGRAM_API_BASE, "OPENROUTER_BASE_URL": OPENROUTER_BASE_URL}
+    return [name for name, url in endpoints.items() if urlparse(url).hostname not in _LOCAL_HOSTS]
+
+
+def load_update_log(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def replay_updates(dispatcher, updates, rate=0.0):
+    """
+    Feed recorded updates into the dispatcher at `rate` updates/s (0 = as fast
+    as it accepts them), wait for processing to finish, and return timings.
+    """
+    started = time.monotonic()
+    submitted = 0
+    for i, update in enumerate(updates):
+        if rate > 0:
+            delay = started + i / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if await submit_update(dispatcher, update):
+            submitted += 1
+    ingest_seconds = time.monotonic() - started
+
+    while dispatcher.busy:
+        await asyncio.sleep(0.05)
+    total_seconds = time.monotonic() - started
+
+    return {
+        "updates": len(updates),
+        "submitted": submitted,
+        "ingest_seconds": round(ingest_seconds, 3),
+        "total_seconds": round(total_seconds, 3),
+        "throughput": round(submitted / total_seconds, 2) if total_seconds else 0.0,
+        "dispatcher": dispatcher.stats(),
+    }
+
+
+async def _main(args):
+    if args.replay:
+        remote = replay_targets_remote()
+        if remote:
+            print(f"🛑 Refusing to replay: {', '.join(remote)} not a local stub (see benchmark.py)")
+            raise SystemExit(2)
+
+    # Reuse the server's startup/shutdown, minus the webhook
+    os.environ["INGEST_MODE"] = "replay" if args.replay else "polling"
+    import main
+    if args.concurrency:
+        main.dispatcher.worker_count = args.concurrency
+
+    await main.startup_event()
+    await main.warmup.wait_ready()
+    try:
+        if args.replay:
+            result = await replay_updates(main.dispatcher, load_update_log(args.replay), args.rate)
+            print(json.dumps(result, indent=2))
+        else:
+            await asyncio.Event().wait()   # until Ctrl+C
+    finally:
+        await main.shutdown_event()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Long-polling / replay runner")
+    parser.add_argument("--replay", help="JSONL update log to replay instead of polling Telegram")
+    parser.add_argument("--rate", type=float, default=0.0, help="Replay rate in updates/s (0 = unthrottled)")
+    parser.add_argument("--concurrency", type=int, help="Dispatcher workers (default DISPATCH_WORKERS)")
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
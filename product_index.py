@@ -0,0 +1,243 @@
+import re
+import math
+from collections import namedtuple
+from database import get_db_connection, register_invalidation_handler
+from text_utils import normalize_text, search_tokens
+
+# In-memory product search over products_inventory.
+#
+# - Inverted index: token -> {product id: field weight} over brand, model,
+#   category, tags and specs (same tokenizer as the knowledge base).
+# - Numeric attributes parsed from specs (kW/W, V, Ah, kWh) for range filters,
+#   plus price filters parsed from the query ("under 2M", "20 သိန်းအောက်").
+# - Ranked by field-weighted IDF, then price.
+# Rows are diffed on reload, so only changed products are re-tokenized when
+# seed_data.py sends NOTIFY meesaya_invalidate, 'products_inventory'.
+#
+#   "6kW 48V inverter under 2M" -> Growatt SPF 6000 ES Plus, no DB round trip.
+
+PRODUCT_SEARCH_LIMIT = 4
+# Spec matches within this relative tolerance count ("5.9kW" ~ "6kW")
+ATTRIBUTE_TOLERANCE = 0.1
+
+FIELD_WEIGHTS = {"brand": 3.0, "model": 3.0, "category": 2.0, "tags": 1.0, "specs": 1.0}
+
+Product = namedtuple("Product", ["id", "category", "brand", "model", "specs", "price", "warranty_years", "tags"])
+
+_BURMESE_DIGITS = str.maketrans("၀၁၂၃၄၅၆၇၈၉", "0123456789")
+
+# number + unit -> (attribute, multiplier); longest units first
+_UNIT = re.compile(r"(\d+(?:\.\d+)?)\s*(kwh|kw|wh|ah|w|v)\b")
+_UNITS = {
+    "kw": ("power_w", 1000.0), "w": ("power_w", 1.0),
+    "kwh": ("energy_wh", 1000.0), "wh": ("energy_wh", 1.0),
+    "ah": ("capacity_ah", 1.0), "v": ("voltage_v", 1.0),
+}
+
+# Money: "2M", "2,000,000", "1.5 million", "20 သိန်း" (lakh), "2 သန်း"
+_AMOUNT = r"(\d[\d,]*(?:\.\d+)?)\s*(m|mil|million|k|lakh|lakhs|သိန်း|သန်း)?"
+_MULTIPLIERS = {"m": 1e6, "mil": 1e6, "million": 1e6, "သန်း": 1e6, "k": 1e3, "lakh": 1e5, "lakhs": 1e5, "သိန်း": 1e5}
+_PRICE_BETWEEN = re.compile(r"between\s+" + _AMOUNT + r"\s*(?:and|-|to)\s*" + _AMOUNT)
+_PRICE_MAX = re.compile(r"(?:under|below|less than|max|<=?|upto|up to)\s*" + _AMOUNT + r"|" + _AMOUNT + r"\s*(?:အောက်|အတွင်း)")
+_PRICE_MIN = re.compile(r"(?:over|above|more than|min|>=?)\s*" + _AMOUNT + r"|" + _AMOUNT + r"\s*(?:အထက်|ကျော်)")
+
+# Query words -> indexed tokens
+SYNONYMS = {"inverters": "inverter", "batteries": "battery", "panels": "panel", "solar": "panel"}
+BURMESE_SYNONYMS = {
+    "အင်ဗာတာ": "inverter", "ဘက်ထရီ": "battery", "ဘတ်ထရီ": "battery", "ဆိုလာပြား": "panel", "ဆိုလာ": "panel",
+}
+# Words that say nothing about which product is wanted
+STOPWORDS = {"the", "a", "an", "for", "with", "and", "or", "of", "price", "how", "much", "is", "mmk", "ks", "kyat"}
+
+
+def _amount(number, unit):
+    value = float(number.replace(",", ""))
+    return value * _MULTIPLIERS.get(unit or "", 1.0)
+
+
+def parse_attributes(text):
+    """'6kW 48V' -> {'power_w': 6000.0, 'voltage_v': 48.0}"""
+    attrs = {}
+    for number, unit in _UNIT.findall(normalize_text(text).translate(_BURMESE_DIGITS)):
+        name, mult = _UNITS[unit]
+        attrs.setdefault(name, float(number) * mult)
+    return attrs
+
+
+def parse_query(query):
+    """-> (text tokens, attribute filters, min price, max price)"""
+    q = normalize_text(query).translate(_BURMESE_DIGITS)
+    min_price = max_price = None
+
+    m = _PRICE_BETWEEN.search(q)
+    if m:
+        min_price, max_price = _amount(m.group(1), m.group(2)), _amount(m.group(3), m.group(4))
+        q = q[:m.start()] + " " + q[m.end():]
+    m = _PRICE_MAX.search(q)
+    if m:
+        g = m.groups()
+        max_price = _amount(*(g[0:2] if g[0] else g[2:4]))
+        q = q[:m.start()] + " " + q[m.end():]
+    m = _PRICE_MIN.search(q)
+    if m:
+        g = m.groups()
+        min_price = _amount(*(g[0:2] if g[0] else g[2:4]))
+        q = q[:m.start()] + " " + q[m.end():]
+
+    attrs = parse_attributes(q)
+    q = _UNIT.sub(" ", q)
+    # Burmese words are split into syllables by search_tokens, so map them first
+    for word in sorted(BURMESE_SYNONYMS, key=len, reverse=True):
+        q = q.replace(word, f" {BURMESE_SYNONYMS[word]} ")
+    tokens = []
+    for t in search_tokens(q):
+        t = SYNONYMS.get(t, t)
+        if t not in STOPWORDS and t not in tokens:
+            tokens.append(t)
+    return tokens, attrs, min_price, max_price
+
+
+def _close(a, b):
+    return abs(a - b) <= ATTRIBUTE_TOLERANCE * max(abs(a), abs(b))
+
+
+def format_product(p):
+    return f"{p.category}: {p.brand} {p.model} ({p.specs}) - {p.price:,} MMK [{p.tags}]"
+
+
+class ProductIndex:
+    def __init__(self):
+        self.products = {}     # id -> Product
+        self.attributes = {}   # id -> parsed spec attributes
+        self._postings = {}    # token -> {id: weight}
+        self._tokens = {}      # id -> {token: weight} (for removal)
+
+    def __len__(self):
+        return len(self.products)
+
+    def _add(self, p):
+        weights = {}
+        for field, w in FIELD_WEIGHTS.items():
+            for t in search_tokens(getattr(p, field) or ""):
+                weights[t] = max(weights.get(t, 0.0), w)
+        self.products[p.id] = p
+        self.attributes[p.id] = parse_attributes(f"{p.specs or ''} {p.model or ''}")
+        self._tokens[p.id] = weights
+        for t, w in weights.items():
+            self._postings.setdefault(t, {})[p.id] = w
+
+    def _remove(self, pid):
+        for t in self._tokens.pop(pid, {}):
+            posting = self._postings.get(t)
+            if posting is not None:
+                posting.pop(pid, None)
+                if not posting:
+                    del self._postings[t]
+        self.products.pop(pid, None)
+        self.attributes.pop(pid, None)
+
+    def sync(self, products):
+        """Make the index match `products`; only new/changed/removed rows are touched."""
+        incoming = {p.id: p for p in products}
+        changed = 0
+        for pid in [pid for pid in self.products if pid not in incoming]:
+            self._remove(pid)
+            changed += 1
+        for pid, p in incoming.items():
+            if self.products.get(pid) != p:
+                self._remove(pid)
+                self._add(p)
+                changed += 1
+        return changed
+
+    def knows(self, token):
+        """True if some product is indexed under `token` (a parse_query() token)."""
+        return token in self._postings
+
+    def _idf(self, token):
+        return math.log(1 + len(self.products) / len(self._postings[token]))
+
+    def search(self, query, limit=PRODUCT_SEARCH_LIMIT):
+        """Ranked [Product] for a free-text query with spec/price filters."""
+        tokens, attrs, min_price, max_price = parse_query(query)
+
+        # Text score; tokens that match nothing at all (e.g. "need", "want") are ignored
+        scores = {}
+        for t in tokens:
+            posting = self._postings.get(t)
+            if not posting:
+                continue
+            idf = self._idf(t)
+            for pid, w in posting.items():
+                scores[pid] = scores.get(pid, 0.0) + w * idf
+        if scores:
+            candidates = scores.keys()
+        elif attrs or min_price is not None or max_price is not None:
+            candidates = self.products.keys()   # filters only, e.g. "48V under 2M"
+        else:
+            return []
+
+        results = []
+        for pid in candidates:
+            p = self.products[pid]
+            if min_price is not None and (p.price or 0) < min_price:
+                continue
+            if max_price is not None and (p.price or 0) > max_price:
+                continue
+            specs = self.attributes[pid]
+            if any(name not in specs or not _close(specs[name], value) for name, value in attrs.items()):
+                continue
+            results.append((-scores.get(pid, 0.0), p.price or 0, pid))
+
+        results.sort()
+        return [self.products[pid] for _, _, pid in results[:limit]]
+
+
+_index = ProductIndex()
+_loaded = False
+
+
+async def load_product_index():
+    global _loaded
+    async with get_db_connection() as conn:
+        rows = await conn.fetch("""
+            SELECT id, category, brand, model, specs, price, warranty_years, tags
+            FROM products_inventory
+        """)
+    changed = _index.sync(Product(**dict(r)) for r in rows)
+    _loaded = True
+    print(f"✅ Product Index Loaded ({len(_index)} products, {changed} re-indexed)")
+    return _index
+
+
+def invalidate_product_index():
+    global _loaded
+    _loaded = False
+
+
+register_invalidation_handler("products_inventory", invalidate_product_index)
+
+
+async def get_product_index():
+    if not _loaded:
+        try:
+            return await load_product_index()
+        except Exception as e:
+            # Keep serving the last snapshot if the DB is briefly unavailable
+            if len(_index):
+                print(f"❌ Product Index Refresh Error: {e}")
+                return _index
+            raise
+    return _index
+
+
+async def search_products(query_text, limit=PRODUCT_SEARCH_LIMIT):
+    """Formatted result lines, same shape as database.search_products_db()."""
+    try:
+        index = await get_product_index()
+    except Exception as e:
+        return [f"Search Error: {e}"]
+    products = index.search(query_text, limit)
+    if not products:
+        return ["No specific products found."]
+    return [format_product(p) for p in products]
@@ -0,0 +1,187 @@
+import os
+import re
+from collections import OrderedDict
+from text_utils import approx_token_count, truncate_to_tokens
+
+# Token-budgeted prompt assembly.
+#
+# Segments by value: system prompt and the user's message always go in; then
+# RAG context, recent turns newest-first, and the rolling summary of older
+# turns, until PROMPT_TOKEN_BUDGET is used. Long assistant replies are trimmed first
+# (Burmese is token-heavy), and turns that fall out of the verbatim window are
+# folded into a per-chat summary instead of being re-sent word for word.
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", 2000))
+PROMPT_RECENT_TURNS = int(os.environ.get("PROMPT_RECENT_TURNS", 6))
+PROMPT_TURN_MAX_TOKENS = int(os.environ.get("PROMPT_TURN_MAX_TOKENS", 250))
+PROMPT_RAG_MAX_TOKENS = int(os.environ.get("PROMPT_RAG_MAX_TOKENS", 600))
+SUMMARY_MAX_TOKENS = int(os.environ.get("SUMMARY_MAX_TOKENS", 300))
+SUMMARY_LINE_MAX_TOKENS = int(os.environ.get("SUMMARY_LINE_MAX_TOKENS", 40))
+SUMMARY_MAX_CHATS = int(os.environ.get("SUMMARY_MAX_CHATS", 5000))
+
+# Chat-format overhead per message (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Words that point back into the conversation ("how much is that one?",
+# "what about 3000W?", "အဲဒါ ဘယ်လောက်လဲ"); a question without them reads the
+# same in any chat
+_FOLLOWUP_EN = re.compile(
+    r"\b(?:it|its|that|this|these|those|them|they|one|ones|same|also|too|instead|another|other|"
+    r"more|else|again|above|previous|earlier|what about|how about|and)\b", re.IGNORECASE
+)
+_FOLLOWUP_MY = ("အဲဒါ", "အဲ့ဒါ", "အဲဒီ", "အဲ့ဒီ", "ဒါ", "ဒီ", "၎င်း", "ထို", "ရော", "ကော", "လည်း",
+                "ထပ်", "နောက်ထပ်", "အရင်က", "ခုနက", "အပေါ်က")
+
+
+def message_tokens(msg):
+    return approx_token_count(msg.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def _turn_id(turn):
+    # Identity of the turn, not its text: repeated "ok" / "thanks" turns must not collide
+    return turn.get("turn_id")
+
+
+class _Summary:
+    __slots__ = ("lines", "last_turn_id")
+
+    def __init__(self):
+        self.lines = []           # one compact line per folded turn, oldest first
+        self.last_turn_id = None  # newest turn already folded in
+
+    def text(self):
+        return "\n".join(self.lines)
+
+
+class PromptBuilder:
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET, recent_turns=PROMPT_RECENT_TURNS):
+        self.budget = budget
+        self.recent_turns = recent_turns
+        self._summaries = OrderedDict()   # chat_id -> _Summary (LRU)
+
+        # Stats
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.tokens_saved = 0
+
+    # --- rolling summary ---
+
+    def _update_summary(self, chat_id, older_turns):
+        """
+        Fold turns that left the verbatim window into the chat's summary.
+        Incremental: only turns after the last folded one are processed.
+        """
+        summary = self._summaries.get(chat_id)
+        if summary is None:
+            summary = self._summaries[chat_id] = _Summary()
+            while len(self._summaries) > SUMMARY_MAX_CHATS:
+                self._summaries.popitem(last=False)
+        self._summaries.move_to_end(chat_id)
+
+        ids = [_turn_id(t) for t in older_turns]
+        start = 0
+        if summary.last_turn_id is not None and summary.last_turn_id in ids:
+            start = ids.index(summary.last_turn_id) + 1
+        elif summary.last_turn_id is not None:
+            # History was reloaded/trimmed and we lost our place; start over
+            summary.lines = []
+
+        for turn in older_turns[start:]:
+            who = "User" if turn["role"] == "user" else "MeeSaya"
+            summary.lines.append(f"- {who}: {truncate_to_tokens(turn['content'], SUMMARY_LINE_MAX_TOKENS)}")
+        if older_turns:
+            summary.last_turn_id = ids[-1]
+
+        # Oldest lines go first when the summary outgrows its budget
+        while summary.lines and approx_token_count(summary.text()) > SUMMARY_MAX_TOKENS:
+            summary.lines.pop(0)
+        return summary.text()
+
+    def is_followup(self, user_text):
+        """True if the message refers back to the conversation (its answer depends on history)."""
+        return bool(_FOLLOWUP_EN.search(user_text)) or any(w in user_text for w in _FOLLOWUP_MY)
+
+    def forget(self, chat_id):
+        self._summaries.pop(str(chat_id), None)
+
+    # --- assembly ---
+
+    def build(self, chat_id, system_prompt, history, user_text, rag_context=""):
+        """
+        Returns (messages, stats) with stats = {"prompt_tokens", "naive_tokens", "saved"}.
+        `history` is oldest-first [{"role", "content"}], as many turns as are cached.
+        """
+        chat_id = str(chat_id)
+        recent = history[-self.recent_turns:] if self.recent_turns else []
+        older = history[:len(history) - len(recent)]
+
+        system_msg = {"role": "system", "content": system_prompt}
+        user_msg = {"role": "user", "content": user_text}
+        used = message_tokens(system_msg) + message_tokens(user_msg)
+
+        # RAG context (high value, but capped)
+        context_msg = None
+        if rag_context:
+            remaining = max(0, self.budget - used - MESSAGE_OVERHEAD_TOKENS)
+            context = truncate_to_tokens(rag_context, min(PROMPT_RAG_MAX_TOKENS, remaining))
+            if context:
+                context_msg = {"role": "system", "content": f"CONTEXT (FROM KNOWLEDGE BASE):\n{context}\n\nUse this context to answer if relevant."}
+                used += message_tokens(context_msg)
+
+        # Recent turns, newest first, trimmed per turn
+        kept = []
+        for turn in reversed(recent):
+            msg = {"role": turn["role"], "content": truncate_to_tokens(turn["content"], PROMPT_TURN_MAX_TOKENS)}
+            cost = message_tokens(msg)
+            if used + cost > self.budget:
+                break
+            kept.append(msg)
+            used += cost
+        kept.reverse()
+
+        # Rolling summary of older turns
+        summary_msg = None
+        summary = self._update_summary(chat_id, older)
+        if summary:
+            candidate = {"role": "system", "content": f"EARLIER CONVERSATION (SUMMARY):\n{summary}"}
+            if used + message_tokens(candidate) <= self.budget:
+                summary_msg = candidate
+                used += message_tokens(candidate)
+
+        messages = [system_msg]
+        if summary_msg:
+            messages.append(summary_msg)
+        messages.extend(kept)
+        if context_msg:
+            messages.append(context_msg)
+        messages.append(user_msg)
+
+        # What the old prompt (last turns verbatim + full context) would have cost
+        naive = message_tokens(system_msg) + message_tokens(user_msg) + sum(message_tokens(t) for t in recent)
+        if rag_context:
+            naive += approx_token_count(rag_context) + MESSAGE_OVERHEAD_TOKENS
+        saved = max(0, naive - used)
+
+        self.turns += 1
+        self.prompt_tokens += used
+        self.tokens_saved += saved
+        return messages, {"prompt_tokens": used, "naive_tokens": naive, "saved": saved}
+
+    def followup(self, messages):
+        """
+        Messages for the tool-result pass: the history turns are dropped (the
+        model already decided what to do), keeping system/context/summary + the question.
+        """
+        return [m for m in messages if m["role"] == "system"] + [m for m in messages if m["role"] == "user"][-1:]
+
+    def stats(self):
+        return {
+            "turns": self.turns,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.turns, 1) if self.turns else 0.0,
+            "tokens_saved": self.tokens_saved,
+            "avg_tokens_saved": round(self.tokens_saved / self.turns, 1) if self.turns else 0.0,
+            "summaries": len(self._summaries),
+        }
+
+
+prompt_builder = PromptBuilder()
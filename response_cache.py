@@ -0,0 +1,155 @@
+import os
+import re
+import time
+import string
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from database import register_invalidation_handler
+from text_utils import normalize_text
+from retrieval import embed_text
+
+# Response cache for repeated questions (load-shedding, error codes, prices).
+#
+# Key = normalised user text + fingerprint of (system prompt, RAG context), so
+# an answer is only reused when the model would have seen the same facts.
+# The context parts also include the model that wrote the answer. Callers only
+# cache standalone questions (prompt_builder.is_followup() finds no reference
+# back into the conversation) and complete answers, so a reply that depends
+# on one user's conversation is never shown to another.
+# Near-duplicate phrasings can also hit via cosine similarity of the query
+# embeddings within the same fingerprint. LRU + TTL; cleared whenever
+# sync_knowledge.py or seed_data.py change data (NOTIFY).
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 2000))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 6 * 3600))
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get("RESPONSE_CACHE_SIMILARITY", 0.92))  # 0 disables
+# Very short messages ("ok", "yes") depend on the conversation, never cache them
+RESPONSE_CACHE_MIN_CHARS = int(os.environ.get("RESPONSE_CACHE_MIN_CHARS", 8))
+
+
+_STRIP = re.compile("[\\s" + re.escape(string.punctuation) + "\u104a\u104b]+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def query_key(user_text):
+    """Normalised text without spaces/punctuation ('Error 04?' == 'error04')."""
+    return _STRIP.sub("", normalize_text(user_text))
+
+
+def fingerprint(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update((p or "").encode("utf-8"))
+        h.update(b"\x1f")
+    return h.hexdigest()
+
+
+class _Entry:
+    __slots__ = ("response", "created", "fp", "vec", "numbers")
+
+    def __init__(self, response, fp, vec, numbers):
+        self.response = response
+        self.created = time.monotonic()
+        self.fp = fp
+        self.vec = vec
+        self.numbers = numbers
+
+
+class ResponseCache:
+    def __init__(self, max_size=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL,
+                 similarity=RESPONSE_CACHE_SIMILARITY):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        self._entries = OrderedDict()   # (query_key, fp) -> _Entry
+        self._by_fp = {}                # fp -> set of keys (similarity candidates)
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def cacheable(self, user_text):
+        return len(normalize_text(user_text)) >= RESPONSE_CACHE_MIN_CHARS
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._by_fp.get(entry.fp)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_fp[entry.fp]
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.created > self.ttl:
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, user_text, *context_parts):
+        if not self.cacheable(user_text):
+            return None
+        query = normalize_text(user_text)
+        fp = fingerprint(*context_parts)
+
+        entry = self._fresh((query_key(query), fp))
+        if entry is not None:
+            self.hits += 1
+            return entry.response
+
+        if self.similarity > 0 and fp in self._by_fp:
+            # Numbers carry meaning ("Error 04" vs "Error 08", "2000W"), so they must match exactly
+            numbers = _NUMBER.findall(query)
+            keys = [k for k in list(self._by_fp[fp])
+                    if self._fresh(k) is not None and self._entries[k].numbers == numbers]
+            if keys:
+                vec = embed_text(query)
+                sims = np.stack([self._entries[k].vec for k in keys]) @ vec
+                best = int(np.argmax(sims))
+                if sims[best] >= self.similarity:
+                    self.similar_hits += 1
+                    return self._entries[keys[best]].response
+
+        self.misses += 1
+        return None
+
+    def put(self, user_text, response, *context_parts):
+        if not response or not self.cacheable(user_text):
+            return
+        query = normalize_text(user_text)
+        fp = fingerprint(*context_parts)
+        key = (query_key(query), fp)
+        self._drop(key)
+        vec = embed_text(query) if self.similarity > 0 else None
+        self._entries[key] = _Entry(response, fp, vec, _NUMBER.findall(query))
+        self._by_fp.setdefault(fp, set()).add(key)
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        self._entries.clear()
+        self._by_fp.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        total = self.hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.similar_hits) / total, 3) if total else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+response_cache = ResponseCache()
+
+register_invalidation_handler("knowledge_base", response_cache.clear)
+register_invalidation_handler("market_packages", response_cache.clear)
+register_invalidation_handler("products_inventory", response_cache.clear)
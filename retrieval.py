@@ -0,0 +1,261 @@
+import os
+import zlib
+import uuid
+import fcntl
+from contextlib import contextmanager
+import numpy as np
+from database import get_db_connection, register_invalidation_handler
+from text_utils import normalize_text, search_tokens
+
+# In-process vector retrieval over knowledge_base.
+#
+# Embeddings are hashed character n-grams + search tokens (Burmese syllables),
+# so they are computed offline with no model or network call. All rows live in
+# one contiguous float32 matrix (L2-normalised), so a top-k query is a single
+# matmul. The matrix is persisted as .npy and memory-mapped on startup.
+# The matrix, ids and content-hash files are published and read together under
+# a file lock, so workers rebuilding at the same time never mix one's ids with
+# another's matrix. The per-row content_hash (knowledge_base.content_hash) lets
+# a loader re-embed rows that were edited in place by another host.
+
+EMBEDDING_DIM = int(os.environ.get("EMBEDDING_DIM", 1024))
+EMBEDDINGS_PATH = os.environ.get("EMBEDDINGS_PATH", "kb_embeddings.npy")
+RAG_MIN_SCORE = float(os.environ.get("RAG_MIN_SCORE", 0.15))
+NGRAM_SIZES = (2, 3, 4)
+
+# Loaded index (module-level singleton, like the DB pool)
+_matrix = None       # (N, EMBEDDING_DIM) float32, possibly np.memmap
+_ids = None          # (N,) int64, knowledge_base.id per matrix row
+_HASH_DTYPE = "S32"  # md5 hex of the embedded row (see sync_knowledge.row_hash)
+_rows = []           # [(category, content)] aligned with _matrix
+
+
+def _sidecar_path(path, name):
+    return path[:-4] + f".{name}.npy" if path.endswith(".npy") else path + f".{name}.npy"
+
+
+def _ids_path(path):
+    return _sidecar_path(path, "ids")
+
+
+def _hashes_path(path):
+    return _sidecar_path(path, "hashes")
+
+
+def _features(text):
+    text = normalize_text(text)
+    padded = f" {text} "
+    for n in NGRAM_SIZES:
+        for i in range(len(padded) - n + 1):
+            yield padded[i:i + n]
+    # Whole tokens (words / syllables / bigrams) carry more signal than raw n-grams
+    for tok in search_tokens(text):
+        yield "#" + tok
+
+
+def embed_text(text, dim=EMBEDDING_DIM):
+    """Hashed n-gram embedding, L2-normalised float32 vector."""
+    vec = np.zeros(dim, dtype=np.float32)
+    for feat in _features(text):
+        h = zlib.crc32(feat.encode("utf-8"))
+        # Signed hashing keeps collisions from only ever adding up
+        vec[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+def embed_batch(texts, dim=EMBEDDING_DIM):
+    out = np.empty((len(texts), dim), dtype=np.float32)
+    for i, t in enumerate(texts):
+        out[i] = embed_text(t, dim)
+    return out
+
+
+def _row_text(category, content):
+    return f"{category or ''} {content}"
+
+
+async def _fetch_rows():
+    async with get_db_connection() as conn:
+        return await conn.fetch("""
+            SELECT id, category, content,
+                   COALESCE(content_hash, md5(coalesce(category, '') || chr(31) || content)) AS content_hash
+            FROM knowledge_base ORDER BY id
+        """)
+
+
+def _hashes(values):
+    return np.array([v.encode("ascii") for v in values], dtype=_HASH_DTYPE)
+
+
+@contextmanager
+def _locked(path, exclusive):
+    """flock on <path>.lock: shared for readers, exclusive while publishing."""
+    with open(path + ".lock", "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _write_tmp(path, array):
+    # Unique per writer, so concurrent rebuilds never write into the same file
+    tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    return tmp
+
+
+def _save(matrix, ids, hashes, path=EMBEDDINGS_PATH):
+    # Write-then-rename, so a process memory-mapping the old file is unaffected
+    tmp_matrix = _write_tmp(path, np.ascontiguousarray(matrix, dtype=np.float32))
+    tmp_ids = _write_tmp(_ids_path(path), np.asarray(ids, dtype=np.int64))
+    tmp_hashes = _write_tmp(_hashes_path(path), np.asarray(hashes, dtype=_HASH_DTYPE))
+    with _locked(path, exclusive=True):
+        os.replace(tmp_matrix, path)
+        os.replace(tmp_ids, _ids_path(path))
+        os.replace(tmp_hashes, _hashes_path(path))
+
+
+def _load(path, mmap_mode=None):
+    """(ids, hashes, matrix) from one consistent publish."""
+    with _locked(path, exclusive=False):
+        ids = np.load(_ids_path(path))
+        hashes = np.load(_hashes_path(path))
+        matrix = np.load(path, mmap_mode=mmap_mode)
+    if matrix.shape != (len(ids), EMBEDDING_DIM) or hashes.shape != ids.shape:
+        raise ValueError("corrupt embeddings")
+    return ids, hashes, matrix
+
+
+async def build_index(path=EMBEDDINGS_PATH):
+    """Embed every knowledge_base row and write the .npy files."""
+    global _matrix, _ids, _rows
+    rows = await _fetch_rows()
+    ids = np.array([r['id'] for r in rows], dtype=np.int64)
+    matrix = embed_batch([_row_text(r['category'], r['content']) for r in rows])
+    _save(matrix, ids, _hashes([r['content_hash'] for r in rows]), path)
+    _matrix, _ids, _rows = matrix, ids, [(r['category'], r['content']) for r in rows]
+    print(f"✅ Vector Index Built ({len(ids)} rows -> {path})")
+    return len(ids)
+
+
+async def apply_changes(upserted, deleted_ids, path=EMBEDDINGS_PATH):
+    """
+    Incremental re-index after a sync: only embed the upserted rows.
+    upserted: [(id, category, content, content_hash)], deleted_ids: [id]
+    Falls back to a full build when there is no usable saved index.
+    """
+    try:
+        ids, hashes, matrix = _load(path)
+    except Exception:
+        return await build_index(path)
+
+    keep = ~np.isin(ids, np.asarray(deleted_ids, dtype=np.int64))
+    ids, hashes, matrix = ids[keep], hashes[keep], matrix[keep]
+
+    if upserted:
+        new_ids = np.array([u[0] for u in upserted], dtype=np.int64)
+        new_hashes = _hashes([u[3] for u in upserted])
+        new_vecs = embed_batch([_row_text(u[1], u[2]) for u in upserted])
+        pos = {int(i): n for n, i in enumerate(ids)}
+        fresh = []
+        for i, h, vec in zip(new_ids, new_hashes, new_vecs):
+            if int(i) in pos:
+                matrix[pos[int(i)]] = vec          # updated row keeps its slot
+                hashes[pos[int(i)]] = h
+            else:
+                fresh.append((i, h, vec))
+        if fresh:
+            ids = np.concatenate([ids, np.array([f[0] for f in fresh], dtype=np.int64)])
+            hashes = np.concatenate([hashes, np.array([f[1] for f in fresh], dtype=_HASH_DTYPE)])
+            matrix = np.vstack([matrix, np.stack([f[2] for f in fresh])])
+        # Keep the same row order as load_index (ORDER BY id)
+        order = np.argsort(ids, kind="stable")
+        ids, hashes, matrix = ids[order], hashes[order], matrix[order]
+
+    _save(matrix, ids, hashes, path)
+    print(f"✅ Vector Index Updated ({len(upserted)} re-embedded, {len(deleted_ids)} removed)")
+    # Refresh this process's view (row texts changed too)
+    await load_index(path)
+    return len(ids)
+
+
+async def load_index(path=EMBEDDINGS_PATH):
+    """
+    Load the index at startup. Memory-maps the saved matrix when it matches the
+    table, re-embeds rows whose content_hash changed (edited elsewhere, same
+    id), and rebuilds it when the set of ids differs.
+    """
+    global _matrix, _ids, _rows
+    try:
+        rows = await _fetch_rows()
+    except Exception as e:
+        print(f"❌ Vector Index Error: {e}")
+        return False
+
+    ids = np.array([r['id'] for r in rows], dtype=np.int64)
+    hashes = _hashes([r['content_hash'] for r in rows])
+    try:
+        saved_ids, saved_hashes, matrix = _load(path, mmap_mode="r")
+        if not np.array_equal(saved_ids, ids):
+            raise ValueError("stale embeddings")
+    except Exception:
+        await build_index(path)
+        return True
+
+    changed = np.flatnonzero(saved_hashes != hashes)
+    if len(changed):
+        matrix = np.array(matrix)   # private copy of the read-only mmap
+        matrix[changed] = embed_batch([_row_text(rows[i]['category'], rows[i]['content']) for i in changed])
+        _save(matrix, ids, hashes, path)
+        print(f"✅ Vector Index Refreshed ({len(changed)} edited rows re-embedded)")
+        matrix = _load(path, mmap_mode="r")[2]
+
+    _matrix, _ids, _rows = matrix, ids, [(r['category'], r['content']) for r in rows]
+    print(f"✅ Vector Index Loaded ({len(ids)} rows, mmap)")
+    return True
+
+
+# Reload when sync_knowledge.py / seed_data.py change the table
+register_invalidation_handler("knowledge_base", load_index)
+
+
+def is_ready():
+    return _matrix is not None and len(_rows) > 0
+
+
+def search_batch(queries, k=2, min_score=RAG_MIN_SCORE):
+    """
+    Top-k for many queries at once: one (Q x D) @ (D x N) matmul.
+    Returns, per query, a list of (score, category, content).
+    """
+    if not is_ready() or not queries:
+        return [[] for _ in queries]
+
+    q = embed_batch(queries)
+    scores = q @ _matrix.T                       # (Q, N)
+    k = min(k, scores.shape[1])
+    # argpartition is O(N) per row; only the k winners get sorted
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    results = []
+    for qi in range(len(queries)):
+        idx = top[qi][np.argsort(-scores[qi, top[qi]])]
+        results.append([
+            (float(scores[qi, j]), _rows[j][0], _rows[j][1])
+            for j in idx if scores[qi, j] >= min_score
+        ])
+    return results
+
+
+def search(query_text, k=2, min_score=RAG_MIN_SCORE):
+    return search_batch([query_text], k, min_score)[0]
+
+
+def search_context(query_text, k=2):
+    """Same output format as database.search_knowledge_base."""
+    hits = search(query_text, k)
+    return "\n".join([f"[Context: {cat}] {content}" for _, cat, content in hits])
@@ -1,64 +1,181 @@
-import os
-import psycopg2
-from dotenv import load_dotenv
-
-load_dotenv()
-
-DB_URL = os.environ.get("DATABASE_URL")
-
-def seed_data():
-    conn = psycopg2.connect(DB_URL)
-    cur = conn.cursor()
-
-    print("🌱 Seeding Data...")
-
-    # 1. MARKET PACKAGES
-    # Clear existing to avoid duplicates if re-run (ignoring IDs)
-    cur.execute("TRUNCATE TABLE market_packages RESTART IDENTITY;")
-    packages = [
-        ('A', 'Entry Level (12V)', 12, 1.5, 1.2, 1500000, 2400000, 300000, 'Lights, WiFi, Laptop', False),
-        ('B', 'Mid-Range (24V)', 24, 3.5, 4.8, 3600000, 4300000, 600000, 'Small Fridge, Lighting, Limited Aircon', False),
-        ('C', 'Standard Home (48V)', 48, 6.0, 16.0, 6600000, 7200000, 800000, '1HP Aircon (10-15hrs), Fridge, Pump', False),
-        ('D', 'Premium Solar (Off-Grid)', 48, 8.0, 16.0, 14500000, 16000000, 1000000, 'Full Off-Grid, Jinko Panels included', False),
-        ('E', 'EcoFlow Delta 2', 48, 1.8, 1.0, 2550000, 2550000, 0, 'Apartment Backup', True),
-        ('E', 'EcoFlow Delta Pro', 48, 3.6, 3.6, 6600000, 6600000, 0, 'Condo Whole Unit', True)
-    ]
-    cur.executemany("""
-        INSERT INTO market_packages (tier_code, name, system_voltage, inverter_kw, battery_kwh, est_price_low, est_price_high, install_cost, description, is_portable)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    """, packages)
-
-    # 2. PRODUCT INVENTORY
-    cur.execute("TRUNCATE TABLE products_inventory RESTART IDENTITY;")
-    inventory = [
-        ('Inverter', 'Growatt', 'SPF 6000 ES Plus', '6kW 48V', 1380000, 2, 'Market Leader'),
-        ('Inverter', 'Deye', 'Hybrid', '6kW 48V', 5900000, 5, 'Premium Bundle'),
-        ('Battery', 'Lvtopsun', 'G4', '314Ah 51.2V', 6800000, 10, 'Best Seller, 10Yr Warranty'),
-        ('Panel', 'Jinko', 'Tiger Neo', '590W N-Type', 300000, 30, 'Tier 1 Brand'),
-    ]
-    cur.executemany("""
-        INSERT INTO products_inventory (category, brand, model, specs, price, warranty_years, tags)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    """, inventory)
-
-    # 3. KNOWLEDGE BASE (RAG)
-    cur.execute("TRUNCATE TABLE knowledge_base RESTART IDENTITY;")
-    kb_data = [
-        ("Myanmar Grid Condition", "Currently, Yangon and Mandalay face rotational load shedding. Typical schedule is 4-hours ON and 4-hours OFF. Industrial zones may have different schedules."),
-        ("Troubleshooting Inverter", "Error 04 on Growatt usually means Low Battery. Solution: Check battery voltage, ensure grid charging is enabled, or reduce load."),
-        ("Troubleshooting Inverter", "Error 08 on Growatt means Bus Voltage High. Solution: Restart inverter. If persistent, check if solar panels are over-voltage."),
-        ("Solar Market", "The price of Solar Panels in Myanmar has dropped significantly in late 2024. 550W panels are now around 280,000 MMK."),
-        ("Battery Maintenance", "For Lead-Acid (Tubular) batteries, check distilled water levels every month. Do not let it dry out."),
-        ("Voltage Fluctuation", "Mee La (Grid) voltage in Myanmar can fluctuate between 160V and 260V. Always use a Voltage Stabilizer (Servo) before the Inverter input."),
-    ]
-    cur.executemany("""
-        INSERT INTO knowledge_base (category, content)
-        VALUES (%s, %s)
-    """, kb_data)
-
-    conn.commit()
-    conn.close()
-    print("✅ Database Seeded Successfully (Packages, Inventory, Knowledge Base).")
+import sys
+import json
+import time
+import asyncio
+import hashlib
+from database import get_db_connection, notify_invalidation
+from text_utils import search_text
+from sync_knowledge import row_hash
+from retrieval import apply_changes
+
+# Idempotent, versioned seed loader (asyncpg).
+#
+# Each dataset has a checksum over SEED_VERSION + its rows, recorded in
+# seed_state. Unchanged datasets are skipped with one query; changed ones are
+# upserted by natural key in a single statement (never TRUNCATEd, so edits to
+# other rows survive restarts). Bump SEED_VERSION to force a re-apply.
+#
+#   python seed_data.py           # apply changed datasets
+#   python seed_data.py --force   # re-apply everything
+
+SEED_VERSION = 2
+
+# Serialises concurrent seeders (several workers warming up at once)
+SEED_LOCK_ID = 7305
+
+PACKAGES = [
+    ('A', 'Entry Level (12V)', 12, 1.5, 1.2, 1500000, 2400000, 300000, 'Lights, WiFi, Laptop', False),
+    ('B', 'Mid-Range (24V)', 24, 3.5, 4.8, 3600000, 4300000, 600000, 'Small Fridge, Lighting, Limited Aircon', False),
+    ('C', 'Standard Home (48V)', 48, 6.0, 16.0, 6600000, 7200000, 800000, '1HP Aircon (10-15hrs), Fridge, Pump', False),
+    ('D', 'Premium Solar (Off-Grid)', 48, 8.0, 16.0, 14500000, 16000000, 1000000, 'Full Off-Grid, Jinko Panels included', False),
+    ('E', 'EcoFlow Delta 2', 48, 1.8, 1.0, 2550000, 2550000, 0, 'Apartment Backup', True),
+    ('E', 'EcoFlow Delta Pro', 48, 3.6, 3.6, 6600000, 6600000, 0, 'Condo Whole Unit', True)
+]
+
+INVENTORY = [
+    ('Inverter', 'Growatt', 'SPF 6000 ES Plus', '6kW 48V', 1380000, 2, 'Market Leader'),
+    ('Inverter', 'Deye', 'Hybrid', '6kW 48V', 5900000, 5, 'Premium Bundle'),
+    ('Battery', 'Lvtopsun', 'G4', '314Ah 51.2V', 6800000, 10, 'Best Seller, 10Yr Warranty'),
+    ('Panel', 'Jinko', 'Tiger Neo', '590W N-Type', 300000, 30, 'Tier 1 Brand'),
+]
+
+KNOWLEDGE = [
+    ("Myanmar Grid Condition", "Currently, Yangon and Mandalay face rotational load shedding. Typical schedule is 4-hours ON and 4-hours OFF. Industrial zones may have different schedules."),
+    ("Troubleshooting Inverter", "Error 04 on Growatt usually means Low Battery. Solution: Check battery voltage, ensure grid charging is enabled, or reduce load."),
+    ("Troubleshooting Inverter", "Error 08 on Growatt means Bus Voltage High. Solution: Restart inverter. If persistent, check if solar panels are over-voltage."),
+    ("Solar Market", "The price of Solar Panels in Myanmar has dropped significantly in late 2024. 550W panels are now around 280,000 MMK."),
+    ("Battery Maintenance", "For Lead-Acid (Tubular) batteries, check distilled water levels every month. Do not let it dry out."),
+    ("Voltage Fluctuation", "Mee La (Grid) voltage in Myanmar can fluctuate between 160V and 260V. Always use a Voltage Stabilizer (Servo) before the Inverter input."),
+]
+
+
+class Dataset:
+    """A seeded table: (column, pg type) list, natural key columns, rows."""
+
+    def __init__(self, name, table, columns, keys, rows, topic):
+        self.name = name
+        self.table = table
+        self.columns = columns
+        self.keys = keys
+        self.rows = rows
+        self.topic = topic
+
+    def checksum(self):
+        payload = json.dumps([SEED_VERSION, self.columns, self.rows], ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def upsert_sql(self):
+        """
+        One round trip: unnest the column arrays, update rows whose key exists
+        but values differ, insert the missing ones; selects both counts.
+        """
+        names = [c for c, _ in self.columns]
+        cols = ", ".join(names)
+        unnest = ", ".join(f"${i + 1}::{t}[]" for i, (_, t) in enumerate(self.columns))
+        key_match = " AND ".join(f"t.{k} = s.{k}" for k in self.keys)
+        return f"""
+            WITH s ({cols}) AS (SELECT * FROM unnest({unnest})),
+            upd AS (
+                UPDATE {self.table} t SET ({cols}) = ({", ".join("s." + c for c in names)})
+                FROM s
+                WHERE {key_match}
+                  AND ({", ".join("t." + c for c in names)}) IS DISTINCT FROM ({", ".join("s." + c for c in names)})
+                RETURNING 1
+            ),
+            ins AS (
+                INSERT INTO {self.table} ({cols})
+                SELECT {cols} FROM s
+                WHERE NOT EXISTS (SELECT 1 FROM {self.table} t WHERE {key_match})
+                RETURNING 1
+            )
+            SELECT (SELECT count(*) FROM upd) AS updated, (SELECT count(*) FROM ins) AS inserted
+        """
+
+    async def apply(self, conn):
+        """Upsert the rows; returns a short report."""
+        arrays = [list(col) for col in zip(*self.rows)]
+        r = await conn.fetchrow(self.upsert_sql(), *arrays)
+        return f"updated={r['updated']} inserted={r['inserted']}"
+
+
+class KnowledgeDataset(Dataset):
+    """Same keys/columns as sync_knowledge.py; unchanged rows are left alone."""
+
+    def __init__(self, rows):
+        super().__init__("knowledge_base", "knowledge_base", [("category", "text"), ("content", "text")],
+                         ["kb_key"], rows, "knowledge_base")
+        self.upserted = []   # (id, category, content, content_hash) for the vector index
+
+    async def apply(self, conn):
+        hashes = [row_hash(cat, content) for cat, content in self.rows]
+        rows = await conn.fetch("""
+            INSERT INTO knowledge_base (kb_key, content_hash, category, content, search_text, search_vector)
+            SELECT h, h, c, body, st,
+                   setweight(to_tsvector('simple', ct), 'A') || setweight(to_tsvector('simple', st), 'B')
+            FROM unnest($1::text[], $2::text[], $3::text[], $4::text[], $5::text[]) AS s (h, c, body, st, ct)
+            ON CONFLICT (kb_key) DO UPDATE SET
+                content_hash = EXCLUDED.content_hash,
+                category = EXCLUDED.category,
+                content = EXCLUDED.content,
+                search_text = EXCLUDED.search_text,
+                search_vector = EXCLUDED.search_vector
+            WHERE knowledge_base.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+            RETURNING id, category, content, content_hash
+        """, hashes, [cat for cat, _ in self.rows], [content for _, content in self.rows],
+            [search_text(content) for _, content in self.rows], [search_text(cat) for cat, _ in self.rows])
+        self.upserted = [(r['id'], r['category'], r['content'], r['content_hash']) for r in rows]
+        return f"upserted={len(rows)}"
+
+
+DATASETS = [
+    Dataset("market_packages", "market_packages", [
+        ("tier_code", "text"), ("name", "text"), ("system_voltage", "int"), ("inverter_kw", "float8"),
+        ("battery_kwh", "float8"), ("est_price_low", "int"), ("est_price_high", "int"),
+        ("install_cost", "int"), ("description", "text"), ("is_portable", "bool"),
+    ], ["tier_code", "name"], PACKAGES, "market_packages"),
+    Dataset("products_inventory", "products_inventory", [
+        ("category", "text"), ("brand", "text"), ("model", "text"), ("specs", "text"),
+        ("price", "int"), ("warranty_years", "int"), ("tags", "text"),
+    ], ["brand", "model"], INVENTORY, "products_inventory"),
+    KnowledgeDataset(KNOWLEDGE),
+]
+
+
+async def seed_all(force=False):
+    """Apply changed datasets. Returns {dataset: 'skipped' | 'updated=N inserted=M'}."""
+    started = time.monotonic()
+    report = {}
+
+    async with get_db_connection() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", SEED_LOCK_ID)
+            applied = {r['dataset']: r['checksum'] for r in await conn.fetch("SELECT dataset, checksum FROM seed_state")}
+
+            for ds in DATASETS:
+                checksum = ds.checksum()
+                if not force and applied.get(ds.name) == checksum:
+                    report[ds.name] = "skipped"
+                    continue
+                report[ds.name] = await ds.apply(conn)
+                await conn.execute("""
+                    INSERT INTO seed_state (dataset, version, checksum, row_count, applied_at)
+                    VALUES ($1, $2, $3, $4, now())
+                    ON CONFLICT (dataset) DO UPDATE SET
+                        version = EXCLUDED.version, checksum = EXCLUDED.checksum,
+                        row_count = EXCLUDED.row_count, applied_at = now()
+                """, ds.name, SEED_VERSION, checksum, len(ds.rows))
+                # Running servers drop their caches (delivered on commit)
+                await notify_invalidation(conn, ds.topic)
+
+    # Re-embed only the changed KB rows for the vector index
+    kb = DATASETS[-1]
+    if kb.upserted:
+        await apply_changes(kb.upserted, [])
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Seed v{SEED_VERSION} done in {elapsed:.2f}s: " + ", ".join(f"{k} {v}" for k, v in report.items()))
+    return report
+
 
 if __name__ == "__main__":
-    seed_data()
+    asyncio.run(seed_all(force="--force" in sys.argv))
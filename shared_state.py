@@ -0,0 +1,214 @@
+import os
+import time
+import random
+from database import get_db_connection
+
+# Pluggable key/value store for state that must be shared between workers
+# and nodes (update dedup, cross-worker cache entries).
+#
+# SHARED_STATE_BACKEND:
+# - memory   (default) process-local; correct for a single worker
+# - postgres an UNLOGGED table (migration 9d2f6b8e4a17) on the existing pool
+# - redis    REDIS_URL, needs the optional 'redis' package
+# Cache invalidation across processes already goes through Postgres
+# LISTEN/NOTIFY (see database.py), so every backend gets it for free.
+
+SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+SHARED_STATE_PREFIX = os.environ.get("SHARED_STATE_PREFIX", "meesaya:")
+
+
+class MemoryBackend:
+    """dict with expiry; the default for a single worker."""
+
+    distributed = False
+
+    def __init__(self):
+        self._data = {}   # key -> (value, expires_at or None)
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def _live(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] < time.monotonic():
+            del self._data[key]
+            return None
+        return item
+
+    def _purge(self):
+        now = time.monotonic()
+        for key in [k for k, (_, exp) in self._data.items() if exp is not None and exp < now]:
+            del self._data[key]
+
+    async def get(self, key):
+        item = self._live(key)
+        return item[0] if item else None
+
+    async def set(self, key, value, ttl=None):
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        if len(self._data) % 1000 == 0:
+            self._purge()
+
+    async def add(self, key, value="1", ttl=None):
+        """Set only if absent. True if this call created the key."""
+        if self._live(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+    async def incr(self, key):
+        value = int(await self.get(key) or 0) + 1
+        await self.set(key, str(value))
+        return value
+
+
+class PostgresBackend:
+    """shared_state table; expired rows are treated as absent and purged now and then."""
+
+    distributed = True
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def _maybe_purge(self, conn):
+        if random.random() < 0.01:
+            await conn.execute("DELETE FROM shared_state WHERE expires_at < now()")
+
+    async def get(self, key):
+        async with get_db_connection() as conn:
+            return await conn.fetchval("""
+                SELECT value FROM shared_state
+                WHERE key = $1 AND (expires_at IS NULL OR expires_at > now())
+            """, key)
+
+    async def set(self, key, value, ttl=None):
+        async with get_db_connection() as conn:
+            await conn.execute("""
+                INSERT INTO shared_state (key, value, expires_at)
+                VALUES ($1, $2, now() + $3::float8 * interval '1 second')
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+            """, key, value, ttl)
+            await self._maybe_purge(conn)
+
+    async def add(self, key, value="1", ttl=None):
+        async with get_db_connection() as conn:
+            # Inserted, or took over an expired row -> we own it
+            created = await conn.fetchval("""
+                INSERT INTO shared_state (key, value, expires_at)
+                VALUES ($1, $2, now() + $3::float8 * interval '1 second')
+                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at
+                WHERE shared_state.expires_at < now()
+                RETURNING true
+            """, key, value, ttl)
+            await self._maybe_purge(conn)
+        return bool(created)
+
+    async def delete(self, key):
+        async with get_db_connection() as conn:
+            await conn.execute("DELETE FROM shared_state WHERE key = $1", key)
+
+    async def incr(self, key):
+        async with get_db_connection() as conn:
+            return int(await conn.fetchval("""
+                INSERT INTO shared_state (key, value) VALUES ($1, '1')
+                ON CONFLICT (key) DO UPDATE SET value = (shared_state.value::bigint + 1)::text
+                RETURNING value
+            """, key))
+
+
+class RedisBackend:
+    distributed = True
+
+    def __init__(self, url=REDIS_URL):
+        self.url = url
+        self._redis = None
+
+    async def start(self):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("SHARED_STATE_BACKEND=redis needs the 'redis' package")
+        self._redis = aioredis.from_url(self.url, decode_responses=True)
+        await self._redis.ping()
+
+    async def close(self):
+        if self._redis:
+            await self._redis.close()
+            self._redis = None
+
+    async def get(self, key):
+        return await self._redis.get(key)
+
+    async def set(self, key, value, ttl=None):
+        await self._redis.set(key, value, ex=int(ttl) if ttl else None)
+
+    async def add(self, key, value="1", ttl=None):
+        return bool(await self._redis.set(key, value, ex=int(ttl) if ttl else None, nx=True))
+
+    async def delete(self, key):
+        await self._redis.delete(key)
+
+    async def incr(self, key):
+        return int(await self._redis.incr(key))
+
+
+BACKENDS = {"memory": MemoryBackend, "postgres": PostgresBackend, "redis": RedisBackend}
+
+
+class SharedState:
+    """Namespaced facade over the configured backend (falls back to memory if it can't start)."""
+
+    def __init__(self, backend_name=SHARED_STATE_BACKEND, prefix=SHARED_STATE_PREFIX):
+        if backend_name not in BACKENDS:
+            raise ValueError(f"Unknown SHARED_STATE_BACKEND '{backend_name}' (use {', '.join(BACKENDS)})")
+        self.backend_name = backend_name
+        self.backend = BACKENDS[backend_name]()
+        self.prefix = prefix
+
+    @property
+    def distributed(self):
+        return self.backend.distributed
+
+    async def start(self):
+        try:
+            await self.backend.start()
+            print(f"✅ Shared State Ready ({self.backend_name})")
+        except Exception as e:
+            print(f"❌ Shared State Error ({self.backend_name}): {e}, falling back to memory")
+            self.backend_name, self.backend = "memory", MemoryBackend()
+
+    async def close(self):
+        await self.backend.close()
+
+    async def get(self, key):
+        return await self.backend.get(self.prefix + key)
+
+    async def set(self, key, value, ttl=None):
+        await self.backend.set(self.prefix + key, value, ttl)
+
+    async def add(self, key, value="1", ttl=None):
+        return await self.backend.add(self.prefix + key, value, ttl)
+
+    async def delete(self, key):
+        await self.backend.delete(self.prefix + key)
+
+    async def incr(self, key):
+        return await self.backend.incr(self.prefix + key)
+
+    def stats(self):
+        return {"backend": self.backend_name, "distributed": self.distributed}
+
+
+shared_state = SharedState()
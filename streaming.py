@@ -0,0 +1,166 @@
+import os
+import json
+import time
+from http_client import get_openrouter_client
+from llm_client import LLMError, RETRYABLE_STATUS, _parse_retry_after
+from metrics import metrics
+from telegram_api import send_message, edit_message, split_message, TELEGRAM_MAX_MESSAGE_LEN
+
+# Streaming replies: consume the OpenRouter SSE stream and show the answer in
+# Telegram as it is generated (one sendMessage, then throttled editMessageText).
+# Native tool_calls deltas are collected instead of shown. Failures surface as
+# LLMError, so llm_client.stream() retries / falls back like a plain request.
+
+OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", 1.0))
+STREAM_MIN_FIRST_CHARS = int(os.environ.get("STREAM_MIN_FIRST_CHARS", 20))
+
+
+async def stream_llm(messages, model, temperature=0.3, tools=None, tool_choice=None):
+    """
+    Async generator over /chat/completions with stream=True. Yields
+    ("content", text) and ("tool_call", index, id, name, arguments_fragment).
+    Raises LLMError if the stream breaks off before [DONE] / a finish_reason,
+    so a truncated answer is never mistaken for a complete one.
+    """
+    body = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "stream": True
+    }
+    if tools:
+        body["tools"] = tools
+        if tool_choice:
+            body["tool_choice"] = tool_choice
+
+    async with get_openrouter_client().stream(
+        "POST", "/chat/completions",
+        headers={
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "Content-Type": "application/json"
+        },
+        json=body
+    ) as r:
+        if r.status_code != 200:
+            err = await r.aread()
+            raise LLMError(
+                f"OpenRouter API Error ({r.status_code}): {err[:300]!r}",
+                status=r.status_code,
+                retry_after=_parse_retry_after(r.headers.get("retry-after")),
+                retryable=r.status_code in RETRYABLE_STATUS,
+            )
+
+        finished = False
+        async for line in r.aiter_lines():
+            # SSE: "data: {...}" lines; ": comment" keep-alives are skipped
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if data == "[DONE]":
+                return
+            try:
+                chunk = json.loads(data)
+            except ValueError:
+                continue
+            if chunk.get("error"):
+                raise LLMError(f"OpenRouter stream error: {str(chunk['error'])[:300]}")
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            delta = choices[0].get("delta") or {}
+            if delta.get("content"):
+                yield ("content", delta["content"])
+            for tc in delta.get("tool_calls") or []:
+                fn = tc.get("function") or {}
+                yield ("tool_call", tc.get("index", 0), tc.get("id"), fn.get("name"), fn.get("arguments") or "")
+            reason = choices[0].get("finish_reason")
+            if reason == "error":
+                raise LLMError("OpenRouter stream finished with an error")
+            if reason:
+                finished = True
+
+        if not finished:
+            raise LLMError("OpenRouter stream ended before [DONE]")
+
+
+class ProgressiveReply:
+    """
+    One Telegram message that grows while the LLM streams.
+    Edits are coalesced to at most one per STREAM_EDIT_INTERVAL (Telegram
+    rate-limits edits per chat); intermediate edits are plain text because
+    half-written Markdown often fails to parse.
+    """
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.message_id = None
+        self.shown = ""
+        self.last_edit = 0.0
+        self.first_token_at = None
+
+    async def update(self, text):
+        text = text[:TELEGRAM_MAX_MESSAGE_LEN]
+        now = time.monotonic()
+        if self.message_id is None:
+            if len(text.strip()) < STREAM_MIN_FIRST_CHARS:
+                return
+            self.message_id = await send_message(self.chat_id, text, parse_mode=None)
+            self.shown, self.last_edit = text, now
+        elif now - self.last_edit >= STREAM_EDIT_INTERVAL and text != self.shown:
+            await edit_message(self.chat_id, self.message_id, text, parse_mode=None)
+            self.shown, self.last_edit = text, now
+
+    async def finish(self, text):
+        """
+        Final version with Markdown (new message if nothing was shown yet).
+        Overflow past 4096 chars follows as extra messages.
+        """
+        if self.message_id is None:
+            self.message_id = await send_message(self.chat_id, text)
+        else:
+            first, *rest = split_message(text)
+            await edit_message(self.chat_id, self.message_id, first)
+            for chunk in rest:
+                await send_message(self.chat_id, chunk)
+        self.shown = text
+
+
+async def stream_reply(messages, reply, model, temperature=0.3, tools=None, tool_choice=None):
+    """
+    Stream a completion into `reply`. Returns (text, tool_calls); raises
+    LLMError if the stream failed at any point. Partial text is discarded: a
+    retry streams into the same message again, and finish() overwrites it.
+    Text is shown progressively unless the model is calling tools.
+    """
+    text = ""
+    calls = {}   # index -> {"id", "type", "function": {"name", "arguments"}}
+    started = time.monotonic()
+    gen = stream_llm(messages, model, temperature, tools, tool_choice)
+    try:
+        async for event in gen:
+            if reply.first_token_at is None:
+                reply.first_token_at = time.monotonic() - started
+                metrics.observe("llm_first_token_seconds", reply.first_token_at, model=model)
+            if event[0] == "tool_call":
+                _, index, call_id, name, args = event
+                call = calls.setdefault(index, {"id": call_id, "type": "function",
+                                                "function": {"name": name or "", "arguments": ""}})
+                if call_id:
+                    call["id"] = call_id
+                if name:
+                    call["function"]["name"] = name
+                call["function"]["arguments"] += args
+                continue
+            text += event[1]
+            if not calls:
+                await reply.update(text)
+    except LLMError as e:
+        print(f"❌ Stream Error ({len(text)} chars discarded): {e}")
+        raise
+    except Exception as e:
+        print(f"❌ Stream Error ({len(text)} chars discarded): {e}")
+        raise LLMError(f"Stream Error: {e}")
+    finally:
+        await gen.aclose()
+    return text, [calls[i] for i in sorted(calls)]
@@ -1,46 +1,117 @@
 import csv
+import hashlib
 import asyncio
-from database import get_db_connection
+from database import get_db_connection, notify_invalidation
+from text_utils import search_text
+from retrieval import apply_changes
 
 CSV_FILE = "knowledge.csv"
 
+# Serialises concurrent syncs (pg_advisory_xact_lock key)
+SYNC_LOCK_ID = 7304
+
+def row_hash(category, content):
+    """md5 of category + content. Also the default row key (see migration 5e9b0d3c71a8)."""
+    return hashlib.md5(f"{category or ''}\x1f{content}".encode("utf-8")).hexdigest()
+
+def read_csv(path=CSV_FILE):
+    """
+    Returns {kb_key: (category, content, content_hash)}.
+    An optional 'Key' column gives rows a stable identity across edits;
+    without it the key is the content hash (edits become delete + insert).
+    """
+    rows = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            category, content = row.get('Category'), row.get('Content')
+            if not category or not content:
+                continue
+            h = row_hash(category, content)
+            key = (row.get('Key') or '').strip() or h
+            rows[key] = (category, content, h)
+    return rows
+
 async def sync_knowledge():
     print(f"🔄 Syncing Knowledge Base from {CSV_FILE}...")
-    
-    data_to_insert = []
-    
+
     # 1. Read CSV
     try:
-        with open(CSV_FILE, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row['Category'] and row['Content']:
-                    data_to_insert.append((row['Category'], row['Content']))
+        csv_rows = read_csv(CSV_FILE)
     except Exception as e:
         print(f"❌ Error reading CSV: {e}")
         return
 
-    if not data_to_insert:
+    if not csv_rows:
         print("⚠️ CSV is empty or invalid.")
         return
 
-    # 2. Update Database (Truncate & Insert)
+    # 2. Diff against the DB and apply only the changes
     try:
         async with get_db_connection() as conn:
-            # We use a transaction block
             async with conn.transaction():
-                # A. Clear old data
-                await conn.execute("TRUNCATE TABLE knowledge_base RESTART IDENTITY;")
-                print("🗑️  Cleared old Knowledge Base data.")
-                
-                # B. Insert new data
-                await conn.executemany("""
-                    INSERT INTO knowledge_base (category, content)
-                    VALUES ($1, $2)
-                """, data_to_insert)
-                
-            print(f"✅ Automatically imported {len(data_to_insert)} items from CSV.")
-            
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", SYNC_LOCK_ID)
+
+                existing = {
+                    r['kb_key']: r['content_hash']
+                    for r in await conn.fetch("SELECT kb_key, content_hash FROM knowledge_base")
+                }
+                changed = [
+                    (key, cat, content, h, search_text(cat), search_text(content))
+                    for key, (cat, content, h) in csv_rows.items()
+                    if existing.get(key) != h
+                ]
+                removed = [key for key in existing if key not in csv_rows]
+
+                upserted = []
+                if changed:
+                    # A. Bulk load changed rows into a staging table via COPY
+                    await conn.execute("""
+                        CREATE TEMP TABLE kb_staging (
+                            kb_key text, category text, content text, content_hash text,
+                            category_text text, search_text text
+                        ) ON COMMIT DROP
+                    """)
+                    await conn.copy_records_to_table(
+                        'kb_staging', records=changed,
+                        columns=['kb_key', 'category', 'content', 'content_hash', 'category_text', 'search_text']
+                    )
+
+                    # B. Upsert (rows are visible throughout, no empty-table gap)
+                    upserted = await conn.fetch("""
+                        INSERT INTO knowledge_base (kb_key, category, content, content_hash, search_text, search_vector)
+                        SELECT kb_key, category, content, content_hash, search_text,
+                               setweight(to_tsvector('simple', category_text), 'A')
+                               || setweight(to_tsvector('simple', search_text), 'B')
+                        FROM kb_staging
+                        ON CONFLICT (kb_key) DO UPDATE SET
+                            category = EXCLUDED.category,
+                            content = EXCLUDED.content,
+                            content_hash = EXCLUDED.content_hash,
+                            search_text = EXCLUDED.search_text,
+                            search_vector = EXCLUDED.search_vector
+                        RETURNING id, category, content, content_hash
+                    """)
+
+                # C. Delete rows no longer in the CSV
+                deleted_ids = []
+                if removed:
+                    deleted_ids = [
+                        r['id'] for r in await conn.fetch(
+                            "DELETE FROM knowledge_base WHERE kb_key = ANY($1::text[]) RETURNING id", removed
+                        )
+                    ]
+
+            print(f"✅ Synced {len(csv_rows)} CSV rows: {len(upserted)} upserted, {len(deleted_ids)} deleted, "
+                  f"{len(csv_rows) - len(changed)} unchanged.")
+
+        # D. Re-embed only the changed rows for the in-process vector index,
+        #    then tell running servers to reload it / drop cached answers
+        if upserted or deleted_ids:
+            await apply_changes([(r['id'], r['category'], r['content'], r['content_hash']) for r in upserted], deleted_ids)
+            async with get_db_connection() as conn:
+                await notify_invalidation(conn, 'knowledge_base')
+
     except Exception as e:
         print(f"❌ Database Error: {e}")
 
@@ -0,0 +1,92 @@
+import asyncio
+from telegram_sender import (
+    telegram_sender, post_method,
+    PRIORITY_REPLY, PRIORITY_EDIT, PRIORITY_ACTION,
+)
+
+# Thin Bot API helpers. While the server runs, calls go through the
+# rate-limited telegram_sender queue; scripts without it post directly.
+
+TELEGRAM_MAX_MESSAGE_LEN = 4096
+
+
+def clean_markdown(text):
+    return text.replace("**", "*")
+
+
+def split_message(text, limit=TELEGRAM_MAX_MESSAGE_LEN):
+    """Split into <= limit chunks, preferring paragraph, line, then word breaks."""
+    chunks = []
+    while len(text) > limit:
+        cut = -1
+        for sep in ("\n\n", "\n", " "):
+            cut = text.rfind(sep, 0, limit)
+            if cut > limit // 2:
+                break
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+async def _call(method, payload, priority=PRIORITY_REPLY):
+    """Response JSON, or None on failure."""
+    if telegram_sender.running:
+        return await telegram_sender.submit(method, payload, priority)
+    try:
+        status, data = await post_method(method, payload)
+        if status == 400 and "parse_mode" in payload and "parse" in str((data or {}).get("description", "")):
+            status, data = await post_method(method, {k: v for k, v in payload.items() if k != "parse_mode"})
+        return data
+    except Exception as e:
+        print(f"❌ Telegram {method} Error: {e}")
+        return None
+
+
+def _message_id(data):
+    try:
+        return data["result"]["message_id"]
+    except Exception:
+        return None
+
+
+async def send_chat_action(chat_id, action="typing"):
+    """Fire-and-forget chat action (coalesced by the sender)."""
+    if telegram_sender.running:
+        telegram_sender.submit("sendChatAction", {"chat_id": chat_id, "action": action}, PRIORITY_ACTION)
+        return
+    await _call("sendChatAction", {"chat_id": chat_id, "action": action})
+
+
+async def send_message(chat_id, text, parse_mode="Markdown", priority=PRIORITY_REPLY):
+    """
+    Async message sender; texts over 4096 chars go out as several messages, in order.
+    Returns the message_id of the first one (or None).
+    """
+    payloads = []
+    for chunk in split_message(clean_markdown(text) if parse_mode else text):
+        payload = {"chat_id": chat_id, "text": chunk}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        payloads.append(payload)
+
+    if telegram_sender.running:
+        # Queue all parts at once so nothing else for this chat slips in between
+        results = await asyncio.gather(*[telegram_sender.submit("sendMessage", p, priority) for p in payloads])
+    else:
+        results = [await _call("sendMessage", p) for p in payloads]
+    return _message_id(results[0])
+
+
+async def edit_message(chat_id, message_id, text, parse_mode="Markdown", priority=PRIORITY_EDIT):
+    """Edit a sent message. Falls back to plain text if Markdown fails to parse."""
+    payload = {"chat_id": chat_id, "message_id": message_id,
+               "text": clean_markdown(text) if parse_mode else text}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    data = await _call("editMessageText", payload, priority)
+    # "message is not modified" is a 400 too, and harmless
+    return bool(data) and (data.get("ok") or "not modified" in str(data.get("description", "")))
@@ -0,0 +1,326 @@
+import os
+import time
+import random
+import asyncio
+import itertools
+from http_client import get_telegram_client
+from metrics import metrics
+
+# Outbound Bot API scheduler.
+#
+# Every send goes through one queue so we stay under Telegram's limits
+# (~30 msg/s overall, ~1 msg/s per chat) instead of collecting 429s:
+# - token buckets for the global and per-chat rates,
+# - priorities: replies > edits > progress notices > chat actions > broadcasts,
+# - one in-flight request per chat, so multi-part replies arrive in order,
+# - a chat whose request is waiting for a retry sends nothing else until it
+#   goes out, so later chunks/replies can't overtake it,
+# - 429s are retried after `retry_after`, 5xx / network errors with backoff;
+#   once a second chat is told to wait in the meantime the flood limit is taken
+#   as bot-wide and every chat waits,
+# - redundant sendChatAction calls are coalesced.
+# Failures are logged and counted instead of being silently ignored.
+
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", 28))
+TELEGRAM_GLOBAL_BURST = float(os.environ.get("TELEGRAM_GLOBAL_BURST", 30))
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", 1.0))
+TELEGRAM_CHAT_BURST = float(os.environ.get("TELEGRAM_CHAT_BURST", 3))
+TELEGRAM_SEND_CONCURRENCY = int(os.environ.get("TELEGRAM_SEND_CONCURRENCY", 8))
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", 3))
+# A chat action shows for ~5s, so repeating it sooner is wasted quota
+CHAT_ACTION_COALESCE_SECONDS = 4.0
+# Idle per-chat buckets are dropped at most this often (and only past 10k chats)
+BUCKET_GC_INTERVAL = 60.0
+
+PRIORITY_REPLY = 0
+PRIORITY_EDIT = 1
+PRIORITY_NOTICE = 2
+PRIORITY_ACTION = 3
+PRIORITY_BROADCAST = 4
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0   # set from a 429's retry_after
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until one token is available (0 = now)."""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "method", "payload", "future",
+                 "not_before", "attempts", "coalesce_key")
+
+    def __init__(self, priority, seq, chat_id, method, payload, future, coalesce_key=None):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.payload = payload
+        self.future = future
+        self.not_before = 0.0
+        self.attempts = 0
+        self.coalesce_key = coalesce_key
+
+
+async def post_method(method, payload):
+    """Raw Bot API call -> (status_code, json or None)."""
+    started = time.monotonic()
+    r = await get_telegram_client().post(f"/{method}", json=payload)
+    metrics.observe("telegram_request_seconds", time.monotonic() - started, method=method)
+    metrics.inc("telegram_responses_total", method=method, status=r.status_code)
+    try:
+        return r.status_code, r.json()
+    except ValueError:
+        return r.status_code, None
+
+
+class TelegramSender:
+    def __init__(self):
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_BURST)
+        self._chat_buckets = {}
+        self._queue = []              # pending _Job list (small; scanned in priority order)
+        self._in_flight = set()       # chat_ids with a request on the wire
+        self._held = {}               # chat_id -> requeued job that must go out first
+        self._pending_actions = set()
+        self._last_action = {}        # chat_id -> (action, monotonic time)
+        self._seq = itertools.count()
+        self._last_429 = (None, 0.0)  # (chat_id, blocked until) of the latest 429
+        self._next_gc = 0.0
+        self._wakeup = None
+        self._sem = None
+        self._task = None
+
+        # Counters
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.retried_429 = 0
+        self.global_429 = 0
+        self.coalesced = 0
+
+    def set_share(self, workers):
+        """Each of `workers` processes gets an equal slice of the bot-wide rate."""
+        workers = max(1, workers)
+        self.global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE / workers, max(1.0, TELEGRAM_GLOBAL_BURST / workers))
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def start(self):
+        if self._task:
+            return
+        self._wakeup = asyncio.Event()
+        self._sem = asyncio.Semaphore(TELEGRAM_SEND_CONCURRENCY)
+        self._task = asyncio.create_task(self._run())
+        print("✅ Telegram Sender Started")
+
+    async def stop(self, timeout=10.0):
+        """Give queued sends up to `timeout` to go out, then stop."""
+        if not self._task:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._queue or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        for job in self._queue:
+            if not job.future.done():
+                job.future.set_result(None)
+        self._queue = []
+        self._held.clear()
+        print(f"🛑 Telegram Sender Stopped (sent={self.sent}, failed={self.failed})")
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        return bucket
+
+    def submit(self, method, payload, priority=PRIORITY_REPLY):
+        """Queue a Bot API call. Returns a Future with the response JSON (None on failure)."""
+        chat_id = str(payload.get("chat_id"))
+        future = asyncio.get_running_loop().create_future()
+
+        coalesce_key = None
+        if method == "sendChatAction":
+            coalesce_key = (chat_id, payload.get("action"))
+            last_action, last = self._last_action.get(chat_id, (None, 0.0))
+            recent = last_action == coalesce_key[1] and time.monotonic() - last < CHAT_ACTION_COALESCE_SECONDS
+            if coalesce_key in self._pending_actions or recent:
+                self.coalesced += 1
+                future.set_result({"ok": True, "coalesced": True})
+                return future
+            self._pending_actions.add(coalesce_key)
+
+        self._queue.append(_Job(priority, next(self._seq), chat_id, method, payload, future, coalesce_key))
+        self._wakeup.set()
+        return future
+
+    def _pick(self, now):
+        """Highest-priority job whose chat is free and within its rate. -> (job, wait)"""
+        best, wait = None, None
+        for job in self._queue:
+            if job.chat_id in self._in_flight:
+                continue
+            held = self._held.get(job.chat_id)
+            if held is not None and held is not job:
+                continue
+            w = max(job.not_before - now, self._chat_bucket(job.chat_id).wait_time(now))
+            if w > 0:
+                wait = w if wait is None else min(wait, w)
+                continue
+            if best is None or (job.priority, job.seq) < (best.priority, best.seq):
+                best = job
+        return best, wait
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            job, wait = self._pick(now)
+            global_wait = self.global_bucket.wait_time(now)
+            if job is None or global_wait > 0:
+                self._wakeup.clear()
+                timeout = global_wait if job is not None else wait
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._queue.remove(job)
+            self.global_bucket.take(now)
+            self._chat_bucket(job.chat_id).take(now)
+            self._in_flight.add(job.chat_id)
+            asyncio.create_task(self._deliver(job))
+            if now >= self._next_gc:
+                self._next_gc = now + BUCKET_GC_INTERVAL
+                self._gc_buckets(now)
+
+    def _gc_buckets(self, now):
+        if len(self._chat_buckets) > 10000:
+            for chat_id in [c for c, b in self._chat_buckets.items() if b.idle(now) and c not in self._in_flight]:
+                del self._chat_buckets[chat_id]
+
+    def _requeue(self, job, delay):
+        """Retry `job` after `delay`, holding back the rest of its chat until then."""
+        job.not_before = time.monotonic() + delay
+        self._held[job.chat_id] = job
+        self._queue.append(job)
+
+    async def _deliver(self, job):
+        job.attempts += 1
+        done = True
+        try:
+            async with self._sem:
+                status, data = await post_method(job.method, job.payload)
+
+            if status == 200:
+                self.sent += 1
+                if job.method == "sendMessage":
+                    # A new message clears the chat's "typing..." indicator
+                    self._last_action.pop(job.chat_id, None)
+                job.future.set_result(data)
+            elif status == 429:
+                retry_after = float(((data or {}).get("parameters") or {}).get("retry_after", 1))
+                self._flood_wait(job.chat_id, retry_after)
+                self.retried_429 += 1
+                if job.attempts <= TELEGRAM_MAX_RETRIES:
+                    print(f"⚠️ Telegram 429 for chat {job.chat_id}, retry in {retry_after}s")
+                    self._requeue(job, retry_after)
+                    done = False
+                else:
+                    self._fail(job, status, data)
+            elif status == 400 and "parse_mode" in job.payload and "parse" in str((data or {}).get("description", "")):
+                # Broken Markdown: resend as plain text
+                job.payload = {k: v for k, v in job.payload.items() if k != "parse_mode"}
+                self._requeue(job, 0)
+                done = False
+            elif status == 403:
+                # Bot blocked / kicked: not retryable
+                self.blocked += 1
+                job.future.set_result(data)
+            elif status >= 500 and job.attempts <= TELEGRAM_MAX_RETRIES:
+                self._requeue(job, random.uniform(0.5, 1.0) * (2 ** job.attempts))
+                done = False
+            elif status == 400 and "not modified" in str((data or {}).get("description", "")):
+                job.future.set_result(data)   # harmless edit no-op
+            else:
+                self._fail(job, status, data)
+        except Exception as e:
+            if job.attempts <= TELEGRAM_MAX_RETRIES:
+                self._requeue(job, random.uniform(0.5, 1.0) * (2 ** job.attempts))
+                done = False
+            else:
+                self._fail(job, None, str(e))
+        finally:
+            self._in_flight.discard(job.chat_id)
+            if done and self._held.get(job.chat_id) is job:
+                del self._held[job.chat_id]
+            if done and job.coalesce_key:
+                self._pending_actions.discard(job.coalesce_key)
+                self._last_action[job.chat_id] = (job.coalesce_key[1], time.monotonic())
+                if len(self._last_action) > 10000:
+                    self._last_action.clear()
+            self._wakeup.set()
+
+    def _flood_wait(self, chat_id, retry_after):
+        """
+        Honour a 429 for `chat_id`. Telegram doesn't say whether the limit is the
+        chat's or the bot's: a 429 for a second chat while the first one is still
+        waiting means it is bot-wide, so the global bucket waits too.
+        """
+        now = time.monotonic()
+        until = now + retry_after
+        self._chat_bucket(chat_id).blocked_until = until
+        last_chat, last_until = self._last_429
+        if last_chat is not None and last_chat != chat_id and now < last_until:
+            self.global_bucket.blocked_until = max(self.global_bucket.blocked_until, until)
+            self.global_429 += 1
+            print(f"⚠️ Telegram flood limit is bot-wide, pausing all sends for {retry_after}s")
+        self._last_429 = (chat_id, until)
+
+    def _fail(self, job, status, detail):
+        self.failed += 1
+        print(f"❌ Telegram {job.method} failed for chat {job.chat_id} ({status}): {str(detail)[:200]}")
+        if not job.future.done():
+            job.future.set_result(detail if isinstance(detail, dict) else None)
+
+    def stats(self):
+        return {
+            "queued": len(self._queue),
+            "in_flight": len(self._in_flight),
+            "held_chats": len(self._held),
+            "sent": self.sent,
+            "failed": self.failed,
+            "blocked": self.blocked,
+            "retried_429": self.retried_429,
+            "global_429": self.global_429,
+            "coalesced_actions": self.coalesced,
+        }
+
+
+telegram_sender = TelegramSender()
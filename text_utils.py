@@ -0,0 +1,90 @@
+import re
+import unicodedata
+
+# Text helpers shared by search and indexing.
+# Burmese is written without spaces between words, so we segment it into
+# syllables (rule-based, no dictionary needed) and index syllables + syllable
+# bigrams. Latin text (brands, error codes, numbers) is split on word boundaries.
+
+_MY_CONSONANT = "\u1000-\u1021"             # KA .. A
+_MY_ASAT = "\u103a"                          # asat (killer)
+_MY_VIRAMA = "\u1039"                        # virama (stacked consonant)
+_MY_INDEPENDENT = "\u1023-\u1027\u1029\u102a\u103f\u104c-\u104f"
+_MY_DIGITS = "\u1040-\u1049"
+
+# A new syllable starts at a consonant that is not stacked (after virama) and
+# not killed (followed by asat/virama), or at an independent vowel/digit.
+_SYLLABLE_BREAK = re.compile(
+    f"(?<!{_MY_VIRAMA})[{_MY_CONSONANT}](?![{_MY_ASAT}{_MY_VIRAMA}])"
+    f"|[{_MY_INDEPENDENT}{_MY_DIGITS}]"
+)
+_MY_RUN = re.compile("[\u1000-\u109f]+")
+_LATIN_WORD = re.compile(r"\d+(?:\.\d+)?[a-z]*|[a-z0-9]+")
+
+
+def normalize_text(text):
+    """NFC + lowercase + collapsed whitespace."""
+    text = unicodedata.normalize("NFC", text or "")
+    return " ".join(text.lower().split())
+
+
+def segment_burmese(run):
+    """Split a run of Burmese script into syllables."""
+    starts = [m.start() for m in _SYLLABLE_BREAK.finditer(run)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = starts + [len(run)]
+    return [run[a:b] for a, b in zip(bounds, bounds[1:]) if run[a:b]]
+
+
+def search_tokens(text):
+    """
+    Tokens used for full-text indexing and querying.
+    Latin words as-is, Burmese syllables plus adjacent-syllable bigrams.
+    """
+    text = normalize_text(text)
+    tokens = _LATIN_WORD.findall(text)
+
+    for run in _MY_RUN.findall(text):
+        syllables = [s for s in segment_burmese(run) if s.strip()]
+        tokens.extend(syllables)
+        tokens.extend(a + b for a, b in zip(syllables, syllables[1:]))
+
+    return tokens
+
+
+def search_text(text):
+    """Space-joined search tokens (what goes into to_tsvector('simple', ...))."""
+    return " ".join(search_tokens(text))
+
+
+# Rough LLM token estimate without a tokenizer download.
+# Latin text averages ~4 chars/token; Burmese is far denser in tokens, roughly
+# 1.5 tokens per syllable with common BPE vocabularies.
+LATIN_CHARS_PER_TOKEN = 4.0
+BURMESE_TOKENS_PER_SYLLABLE = 1.5
+
+
+def approx_token_count(text):
+    if not text:
+        return 0
+    burmese = 0.0
+    latin_chars = len(text)
+    for run in _MY_RUN.findall(text):
+        burmese += len(segment_burmese(run)) * BURMESE_TOKENS_PER_SYLLABLE
+        latin_chars -= len(run)
+    return int(burmese + latin_chars / LATIN_CHARS_PER_TOKEN + 0.999)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text to about max_tokens (binary search on length), marking the cut."""
+    if approx_token_count(text) <= max_tokens:
+        return text
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if approx_token_count(text[:mid]) <= max_tokens - 1:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo].rstrip() + "…"
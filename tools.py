@@ -0,0 +1,189 @@
+import os
+import json
+import asyncio
+from database import search_products_db
+from product_index import search_products
+from metrics import metrics
+from calculator import calculate_system
+
+# Tool registry for native (OpenAI-style) tool calling.
+#
+# Each tool has a JSON schema (sent as `tools`), an async handler, a
+# to_text() for the LLM's "tool" message, and an optional render() that turns a
+# simple result straight into the Burmese reply, so the second LLM pass can be
+# skipped entirely.
+
+# Set to 0 to always let the LLM write the final answer from tool results
+TOOL_TEMPLATE_REPLIES = os.environ.get("TOOL_TEMPLATE_REPLIES", "1") == "1"
+
+
+class Tool:
+    def __init__(self, name, description, parameters, handler, to_text, render=None, progress=None):
+        self.name = name
+        self.description = description
+        self.parameters = parameters
+        self.handler = handler
+        self.to_text = to_text
+        self.render = render
+        self.progress = progress   # optional notice shown while the tool runs
+
+    def schema(self):
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": self.parameters,
+            }
+        }
+
+
+TOOLS = {}
+
+
+def register_tool(tool):
+    TOOLS[tool.name] = tool
+    return tool
+
+
+def tool_schemas():
+    return [t.schema() for t in TOOLS.values()]
+
+
+# --- calculate ---
+
+async def _calculate(args):
+    return await calculate_system(int(args['watts']), int(args.get('hours', 4)), args.get('housing', 'home'))
+
+def _calculate_text(res):
+    if "error" in res:
+        return f"Error: {res['error']}"
+    if res['strategy'] == 'HOME_INSTALL':
+        return (
+            f"RECOMMENDATION: {res['tier_name']}\n"
+            f"SPECS: {res['specs']['inverter']} + {res['specs']['battery']}\n"
+            f"VOLTAGE: {res['voltage']}V System\n"
+            f"ESTIMATED PRICE: {res['price_range']} (Includes {res['install_fee']} Installation)\n"
+            f"CAPABILITY: {res['desc']}"
+        )
+    return f"RECOMMENDATION: {res['tier_name']} (Portable)\nPRICE: {res['price_est']:,} MMK"
+
+def _calculate_render(res):
+    if "error" in res:
+        return None
+    if res['strategy'] == 'HOME_INSTALL':
+        return (
+            f"☀️ *အကြံပြု System:* {res['tier_name']}\n"
+            f"⚡ Inverter: {res['specs']['inverter']} | Battery: {res['specs']['battery']}\n"
+            f"🔋 System Voltage: {res['voltage']}V\n"
+            f"💰 ခန့်မှန်းဈေး: {res['price_range']} (တပ်ဆင်ခ {res['install_fee']} ပါဝင်)\n"
+            f"✅ သုံးနိုင်သည်: {res['desc']}"
+        )
+    return (
+        f"🔌 *အကြံပြု Portable:* {res['tier_name']}\n"
+        f"⚡ {res['specs']}\n"
+        f"💰 ဈေးနှုန်း: {res['price_est']:,} ကျပ်\n"
+        f"✅ {res['desc']}"
+    )
+
+register_tool(Tool(
+    name="calculate",
+    description="Size a solar system from the user's load. Use when the user gives watts or appliances.",
+    parameters={
+        "type": "object",
+        "properties": {
+            "watts": {"type": "integer", "description": "Total load in watts"},
+            "hours": {"type": "integer", "description": "Backup hours needed"},
+            "housing": {"type": "string", "enum": ["home", "apartment", "condo", "flat"]},
+        },
+        "required": ["watts", "hours"],
+    },
+    handler=_calculate,
+    to_text=_calculate_text,
+    render=_calculate_render,
+    progress="🔍 တွက်ချက်နေပါသည်... (Calculating...)",
+))
+
+
+# --- search ---
+
+async def _search(args):
+    # In-memory ranked index; plain ILIKE query if it can't be loaded
+    items = await search_products(args['query'])
+    if items and items[0].startswith("Search Error"):
+        return await search_products_db(args['query'])
+    return items
+
+def _search_text(items):
+    return "INVENTORY SEARCH RESULTS:\n" + "\n".join(items)
+
+def _search_render(items):
+    if not items or items[0].startswith(("No specific", "Search Error")):
+        return None
+    return "📦 *လက်ရှိ ရရှိနိုင်သော ပစ္စည်းများ:*\n" + "\n".join(f"• {i}" for i in items)
+
+register_tool(Tool(
+    name="search",
+    description="Look up product price and stock in the inventory (brand, model or category).",
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "Brand, model, category and/or specs and budget, e.g. 6kW 48V inverter under 2M"},
+        },
+        "required": ["query"],
+    },
+    handler=_search,
+    to_text=_search_text,
+    render=_search_render,
+))
+
+
+# --- execution ---
+
+class ToolResult:
+    __slots__ = ("call_id", "name", "result", "text", "rendered")
+
+    def __init__(self, call_id, name, result, text, rendered):
+        self.call_id = call_id
+        self.name = name
+        self.result = result
+        self.text = text
+        self.rendered = rendered
+
+
+async def _run_one(call):
+    fn = call.get("function") or {}
+    name = fn.get("name")
+    tool = TOOLS.get(name)
+    if not tool:
+        return ToolResult(call.get("id"), name, None, f"Error: unknown tool '{name}'", None)
+    try:
+        args = json.loads(fn.get("arguments") or "{}")
+        with metrics.stage(f"tool_{name}"):
+            result = await tool.handler(args)
+        rendered = tool.render(result) if (tool.render and TOOL_TEMPLATE_REPLIES) else None
+        return ToolResult(call.get("id"), name, result, tool.to_text(result), rendered)
+    except Exception as e:
+        print(f"Tool Error ({name}): {e}")
+        return ToolResult(call.get("id"), name, None, f"Error: {e}", None)
+
+
+async def execute_tool_calls(tool_calls):
+    """Run every requested tool concurrently; results keep the call order."""
+    return await asyncio.gather(*[_run_one(c) for c in tool_calls])
+
+
+def progress_notice(tool_calls):
+    for c in tool_calls:
+        tool = TOOLS.get((c.get("function") or {}).get("name"))
+        if tool and tool.progress:
+            return tool.progress
+    return None
+
+
+def tool_messages(text, tool_calls, results):
+    """Assistant tool_calls message + one 'tool' message per result (for the second pass)."""
+    msgs = [{"role": "assistant", "content": text or None, "tool_calls": tool_calls}]
+    for r in results:
+        msgs.append({"role": "tool", "tool_call_id": r.call_id, "content": r.text})
+    return msgs
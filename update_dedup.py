@@ -0,0 +1,206 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict, deque
+from database import get_db_connection
+from shared_state import shared_state
+
+# Telegram update_id de-duplication.
+#
+# Telegram re-sends a webhook update when we are slow to answer, and after a
+# restart it re-delivers whatever it thinks is pending. Without this, every
+# retry would be a second LLM call, chat_history row and reply.
+#
+# - A bounded window of recently claimed update_ids (O(1) set lookup), checked
+#   by the worker that owns the chat (cluster.py), before anything is queued.
+# - A durable high-water mark per bot and worker in Postgres
+#   (telegram_update_state), flushed every few seconds; after a restart ids at
+#   or below the lowest live worker's mark are rejected. A worker's mark trails
+#   its newest claim by DEDUP_MARK_LAG seconds, so lower ids still arriving out
+#   of order on concurrent webhook connections are not lost on a restart.
+# - With a distributed SHARED_STATE_BACKEND, claims are also made there, so
+#   workers/nodes agree even while the hash ring is being changed.
+
+DEDUP_WINDOW = int(os.environ.get("DEDUP_WINDOW", 20000))
+DEDUP_FLUSH_INTERVAL = float(os.environ.get("DEDUP_FLUSH_INTERVAL", 2.0))
+DEDUP_SHARED_TTL = int(os.environ.get("DEDUP_SHARED_TTL", 24 * 3600))
+DEDUP_MARK_LAG = float(os.environ.get("DEDUP_MARK_LAG", 60.0))
+TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN") or ""
+
+
+class UpdateDeduplicator:
+    def __init__(self, bot_id=None, node_id=None, window=DEDUP_WINDOW, lag=DEDUP_MARK_LAG):
+        self.bot_id = bot_id or TELEGRAM_BOT_TOKEN.split(":")[0] or "default"
+        # Set by the cluster launcher before import; '' for a single process
+        self.node_id = os.environ.get("CLUSTER_NODE_ID", "") if node_id is None else node_id
+        self.window = window
+        self.lag = lag
+        self.floor = 0                 # durable mark loaded at startup
+        self.max_claimed = 0
+        self.settled = 0               # max_claimed as of `lag` seconds ago
+        self._claim_marks = deque()    # (monotonic time, max_claimed) not yet settled
+        self._recent = OrderedDict()   # claimed update_ids, oldest first
+        self._deferred = set()         # ids we answered 429 for (Telegram will retry)
+        self._flushed = 0
+        self._task = None
+        self._loaded = None            # set once the durable mark is known
+
+        # Metrics
+        self.claimed = 0
+        self.duplicates = 0
+        self.not_ready = 0             # updates turned away (429) during warm-up
+
+    # --- durable high-water mark ---
+
+    def expect_load(self):
+        """Hold off claims until load() (the server accepts connections before the DB is up)."""
+        if self._loaded is None:
+            self._loaded = asyncio.Event()
+
+    @property
+    def ready(self):
+        """False while the durable mark is still loading: callers answer 429 instead of waiting."""
+        return self._loaded is None or self._loaded.is_set()
+
+    def _release_waiters(self):
+        # Claims never wait on a load that is not going to happen
+        if self._loaded is not None:
+            self._loaded.set()
+
+    async def load(self):
+        """
+        Floor = lowest mark among this worker and the workers that flushed
+        recently: another worker's deferred or in-flight ids may sit below ours.
+        """
+        try:
+            async with get_db_connection() as conn:
+                floor, own = await conn.fetchrow("""
+                    SELECT min(high_water), max(high_water) FILTER (WHERE node_id = $2)
+                    FROM telegram_update_state
+                    WHERE bot_id = $1
+                      AND (node_id = $2 OR updated_at > now() - make_interval(secs => $3))
+                """, self.bot_id, self.node_id, float(DEDUP_SHARED_TTL))
+            self.floor = floor or 0
+            self._flushed = own or 0
+            print(f"✅ Update Dedup Ready (high-water mark {self.floor})")
+        except Exception as e:
+            print(f"❌ Update Dedup Load Error: {e}")
+        finally:
+            self._release_waiters()
+
+    def _settle(self, now):
+        """Advance `settled` past claims older than the lag."""
+        while self._claim_marks and now - self._claim_marks[0][0] >= self.lag:
+            self.settled = self._claim_marks.popleft()[1]
+
+    def high_water(self):
+        """
+        Highest id that is safe to persist: our claims as of `lag` seconds ago
+        (a lower id may still be on its way), and never past an update we
+        deferred (429), or its retry would be rejected after a restart.
+        """
+        self._settle(time.monotonic())
+        mark = self.settled
+        # A deferred update that never came back must not pin the mark forever
+        self._deferred = {d for d in self._deferred if d > mark - self.window}
+        if self._deferred:
+            mark = min(mark, min(self._deferred) - 1)
+        return mark
+
+    async def flush(self):
+        mark = self.high_water()
+        if mark <= self._flushed:
+            return
+        try:
+            async with get_db_connection() as conn:
+                # One row per worker: only this worker's own claims move its mark
+                await conn.execute("""
+                    INSERT INTO telegram_update_state (bot_id, node_id, high_water, updated_at)
+                    VALUES ($1, $2, $3, now())
+                    ON CONFLICT (bot_id, node_id) DO UPDATE SET
+                        high_water = GREATEST(telegram_update_state.high_water, EXCLUDED.high_water),
+                        updated_at = now()
+                """, self.bot_id, self.node_id, mark)
+            self._flushed = mark
+        except Exception as e:
+            print(f"❌ Update Dedup Flush Error: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(DEDUP_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def start(self):
+        if self._task:
+            return
+        await self.load()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        self._release_waiters()
+        if not self._task:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.flush()
+
+    # --- claims ---
+
+    def _remember(self, update_id):
+        self._recent[update_id] = None
+        while len(self._recent) > self.window:
+            self._recent.popitem(last=False)
+
+    def is_duplicate(self, update_id):
+        return update_id <= self.floor or update_id in self._recent
+
+    async def claim(self, update_id):
+        """True if this update is new and now ours to process; False for a duplicate (check `ready` first)."""
+        if self.is_duplicate(update_id):
+            self.duplicates += 1
+            return False
+        # Claimed before any await, so a concurrent retry sees it
+        self._remember(update_id)
+
+        if shared_state.distributed:
+            try:
+                if not await shared_state.add(f"update:{self.bot_id}:{update_id}", ttl=DEDUP_SHARED_TTL):
+                    self.duplicates += 1
+                    return False
+            except Exception as e:
+                print(f"⚠️ Shared dedup unavailable ({e}), using local window only")
+
+        self._deferred.discard(update_id)
+        if update_id > self.max_claimed:
+            self.max_claimed = update_id
+            self._claim_marks.append((time.monotonic(), update_id))
+        self.claimed += 1
+        return True
+
+    async def release(self, update_id):
+        """Undo a claim when the update couldn't be queued (we answered 429)."""
+        self._recent.pop(update_id, None)
+        self._deferred.add(update_id)
+        if len(self._deferred) > self.window:
+            self._deferred.discard(min(self._deferred))
+        self.claimed -= 1
+        if shared_state.distributed:
+            try:
+                await shared_state.delete(f"update:{self.bot_id}:{update_id}")
+            except Exception as e:
+                print(f"⚠️ Shared dedup release failed: {e}")
+
+    def stats(self):
+        return {
+            "claimed": self.claimed,
+            "duplicates": self.duplicates,
+            "not_ready": self.not_ready,
+            "window": len(self._recent),
+            "high_water": self.high_water(),
+            "max_claimed": self.max_claimed,
+            "floor": self.floor,
+        }
+
+
+update_dedup = UpdateDeduplicator()
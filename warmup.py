@@ -0,0 +1,74 @@
+import time
+import asyncio
+
+# Background warm-up with a readiness flag.
+#
+# The server binds and starts accepting updates immediately; DB pool creation,
+# seeding, index and catalogue loading run here afterwards. Message handlers
+# wait on wait_ready(), and /ready reports progress, so a load balancer (or
+# Telegram's retries) simply waits while the process warms up.
+
+# Measured from when this module is first imported (≈ process start)
+PROCESS_STARTED = time.monotonic()
+
+
+class Warmup:
+    def __init__(self):
+        self.stages = []            # (name, seconds, error or None)
+        self.accepting_at = None    # seconds after process start
+        self.ready_at = None
+        self.current = None
+        self._ready = None
+        self._task = None
+
+    @property
+    def ready(self):
+        return self.ready_at is not None
+
+    def accepting(self):
+        """Call once the server can take updates (end of the fast startup path)."""
+        self.accepting_at = time.monotonic() - PROCESS_STARTED
+        print(f"✅ Accepting updates after {self.accepting_at:.2f}s")
+
+    def start(self, stages):
+        """Run [(name, async fn)] in order in the background. A failing stage is logged, not fatal."""
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run(stages))
+
+    async def _run(self, stages):
+        for name, fn in stages:
+            self.current = name
+            started = time.monotonic()
+            error = None
+            try:
+                await fn()
+            except Exception as e:
+                error = str(e)
+                print(f"❌ Warm-up '{name}' Error: {e}")
+            self.stages.append((name, round(time.monotonic() - started, 3), error))
+        self.current = None
+        self.ready_at = time.monotonic() - PROCESS_STARTED
+        self._ready.set()
+        slowest = max(self.stages, key=lambda s: s[1], default=None)
+        print(f"✅ Ready after {self.ready_at:.2f}s" + (f" (slowest: {slowest[0]} {slowest[1]:.2f}s)" if slowest else ""))
+
+    async def wait_ready(self):
+        if self._ready is not None and not self._ready.is_set():
+            await self._ready.wait()
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "stage": self.current,
+            "accepting_after_s": round(self.accepting_at, 3) if self.accepting_at is not None else None,
+            "ready_after_s": round(self.ready_at, 3) if self.ready_at is not None else None,
+            "stages": [{"name": n, "seconds": s, "error": e} for n, s, e in self.stages],
+        }
+
+
+warmup = Warmup()